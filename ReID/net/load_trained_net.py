@@ -2,10 +2,12 @@ import torch
 from .resnet import resnet18, resnet34, resnet50, resnet101, resnet152
 import torch.nn as nn
 from .utils import weights_init_kaiming, weights_init_classifier
+from .quantization import load_quantized
 
 
 def load_net(nb_classes, net_type, neck=0, pretrained_path=None, red=1,
-             add_distractors=False, pool='avg'):
+             add_distractors=False, pool='avg', precision='fp32',
+             quantized_path=None):
 
     # initialize network
     if net_type == 'resnet18':
@@ -64,4 +66,11 @@ def load_net(nb_classes, net_type, neck=0, pretrained_path=None, red=1,
     else:
         optimizer_state_dict = None
 
+    # INT8 encoder for CPU inference, see tools/quantize_encoder.py
+    if precision == 'int8':
+        model = load_quantized(model, quantized_path)
+        optimizer_state_dict = None
+    elif precision != 'fp32':
+        raise ValueError(f"Unknown encoder precision {precision}")
+
     return model, sz_embed, optimizer_state_dict
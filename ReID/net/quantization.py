@@ -0,0 +1,97 @@
+import copy
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+class EmbeddingTrunk(nn.Module):
+    """
+    fc7 embeddings of ResNetInference, the part of the encoder that is
+    quantized
+    """
+    def __init__(self, model):
+        super(EmbeddingTrunk, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.features(x)
+
+
+class QuantizedResNet(nn.Module):
+    """
+    Post-training static INT8 quantization of the ResNet encoder for CPU
+    inference. The BatchNorm folded trunk up to fc7 (and red) is
+    quantized with FX graph mode quantization, the neck stays in fp32.
+    Workflow:
+        quantized = QuantizedResNet(model)
+        for crops in calibration_batches:
+            quantized.calibrate(crops)
+        quantized.convert()
+    Inputs on other devices are moved to CPU, outputs are moved back.
+    Same outputs as ResNet, the logits are None.
+    """
+    def __init__(self, model, backend='x86', sz_crop=(384, 128)):
+        super(QuantizedResNet, self).__init__()
+        self.backend = backend
+        torch.backends.quantized.engine = backend
+
+        model = copy.deepcopy(model).cpu().eval()
+        self.trunk = prepare_fx(
+            EmbeddingTrunk(model.inference_model(channels_last=False)),
+            get_default_qconfig_mapping(backend),
+            (torch.zeros(1, 3, *sz_crop),))
+        self.bottleneck = model.bottleneck if model.neck else None
+        self.converted = False
+        self.eval()
+
+    def calibrate(self, x):
+        """
+        Collect activation ranges of a batch of crops
+        """
+        if self.converted:
+            raise RuntimeError("Encoder is already quantized")
+        with torch.no_grad():
+            self.trunk(x.cpu())
+
+    def convert(self):
+        """
+        Quantize weights and activations with the collected ranges
+        """
+        self.trunk = convert_fx(self.trunk)
+        self.converted = True
+
+    def forward(self, x, output_option='norm', val=False):
+        fc7 = self.trunk(x.cpu())
+
+        if output_option == 'plain':
+            fc7 = F.normalize(fc7, p=2, dim=1)
+        elif output_option == 'neck' and self.bottleneck is not None:
+            fc7 = self.bottleneck(fc7)
+        return None, fc7.to(x.device)
+
+
+def save_quantized(model, path):
+    """
+    Store quantized encoder
+    """
+    torch.save({
+        'backend': model.backend,
+        'model_state_dict': model.state_dict()}, path)
+
+
+def load_quantized(model, path):
+    """
+    Load quantized encoder stored with save_quantized, model is the fp32
+    ResNet of the same architecture
+    """
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    quantized = QuantizedResNet(model, backend=checkpoint['backend'])
+    with warnings.catch_warnings():
+        # ranges are loaded from the checkpoint
+        warnings.simplefilter('ignore')
+        quantized.convert()
+    quantized.load_state_dict(checkpoint['model_state_dict'])
+    return quantized.eval()
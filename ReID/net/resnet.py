@@ -1,4 +1,5 @@
 from operator import add
+import copy
 import torch
 import torch.nn as nn
 from torch.utils.model_zoo import load_url as load_state_dict_from_url
@@ -263,27 +264,24 @@ class ResNet(nn.Module):
         return custom_forward
 
     def _forward(self, x, output_option='norm', val=False):
-        val = torch.tensor(val)
-
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
         x = self.maxpool(x)
-        
-        # if you dont want to use gradient checkpointing: uncomment first lines, comment second
 
-        #x = self.layer1(x, val)
-        x = checkpoint.checkpoint(self.layer1, x, val)
-        
-        #x = self.layer2(x, val)
-        x = checkpoint.checkpoint(self.layer2, x, val)
-        
-        #x = self.layer3(x, val)
-        x = checkpoint.checkpoint(self.layer3, x, val)
-        
-        #x = self.layer4(x, val)
-        last_feature_map = checkpoint.checkpoint(self.layer4, x, val)
-         
+        # gradient checkpointing only saves memory if gradients are needed
+        if torch.is_grad_enabled():
+            val = torch.tensor(val)
+            x = checkpoint.checkpoint(self.layer1, x, val)
+            x = checkpoint.checkpoint(self.layer2, x, val)
+            x = checkpoint.checkpoint(self.layer3, x, val)
+            last_feature_map = checkpoint.checkpoint(self.layer4, x, val)
+        else:
+            x = self.layer1(x)
+            x = self.layer2(x)
+            x = self.layer3(x)
+            last_feature_map = self.layer4(x)
+ 
         x = self.avgpool(last_feature_map)
 
         fc7 = torch.flatten(x, 1)
@@ -327,6 +325,108 @@ class ResNet(nn.Module):
     # Allow for accessing forward method in a inherited class
     forward = _forward
 
+    def weights_version(self):
+        """
+        Counter that increases with every in-place change of parameters
+        and buffers (optimizer steps, BatchNorm statistics, loading)
+        """
+        return sum(t._version for t in
+                   list(self.parameters()) + list(self.buffers()))
+
+    def inference_model(self, channels_last=True):
+        """
+        Copy of the network for inference of embeddings, see
+        ResNetInference
+        """
+        return ResNetInference(self, channels_last=channels_last)
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    Convolution with the BatchNorm (eval mode statistics) that follows it
+    folded into weight and bias
+    """
+    fused = copy.deepcopy(conv)
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        bias = conv.bias if conv.bias is not None else \
+            torch.zeros_like(bn.running_mean)
+        fused.weight = nn.Parameter(
+            conv.weight * scale.reshape(-1, 1, 1, 1), requires_grad=False)
+        fused.bias = nn.Parameter(
+            (bias - bn.running_mean) * scale + bn.bias, requires_grad=False)
+    return fused
+
+
+def fuse_block(block):
+    """
+    Copy of BasicBlock or Bottleneck with all BatchNorms folded into the
+    convolutions before them
+    """
+    block = copy.deepcopy(block)
+    for i in [1, 2, 3]:
+        if hasattr(block, f'conv{i}'):
+            setattr(block, f'conv{i}', fuse_conv_bn(
+                getattr(block, f'conv{i}'), getattr(block, f'bn{i}')))
+            setattr(block, f'bn{i}', nn.Identity())
+    if block.downsample is not None:
+        block.downsample = nn.Sequential(
+            fuse_conv_bn(block.downsample[0], block.downsample[1]))
+    return block
+
+
+class ResNetInference(nn.Module):
+    """
+    Inference path of ResNet for tracking: no gradient checkpointing,
+    BatchNorms folded into convolutions, optionally channels_last memory
+    layout, and only the embedding branch (fc7, red and neck), the fc and
+    fc_person heads are skipped. Same outputs as ResNet in eval mode, the
+    logits are None. Built from the current weights, the copy has to be
+    rebuilt if the weights or BatchNorm statistics of ResNet change.
+    """
+    def __init__(self, model, channels_last=True):
+        super(ResNetInference, self).__init__()
+        self.channels_last = channels_last
+        self.conv1 = fuse_conv_bn(model.conv1, model.bn1)
+        self.relu = nn.ReLU(inplace=True)
+        self.maxpool = model.maxpool
+        self.layers = nn.Sequential(*[
+            fuse_block(block) for layer in [
+                model.layer1, model.layer2, model.layer3, model.layer4]
+            for block in layer])
+        self.avgpool = model.avgpool
+        self.red = copy.deepcopy(model.red)
+        self.bottleneck = copy.deepcopy(model.bottleneck) if model.neck \
+            else None
+        self.eval()
+        for p in self.parameters():
+            p.requires_grad_(False)
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    def features(self, x):
+        """
+        fc7 embeddings (after red)
+        """
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        x = self.maxpool(self.relu(self.conv1(x)))
+        x = self.layers(x)
+        fc7 = torch.flatten(self.avgpool(x), 1)
+
+        if self.red is not None:
+            fc7 = self.red(fc7)
+        return fc7
+
+    def forward(self, x, output_option='norm'):
+        fc7 = self.features(x)
+
+        if output_option == 'plain':
+            return None, F.normalize(fc7, p=2, dim=1)
+        elif output_option == 'neck' and self.bottleneck is not None:
+            return None, self.bottleneck(fc7)
+        return None, fc7
+
 
 def _resnet(arch, block, layers, pretrained, progress, neck=0,
             red=1, add_distractors=False, pool='avg', **kwargs):
@@ -0,0 +1,342 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from scipy.optimize import linear_sum_assignment as solve_dense
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components, \
+    min_weight_full_bipartite_matching
+
+
+def feasible_components(feasible):
+    """
+    Connected components of the bipartite graph of feasible pairs
+    (detections x tracks mask). Returns rows and cols of the components
+    that consist of a single feasible pair and list of (rows, cols) of
+    all larger components.
+    """
+    num_rows, num_cols = feasible.shape
+    r, c = np.nonzero(feasible)
+    if r.shape[0] == 0:
+        return (r, c), list()
+
+    graph = coo_matrix(
+        (np.ones(r.shape[0], dtype=np.int8), (r, num_rows + c)),
+        shape=(num_rows + num_cols, num_rows + num_cols))
+    _, labels = connected_components(graph, directed=False)
+
+    # components with one pair are assigned directly
+    pair_labels = labels[r]
+    single = np.bincount(pair_labels)[pair_labels] == 1
+    singles = (r[single], c[single])
+    r, c, pair_labels = r[~single], c[~single], pair_labels[~single]
+
+    # rows and cols of larger components, grouped by component
+    row_labels = np.full(num_rows, -1, dtype=np.int64)
+    col_labels = np.full(num_cols, -1, dtype=np.int64)
+    row_labels[r] = pair_labels
+    col_labels[c] = labels[num_rows + c]
+    rows = np.nonzero(row_labels >= 0)[0]
+    cols = np.nonzero(col_labels >= 0)[0]
+    rows = rows[np.argsort(row_labels[rows], kind='stable')]
+    cols = cols[np.argsort(col_labels[cols], kind='stable')]
+    _, row_starts = np.unique(row_labels[rows], return_index=True)
+    _, col_starts = np.unique(col_labels[cols], return_index=True)
+    blocks = list(zip(np.split(rows, row_starts[1:]),
+                      np.split(cols, col_starts[1:]))) if rows.shape[0] \
+        else list()
+
+    return singles, blocks
+
+
+def label_blocks(row_labels, col_labels):
+    """
+    Rows and cols of every label that occurs in rows and cols, e.g.,
+    detections and tracks of the same class. Pairs of different labels
+    are never assigned.
+    """
+    row_labels = np.asarray(row_labels)
+    col_labels = np.asarray(col_labels)
+    blocks = list()
+    for label in np.unique(row_labels):
+        cols = np.nonzero(col_labels == label)[0]
+        if cols.shape[0]:
+            blocks.append((np.nonzero(row_labels == label)[0], cols))
+    return blocks
+
+
+def restrict_blocks(blocks, rows=None, cols=None):
+    """
+    Blocks of the sub problem of given rows and cols (sorted indices),
+    indices of returned blocks refer to the sub problem
+    """
+    if blocks is None:
+        return None
+    sub = list()
+    for r, c in blocks:
+        if rows is not None:
+            r = np.nonzero(np.isin(rows, r))[0]
+        if cols is not None:
+            c = np.nonzero(np.isin(cols, c))[0]
+        if r.shape[0] and c.shape[0]:
+            sub.append((r, c))
+    return sub
+
+
+class LAPSolver(ABC):
+    """
+    Interface of assignment solver backends. solve returns the maximum
+    number of feasible pairs of a detections x tracks cost matrix at
+    minimum cost, pairs that are not feasible are never returned.
+    col_ids are the track ids of the columns, used by solvers that keep
+    a state over frames.
+    """
+    name = None
+
+    @abstractmethod
+    def solve(self, dist, feasible, col_ids=None):
+        pass
+
+    def reset(self):
+        """
+        Reset state between sequences
+        """
+        pass
+
+
+class DenseSolver(LAPSolver):
+    """
+    Shortest augmenting path solver of scipy (Jonker-Volgenant like),
+    infeasible pairs get the same large cost
+    """
+    name = 'scipy'
+
+    def __init__(self, large_value=1e6):
+        self.large_value = large_value
+
+    def solve(self, dist, feasible, col_ids=None):
+        if dist.shape[0] == 1 or dist.shape[1] == 1:
+            # only one pair can be assigned
+            i = np.argmin(np.where(feasible, dist, np.inf))
+            row, col = np.unravel_index(i, dist.shape)
+            return np.array([row]), np.array([col])
+
+        row, col = solve_dense(np.where(feasible, dist, self.large_value))
+        keep = feasible[row, col]
+        return row[keep], col[keep]
+
+
+class LapJVSolver(DenseSolver):
+    """
+    Jonker-Volgenant solver of the lap package (pip install lap)
+    """
+    name = 'lapjv'
+
+    def __init__(self, large_value=1e6):
+        super().__init__(large_value)
+        import lap
+        self.lapjv = lap.lapjv
+
+    def solve(self, dist, feasible, col_ids=None):
+        _, x, _ = self.lapjv(
+            np.where(feasible, dist, self.large_value).astype(np.float64),
+            extend_cost=True)
+        row = np.nonzero(x >= 0)[0]
+        col = x[row]
+        keep = feasible[row, col]
+        return row[keep], col[keep]
+
+
+class LapsolverSolver(LAPSolver):
+    """
+    Dense solver of the lapsolver package (pip install lapsolver),
+    infeasible pairs are nan
+    """
+    name = 'lapsolver'
+
+    def __init__(self):
+        from lapsolver import solve_dense as lapsolver_dense
+        self.solve_dense = lapsolver_dense
+
+    def solve(self, dist, feasible, col_ids=None):
+        row, col = self.solve_dense(np.where(feasible, dist, np.nan))
+        return np.asarray(row, dtype=np.int64), np.asarray(col, dtype=np.int64)
+
+
+class SparseSolver(LAPSolver):
+    """
+    Sparse solver of scipy (LAPJVsp) on the feasible pairs only. Every
+    row gets a private dummy column with a large cost, which always
+    allows a full matching of the rows.
+    """
+    name = 'sparse'
+
+    def __init__(self, large_value=1e6):
+        self.large_value = large_value
+
+    def solve(self, dist, feasible, col_ids=None):
+        num_rows, num_cols = dist.shape
+        r, c = np.nonzero(feasible)
+        # positive weights, explicit zeros are no edges
+        offset = 1 - min(dist[r, c].min(), 0) if r.shape[0] else 1
+        rows = np.concatenate([r, np.arange(num_rows)])
+        cols = np.concatenate([c, num_cols + np.arange(num_rows)])
+        weights = np.concatenate([
+            dist[r, c] + offset,
+            np.full(num_rows, self.large_value + offset)])
+        graph = csr_matrix(
+            (weights, (rows, cols)), shape=(num_rows, num_cols + num_rows))
+        row, col = min_weight_full_bipartite_matching(graph)
+        keep = col < num_cols
+        return row[keep], col[keep]
+
+
+class AuctionSolver(LAPSolver):
+    """
+    Forward auction algorithm (Bertsekas) with epsilon scaling on the
+    feasible pairs. The problem is made symmetric with a private dummy
+    track per detection and a dummy detection per track at a large cost
+    (and zero cost dummy pairs following the feasible pairs), so any
+    prices are a valid start. The large cost is just large enough to
+    prefer the maximum number of pairs, which bounds price wars of the
+    dummies. Prices of tracks relative to the cheapest track are kept over
+    frames and used as warm start, the auction then starts with a smaller
+    epsilon.
+    """
+    name = 'auction'
+
+    def __init__(self, eps_min=1e-6, eps_factor=0.1, eps_warm=1e-3):
+        self.eps_min = eps_min
+        self.eps_factor = eps_factor
+        self.eps_warm = eps_warm
+        self.prices = dict()
+
+    def reset(self):
+        self.prices = dict()
+
+    def solve(self, dist, feasible, col_ids=None):
+        num_rows, num_cols = dist.shape
+        r, c = np.nonzero(feasible)
+        if r.shape[0] == 0:
+            return r, c
+        num = num_rows + num_cols
+
+        # one more pair saves twice the large cost, which outweighs any
+        # change of the costs of the other pairs
+        cost = dist[r, c].astype(np.float64)
+        cost_range = cost.max() - cost.min() + 1
+        large_value = (min(num_rows, num_cols) + 1) * cost_range
+
+        # persons: detections, dummy detections of tracks
+        # objects: tracks, dummy tracks of detections
+        persons = np.concatenate([
+            r, np.arange(num_rows), num_rows + np.arange(num_cols),
+            num_rows + c])
+        objects = np.concatenate([
+            c, num_cols + np.arange(num_rows), np.arange(num_cols),
+            num_cols + r])
+        benefit = np.concatenate([
+            cost.min() - cost,
+            np.full(num, -large_value),
+            np.zeros(r.shape[0])])
+        order = np.argsort(persons, kind='stable')
+        objects, benefit = objects[order], benefit[order]
+        starts = np.searchsorted(persons[order], np.arange(num + 1))
+
+        # warm start with prices of tracks of last frame
+        prices = np.zeros(num)
+        warm = col_ids is not None and len(self.prices) > 0 and \
+            all(k in self.prices for k in col_ids)
+        if warm:
+            prices[:num_cols] = [self.prices[k] for k in col_ids]
+        eps = self.eps_warm * cost_range if warm else large_value / 2
+
+        while True:
+            owner = np.full(num, -1, dtype=np.int64)
+            assigned = np.full(num, -1, dtype=np.int64)
+            queue = list(range(num - 1, -1, -1))
+            while len(queue):
+                i = queue.pop()
+                objs = objects[starts[i]:starts[i + 1]]
+                values = benefit[starts[i]:starts[i + 1]] - prices[objs]
+                best = np.argmax(values)
+                v1 = values[best]
+                if values.shape[0] > 1:
+                    values[best] = -np.inf
+                    v2 = values.max()
+                else:
+                    v2 = v1 - large_value
+                j = objs[best]
+                prices[j] += v1 - v2 + eps
+                if owner[j] >= 0:
+                    assigned[owner[j]] = -1
+                    queue.append(owner[j])
+                owner[j] = i
+                assigned[i] = j
+
+            if eps <= self.eps_min:
+                break
+            eps = max(eps * self.eps_factor, self.eps_min)
+
+        if col_ids is not None:
+            # prices of unassigned tracks grow with the large cost
+            track_prices = prices[:num_cols] - prices[:num_cols].min()
+            self.prices.update(zip(col_ids, np.minimum(
+                track_prices, cost_range).tolist()))
+
+        row = np.nonzero(assigned[:num_rows] < num_cols)[0]
+        return row, assigned[row]
+
+
+solvers = {
+    s.name: s for s in
+    [DenseSolver, LapJVSolver, LapsolverSolver, SparseSolver, AuctionSolver]}
+
+
+def get_solver(name):
+    """
+    Get assignment solver backend by name, optional backends raise an
+    ImportError if their package is not installed
+    """
+    if name not in solvers:
+        raise ValueError(f"Unknown assignment solver {name}, "
+                         f"choose from {list(solvers.keys())}")
+    return solvers[name]()
+
+
+def solve_decomposed(dist, feasible, solver=None, col_ids=None, pool=None,
+                     min_parallel=10000, min_decompose=40000):
+    """
+    Solve the assignment of every connected component of feasible pairs
+    independently and merge the results, pairs that are not feasible are
+    never returned. Blocks with at least min_parallel entries are solved
+    in the thread pool if given. Problems with less than min_decompose
+    entries are solved as one block, which gives the same assignment.
+    """
+    solver = solver if solver is not None else DenseSolver()
+    col_ids = np.asarray(col_ids) if col_ids is not None else None
+    if dist.size < min_decompose:
+        if not feasible.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        row, col = solver.solve(dist, feasible, col_ids)
+        order = np.argsort(row, kind='stable')
+        return row[order], col[order]
+
+    singles, blocks = feasible_components(feasible)
+    results, futures = [singles], list()
+    for rows, cols in blocks:
+        sub = np.ix_(rows, cols)
+        ids = col_ids[cols] if col_ids is not None else None
+        if pool is not None and rows.shape[0] * cols.shape[0] >= min_parallel:
+            futures.append((rows, cols, pool.submit(
+                solver.solve, dist[sub], feasible[sub], ids)))
+        else:
+            row, col = solver.solve(dist[sub], feasible[sub], ids)
+            results.append((rows[row], cols[col]))
+    for rows, cols, future in futures:
+        row, col = future.result()
+        results.append((rows[row], cols[col]))
+
+    row = np.concatenate([r for r, _ in results])
+    col = np.concatenate([c for _, c in results])
+    order = np.argsort(row, kind='stable')
+
+    return row[order], col[order]
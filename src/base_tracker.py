@@ -12,11 +12,16 @@ import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import random
-from src.tracking_utils import get_center, get_height, get_width,\
-    make_pos, warp_pos, bbox_overlaps, is_moving, frame_rate, mot_fps, bisoftmax
-import cv2
+from src.tracking_utils import bbox_overlaps, is_moving, frame_rate, \
+    mot_fps, bisoftmax, cosine_distance, euclidean_distance, \
+    FeatureGallery, RetentionPolicy, ResultBuffer, MotionBuffer, TrackStore
+from concurrent.futures import ThreadPoolExecutor
 import copy
-from src.kalman import KalmanFilter
+from src.kalman import KalmanFilter, KalmanStore, chi2inv95
+from src.assignment import get_solver, label_blocks
+from src.camera_motion import CameraMotion
+from src.encoder_backend import get_backend
+from src.datasets.TrackingDataset import keep_dets
 
 
 logger = logging.getLogger('AllReIDTracker.BaseTracker')
@@ -30,12 +35,13 @@ class BaseTracker():
             net_type='resnet50',
             output='plain',
             data='tracktor_preprocessed_files.txt',
-            device='cpu'):
+            device='cpu',
+            embedding_cache=None,
+            backend_cfg=None):
 
         # initialize all variables
         self.kalman = tracker_cfg['kalman']
         if self.kalman:
-            self.shared_kalman = KalmanFilter()
             self.kalman_filter = KalmanFilter()
         else:
             self.kalman_filter = None
@@ -46,23 +52,70 @@ class BaseTracker():
 
         self.net_type = net_type
         self.encoder = encoder
+        # BatchNorm folded copy of encoder for eval mode, see get_encoder
+        self.inference_encoder = None
+        self.inference_version = None
+        self.embedding_cache = embedding_cache
 
         self.tracker_cfg = tracker_cfg
         self.motion_model_cfg = tracker_cfg['motion_config']
         self.output = output if not tracker_cfg['use_bism'] else 'norm'
 
+        # eager encoder or exported encoder (TorchScript, ONNX Runtime)
+        self.encoder_backend = get_backend(
+            backend_cfg, self.get_encoder, device)
+        if self.encoder_backend.name != 'eager' and self.encoder_changes():
+            raise ValueError(
+                "Exported encoders can not be updated while tracking, use "
+                "the eager backend for on the fly updates or BatchNorm "
+                "experiments")
+        # crops of later frames are encoded before the encoder is adapted
+        # to the current frame
+        if tracker_cfg['encoder_batching']['lookahead'] > 1 and \
+                self.encoder_changes():
+            raise ValueError(
+                "Encoder batching over frames can not be combined with on "
+                "the fly updates or BatchNorm experiments, set "
+                "encoder_batching lookahead to 1")
+        # lazy embeddings decide per frame which crops are encoded and
+        # need the motion model to find unambiguous matches
+        if tracker_cfg['lazy_embeddings']['do'] and (
+                self.encoder_changes() or embedding_cache is not None or
+                tracker_cfg['store_feats'] or
+                tracker_cfg['encoder_batching']['lookahead'] > 1 or
+                not self.motion_model_cfg['apply_motion_model']):
+            raise ValueError(
+                "Lazy embeddings need the motion model and can not be "
+                "combined with on the fly updates, BatchNorm experiments, "
+                "the embedding cache, stored features or encoder batching "
+                "over frames")
+        # detections, encoded crops, frames and encoder calls of lazy
+        # embeddings over all sequences
+        self.lazy_stats = defaultdict(int)
+
         self.inact_patience = tracker_cfg['inact_patience']
         self.act_reid_thresh = tracker_cfg['act_reid_thresh']
         self.inact_reid_thresh = tracker_cfg['inact_reid_thresh']
         self.output_dir = tracker_cfg['output_dir']
         self.nan_first = tracker_cfg['nan_first']
 
-        self.warp_mode_dct = {
-            'Translation': cv2.MOTION_TRANSLATION,
-            'Affine': cv2.MOTION_AFFINE,
-            'Euclidean': cv2.MOTION_EUCLIDEAN,
-            'Homography': cv2.MOTION_HOMOGRAPHY
-        }
+        # assignment solver backend and thread pool for large components
+        # of the assignment problem
+        self.lap_solver = get_solver(tracker_cfg['lap']['solver'])
+        self.lap_pool = ThreadPoolExecutor(
+            max_workers=tracker_cfg['lap']['threads']) \
+            if tracker_cfg['lap']['threads'] else None
+
+        # camera motion estimation for motion compensation
+        self.camera_motion = CameraMotion(
+            warp_mode=self.motion_model_cfg['warp_mode'],
+            estimator=self.motion_model_cfg['mc_estimator'],
+            pyramid_level=self.motion_model_cfg['mc_pyramid_level'],
+            num_iter=self.motion_model_cfg['num_iter_mc'],
+            termination_eps=self.motion_model_cfg['termination_eps_mc'],
+            max_features=self.motion_model_cfg['mc_max_features'],
+            cache_dir=self.motion_model_cfg['mc_cache_dir']) \
+            if self.motion_model_cfg['motion_compensation'] else None
 
         self.data = data
         # get experiment name
@@ -89,23 +142,134 @@ class BaseTracker():
 
         self.fps = mot_fps
 
-    def dist(self, x, y):
+    def dist(self, x, y, x_normalized=False, y_normalized=False):
         """
         Compute distance using cosine distance or euclidean
-        or utilize bisoftmax as diatnce measures
+        or utilize bisoftmax as diatnce measures. x and y can be
+        normalized before using normalize_feats.
         """
         if not self.tracker_cfg['use_bism']:
             if self.tracker_cfg['distance'] == 'cosine':
-                dist = 1 - \
-                    F.cosine_similarity(x[:, :, None], y.t()[None, :, :])
+                dist = cosine_distance(
+                    x, y, x_normalized, y_normalized,
+                    dtype=self.tracker_cfg['dist_dtype'])
             else:
-                dist = F.pairwise_distance(x[:, :, None], y.t()[None, :, :])
+                dist = euclidean_distance(
+                    x, y, dtype=self.tracker_cfg['dist_dtype'])
 
             return dist.cpu().numpy()
         else:
             dist = 1 - bisoftmax(x.cpu(), y.cpu())
             return dist.numpy()
 
+    def gated_dist(self, x, y, feasible, x_normalized=False,
+                   y_normalized=False, blocks=None):
+        """
+        Compute distances only for feasible pairs (detections x tracks
+        mask from gating), nan for all other pairs. Bisoftmax normalizes
+        over all pairs and is computed densely. If class blocks are given,
+        distances are only computed within every block.
+        """
+        if blocks is not None:
+            return self.blockwise(
+                lambda rows, cols: self.gated_dist(
+                    x[torch.from_numpy(rows).to(x.device)],
+                    y[torch.from_numpy(cols).to(y.device)],
+                    feasible[np.ix_(rows, cols)]
+                    if feasible is not None else None,
+                    x_normalized, y_normalized),
+                blocks, (x.shape[0], y.shape[0]))
+        if feasible is None:
+            return self.dist(x, y, x_normalized, y_normalized)
+        if self.tracker_cfg['use_bism']:
+            dist = self.dist(x, y, x_normalized, y_normalized)
+            dist[~feasible] = np.nan
+            return dist
+
+        dist = np.full(feasible.shape, np.nan, dtype=np.float32)
+        rows, cols = np.nonzero(feasible)
+        if rows.shape[0] == 0:
+            return dist
+        x = x[torch.from_numpy(rows).to(x.device)]
+        y = y[torch.from_numpy(cols).to(y.device)]
+        if self.tracker_cfg['distance'] == 'cosine':
+            if not x_normalized:
+                x = F.normalize(x, p=2, dim=1)
+            if not y_normalized:
+                y = F.normalize(y, p=2, dim=1)
+            d = 1 - (x * y).sum(dim=1)
+        else:
+            d = (x - y).norm(dim=1)
+        dist[rows, cols] = d.cpu().numpy()
+
+        return dist
+
+    def class_blocks(self, detections, curr_it):
+        """
+        Detections and active and inactive tracks of every class as
+        (rows, cols) of the detections x tracks matrix, None if all
+        detections and tracks are of the same class
+        """
+        labels = np.concatenate([
+            self.track_store.labels_of(self.tracks.keys()),
+            self.track_store.labels_of(curr_it.keys())])
+        if np.unique(np.concatenate([detections.label, labels])).shape[0] \
+                <= 1:
+            return None
+        return label_blocks(detections.label, labels)
+
+    def map_blocks(self, fn, blocks):
+        """
+        Evaluate fn(rows, cols) for every block, in the thread pool if
+        given
+        """
+        if self.lap_pool is not None and len(blocks) > 1:
+            return list(self.lap_pool.map(lambda b: fn(*b), blocks))
+        return [fn(*b) for b in blocks]
+
+    def blockwise(self, fn, blocks, shape, fill=np.nan, dtype=np.float32):
+        """
+        Matrix of given shape with the results of fn(rows, cols) at every
+        block and fill value at all other pairs
+        """
+        out = np.full(shape, fill, dtype=dtype)
+        for (rows, cols), d in zip(blocks, self.map_blocks(fn, blocks)):
+            out[np.ix_(rows, cols)] = d
+        return out
+
+    def gating(self, detections, curr_it):
+        """
+        Chi-square gating of detections with the kalman predictions of
+        active and inactive tracks, returns detections x tracks mask of
+        feasible pairs
+        """
+        boxes = detections.boxes.astype(np.float64)
+        width = boxes[:, 2] - boxes[:, 0]
+        height = boxes[:, 3] - boxes[:, 1]
+        measurements = np.stack([
+            boxes[:, 0] + width / 2,
+            boxes[:, 1] + height / 2,
+            width / height,
+            height], axis=1)
+
+        only_position = self.tracker_cfg['gating']['only_position']
+        maha = self.kalman_store.gating_distance(
+            list(self.tracks.keys()) + list(curr_it.keys()),
+            measurements,
+            only_position)
+
+        return maha.T <= chi2inv95[2 if only_position else 4]
+
+    def normalize_feats(self, x):
+        """
+        L2-normalize features once if used for several cosine distance
+        computations, returns if features are normalized
+        """
+        if not self.tracker_cfg['use_bism'] and \
+                self.tracker_cfg['distance'] == 'cosine':
+            return F.normalize(x, p=2, dim=1), True
+        return x, False
+
     def strfrac2float(self, x):
         """
         Convert number given as string to float
@@ -114,6 +278,23 @@ class BaseTracker():
             return x
         return float(x.split('/')[0]) / float(x.split('/')[-1])
 
+    def get_encoder(self):
+        """
+        Inference path of the encoder if it is in eval mode and provides
+        one (ResNet), rebuilt whenever weights or BatchNorm statistics of
+        the encoder changed, e.g., by BatchNorm experiments or on the fly
+        updates. Otherwise the encoder itself.
+        """
+        if self.encoder.training or \
+                not hasattr(self.encoder, 'inference_model'):
+            return self.encoder
+        version = self.encoder.weights_version()
+        if self.inference_encoder is None or \
+                version != self.inference_version:
+            self.inference_encoder = self.encoder.inference_model()
+            self.inference_version = version
+        return self.inference_encoder
+
     def get_features(self, frame):
         """
         Compute reid feature vectors
@@ -124,21 +305,58 @@ class BaseTracker():
                 feats = self.encoder(frame)
                 feats = F.normalize(feats, p=2, dim=1)
             else:
-                _, feats = self.encoder(frame, output_option=self.output)
+                feats = self.encoder_backend(frame, self.output)
 
         return feats
 
+    def use_embedding_cache(self, first=False):
+        """
+        Embeddings can only be cached if the encoder does not change
+        while tracking
+        """
+        if self.embedding_cache is None or first:
+            return False
+        return not self.encoder_changes()
+
+    def encoder_changes(self):
+        """
+        If the encoder changes while tracking, i.e., on the fly updates or
+        BatchNorm experiments
+        """
+        return any(self.tracker_cfg[k] for k in [
+            'on_the_fly', 'random_patches', 'random_patches_first',
+            'random_patches_several_frames', 'several_frames',
+            'running_mean_seq', 'running_mean_seq_reset', 'first_batch',
+            'first_batch_reset', 'every_frame_several_frames'])
+
+    def bn_stats_on_bbs(self):
+        """
+        If BatchNorm experiments update the statistics with the bbs of the
+        frames while tracking
+        """
+        return any(self.tracker_cfg[k] for k in [
+            'several_frames', 'running_mean_seq', 'running_mean_seq_reset',
+            'first_batch', 'first_batch_reset', 'every_frame_several_frames'])
+
+    def filter_detections(self, detections):
+        """
+        Detections with confidence >= det_conf and height / width <
+        h_w_thresh, only needed if the sequence loads all detections
+        """
+        if not self.bn_stats_on_bbs():
+            return detections
+        keep = keep_dets(
+            detections.boxes, detections.conf, self.tracker_cfg['det_conf'],
+            self.tracker_cfg['h_w_thresh'])
+        return detections.subset(np.nonzero(keep)[0])
+
     def make_results(self):
         """
         Get results dict: dictionary with 1 dictionary for every track:
             {..., i: [x1,y1,x2,y2,label], ...}
         i is track id
         """
-        results = defaultdict(dict)
-        for i, ts in self.tracks.items():
-            for im_index, bbox, label in zip(ts.past_im_indices, ts.bbox, ts.label):
-                results[i][im_index] = bbox.tolist() + [label]
-        return results
+        return self.results.tracks(self.tracks.keys())
 
     def _remove_short_tracks(self, all_tracks):
         """
@@ -243,6 +461,11 @@ class BaseTracker():
             else:
                 self.experiment += str(self.motion_model_cfg['combi'])
 
+        if self.tracker_cfg['lazy_embeddings']['do']:
+            lazy_cfg = self.tracker_cfg['lazy_embeddings']
+            self.experiment += 'Lazy:' + '_'.join(str(lazy_cfg[k]) for k in [
+                'min_iou', 'margin', 'refresh'])
+
         self.experiment = '_'.join([self.data[:-4],
                                     'OnTheFly:' +
                                     str(self.tracker_cfg['on_the_fly']),
@@ -461,9 +684,45 @@ class BaseTracker():
         # initialize track storage
         self.tracks = defaultdict(list)
         self.inactive_tracks = defaultdict(list)
+        # expired inactive tracks, min-heap of last seen frames of inactive
+        # tracks and number of tracks that became inactive
+        self.archived_tracks = dict()
+        self.expiry = list()
+        self.num_inactivated = 0
         self.mv_avg = dict()
         self.id = 0
 
+        # packed embeddings of all tracks, normalized once if cosine
+        self.gallery = FeatureGallery(
+            normalize=not self.tracker_cfg['use_bism'] and
+            self.tracker_cfg['distance'] == 'cosine')
+
+        # bounded track history and storage of output only fields
+        self.retention = RetentionPolicy(
+            motion_len=self.motion_model_cfg['last_n_frames'],
+            feats=self.tracker_cfg['retention']['feats'],
+            feats_sampling=self.tracker_cfg['retention']['feats_sampling'])
+        self.results = ResultBuffer()
+
+        # latest embeddings, labels, states and last seen frames and
+        # positions and velocities of all tracks for the motion model
+        self.track_store = TrackStore()
+        self.motion_buffer = MotionBuffer(
+            length=self.motion_model_cfg['last_n_frames'])
+        self.kalman_store = KalmanStore(self.kalman_filter) \
+            if self.kalman else None
+        # detections x tracks mask of feasible pairs if gated and
+        # detections and tracks of every class
+        self.feasible = None
+        self.blocks = None
+        self.lap_solver.reset()
+
+        # crops of current frame if embeddings are computed lazily and if
+        # tracks were moved by the motion model in the current frame
+        self.lazy_crops = None
+        self.seq_lazy_stats = defaultdict(int)
+        self.motion_stepped = False
+
         # set backbone into evaluation mode
         if not self.tracker_cfg['on_the_fly'] and not first:
             self.encoder.eval()
@@ -474,6 +733,21 @@ class BaseTracker():
         if seq is not None:
             seq.random_patches = self.tracker_cfg['random_patches'] or self.tracker_cfg[
                 'random_patches_first'] or self.tracker_cfg['random_patches_several_frames']
+            # whole image only needed for motion compensation if the
+            # camera motion is not cached
+            seq.load_img_for_det = False
+            if self.camera_motion is not None and not first and \
+                    is_moving(seq.name):
+                seq.load_img_for_det = not self.camera_motion.start(seq.name)
+            # only load detections that are used for tracking, all
+            # detections if feeding for bn stats update or if BatchNorm
+            # experiments use the bbs of the frames, those are filtered
+            # after the forward pass (see filter_detections)
+            if first or self.bn_stats_on_bbs():
+                seq.set_filter()
+            else:
+                seq.set_filter(self.tracker_cfg['det_conf'],
+                               self.tracker_cfg['h_w_thresh'])
 
         # get if sequence is moving and frame rate
         self.is_moving = is_moving(seq.name)
@@ -536,12 +810,12 @@ class BaseTracker():
         img = matplotlib.image.imread(path)
         figure, ax = plt.subplots(1)
         figure.set_size_inches(img.shape[1] / 100, img.shape[0] / 100)
-        for tr_id, d in zip(tr_ids, detections):
+        for j, tr_id in enumerate(tr_ids):
             if tr_id not in self.id_to_col.keys():
                 self.id_to_col[tr_id] = self.color_list[self.col]
                 self.col += 1
 
-            d = copy.deepcopy(d)
+            d = copy.deepcopy(detections.detection(j))
             d['bbox'][0] = max(d['bbox'][0], 0)
             d['bbox'][1] = max(d['bbox'][1], 0)
             d['bbox'][2] = min(d['bbox'][2], img.shape[1])
@@ -601,117 +875,54 @@ class BaseTracker():
         compensate ego motion for bounding boxes
         """
         # adapted from tracktor
-        # warp_matrix_nomr = norm of the transformation matrix.
-        self.warp_matrix_nomr = None
-        if im_index > 0:
-            # im1 = reference frame, im2 = frame to convert
-            # changed this from tracktor --> current img = reference
-            # convert images from the channel-first format (C=0, H=1, W=2) (common in PyTorch) 
-            # to the channel-last format (H=1, W=2, C=0) (expected by OpenCV functions) by (1, 2, 0):
-            im1 = np.transpose(whole_image.cpu().numpy(), (1, 2, 0)) 
-            im2 = np.transpose(self.last_image.cpu().numpy(), (1, 2, 0))
-            im1_gray = cv2.cvtColor(im1, cv2.COLOR_RGB2GRAY)
-            im2_gray = cv2.cvtColor(im2, cv2.COLOR_RGB2GRAY)
-            warp_matrix = np.eye(2, 3, dtype=np.float32)
-            criteria = (
-                cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT,
-                self.motion_model_cfg['num_iter_mc'],
-                self.motion_model_cfg['termination_eps_mc'])
-            # cv2.findTransformECC estimates the warp matrix that aligns im2_gray to im1_gray  
-            # using the Enhanced Correlation Coefficient (ECC) maximization algorithm.
-            _, warp_matrix = cv2.findTransformECC(
-                im1_gray, im2_gray, warp_matrix, self.warp_mode_dct[
-                    self.motion_model_cfg['warp_mode']], criteria, None, 15) #warp_mode: 'Euclidean' 
-            warp_matrix = torch.from_numpy(warp_matrix)
-            self.warp_matrix_nomr = np.linalg.norm(warp_matrix[:, -1]) # extracting the last column of transformation matrix, representing translation of coordinates
-            if self.is_moving and self.motion_model_cfg['motion_compensation']:
-                for tracks in [self.tracks, self.inactive_tracks]:
-                    for k, track in tracks.items():
-                        for i, pos in enumerate(track.last_pos):
-                            if isinstance(pos, torch.Tensor):
-                                pos = pos.cpu().numpy()
-                            pos = np.squeeze(
-                                warp_pos(np.atleast_2d(pos), warp_matrix))
-                            track.last_pos[i] = pos
-
-        self.last_image = whole_image
-
-    def motion_step(self, track):
-        """
-        Updates the given track's position by one step based on track.last_v
-        """
-        if self.motion_model_cfg['center_only']:
-            center_new = get_center(track.pos) + track.last_v
-            track.pos = make_pos(
-                *center_new,
-                get_width(track.pos),
-                get_height(track.pos))
-        else:
-            track.pos = track.pos + track.last_v
+        # camera motion is only compensated for moving cameras
+        if not self.is_moving:
+            return
+
+        # warp matrix from current frame (reference) to last frame,
+        # None for first frame
+        warp_matrix = self.camera_motion.estimate(whole_image, im_index)
+        if warp_matrix is None:
+            return
+
+        # warp stored positions of all tracks at once, only the linear
+        # motion model reads them
+        if self.motion_model_cfg['apply_motion_model'] and not self.kalman:
+            self.motion_buffer.warp(
+                list(self.tracks.keys()) + list(self.inactive_tracks.keys()),
+                warp_matrix)
 
     def motion(self, approximate=False):
         """
         Applies a simple linear motion model that considers the 
-        last n_steps steps.
+        last n_steps steps. Velocities of all active tracks are computed
+        in one pass over the motion buffer, inactive tracks are moved
+        with their last known velocity.
         """
         if self.i == 0:
             logger.info(f"Appriximating motion {approximate}...")
 
-        # update active tracks
-        for track in self.tracks.values():
-            if len(track.last_pos) > 1:
-                last_pos = np.asarray(
-                    track.last_pos[-self.motion_model_cfg['last_n_frames']:])# last_n_frames=90
-                frames = np.asarray(
-                    track.past_frames[-self.motion_model_cfg['last_n_frames']:])
-
-                # avg velocity between each pair of consecutive positions in
-                # t.last_pos
-                if self.motion_model_cfg['center_only']:# center_only=0
-                    if approximate:
-                        vs = np.stack([get_center(p2) - get_center(p1)
-                                       for p1, p2 in zip(last_pos, last_pos[1:])])
-                    else:
-                        dt = [p2 - p1 for p1, p2 in zip(frames, frames[1:])]
-                        vs = np.stack([(get_center(p2) - get_center(p1))/t
-                                       for p1, p2, t in zip(last_pos, last_pos[1:], dt)])
-
-                    track.update_v(vs.mean(axis=0))
-
-                    # motion step
-                    center_new = get_center(track.pos) + track.last_v
-                    track.pos = make_pos(
-                        *center_new,
-                        get_width(track.pos),
-                        get_height(track.pos))
-                else:
-                    if approximate:
-                        vs = [p2 - p1 for p1,
-                              p2 in zip(last_pos, last_pos[1:])]
-                    else:# np.repeat([4], axis=1) repeats the time differences of (N-1,1) to 4 columns, resulting in (N-1,4)
-                        # for (x, y,width,height per unit time) between consecutive frames.
-                        vs = (last_pos[1:, ]-last_pos[:-1, ])/np.repeat(
-                            np.expand_dims((frames[1:]-frames[:-1]), 1), [4], axis=1)
-                        # np.expand_dims((frames[1:] - frames[:-1]), 1) reshapes the 1D array of time differences to a 2D array of shape (N-1, 1).
-
-                    # motion stepß
-                    track.update_v(vs.mean(axis=0)) # updating past_vs and last_v
-                    track.pos = track.pos + track.last_v
-
-        # update for inactive tracks with last known dist
-        for track in self.inactive_tracks.values():
-            if len(track.last_pos) > 1:
-                self.motion_step(track)
-
-    def get_motion_dist(self, detections, curr_it):
+        self.motion_buffer.step(
+            self.tracks.keys(),
+            self.inactive_tracks.keys(),
+            center_only=self.motion_model_cfg['center_only'],
+            approximate=approximate)
+
+    def get_motion_dist(self, detections, curr_it, blocks=None):
         '''
-        Compute motion distance using IoU distance of bounding boxes
+        Compute motion distance using IoU distance of bounding boxes,
+        only within class blocks if given
         '''
-        act_pos = [track.pos for track in self.tracks.values()]
-        inact_pos = [track.pos for track in curr_it.values()]
-        pos = torch.from_numpy(np.asarray(act_pos + inact_pos))
-        det_pos = torch.from_numpy(np.asarray(
-            [t['bbox'] for t in detections]))
+        pos = torch.from_numpy(self.motion_buffer.positions(
+            list(self.tracks.keys()) + list(curr_it.keys())))
+        det_pos = torch.from_numpy(detections.boxes)
+        if blocks is not None:
+            return self.blockwise(
+                lambda rows, cols: 1 - bbox_overlaps(
+                    det_pos[torch.from_numpy(rows)],
+                    pos[torch.from_numpy(cols)]).numpy(),
+                blocks, (det_pos.shape[0], pos.shape[0]), fill=1,
+                dtype=np.float64)
         iou = bbox_overlaps(det_pos, pos)
         iou = 1 - iou
         return iou
@@ -740,8 +951,10 @@ class BaseTracker():
         """
         Store features for anaylsis
         """
-        detections_to_save = copy.deepcopy(detections)
-        for d in detections_to_save:
-            d['bbox'] = d['bbox'].tolist()
-            d['feats'] = d['feats'].tolist()
+        detections_to_save = list()
+        for j in range(len(detections)):
+            d = copy.deepcopy(detections.detection(j))
+            for k, v in d.items():
+                d[k] = v.tolist() if hasattr(v, 'tolist') else v
+            detections_to_save.append(d)
         self.features_[self.seq][self.frame_id] = detections_to_save
@@ -0,0 +1,232 @@
+import os
+import os.path as osp
+import json
+import hashlib
+import logging
+import numpy as np
+import cv2
+
+
+logger = logging.getLogger('AllReIDTracker.CameraMotion')
+
+
+warp_modes = {
+    'Translation': cv2.MOTION_TRANSLATION,
+    'Affine': cv2.MOTION_AFFINE,
+    'Euclidean': cv2.MOTION_EUCLIDEAN,
+    'Homography': cv2.MOTION_HOMOGRAPHY
+}
+
+
+def to_gray(image):
+    """
+    Grayscale float32 image of RGB image tensor (channels first)
+    """
+    image = np.transpose(image.cpu().numpy(), (1, 2, 0))
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def scale_warp(warp_matrix, scale):
+    """
+    Warp matrix estimated on images scaled by scale as warp matrix of
+    the full resolution images, i.e., S^-1 W S with S = diag(s, s, 1)
+    """
+    warp_matrix = warp_matrix.copy()
+    warp_matrix[:2, 2] /= scale
+    if warp_matrix.shape[0] == 3:
+        warp_matrix[2, :2] *= scale
+    return warp_matrix
+
+
+def rigid_warp(warp_matrix, pts, last_pts):
+    """
+    Rigid (Euclidean) warp of a similarity warp matrix fit to points, the
+    scale is removed from the rotation part and the translation is fit
+    again to the points with the rotation only
+    """
+    rotation = warp_matrix[:, :2] / np.hypot(
+        warp_matrix[0, 0], warp_matrix[1, 0])
+    translation = np.mean(last_pts - pts @ rotation.T, axis=0)
+    return np.concatenate([rotation, translation[:, None]], axis=1)
+
+
+class CameraMotion():
+    """
+    Estimation of the camera motion between consecutive frames of a
+    sequence as warp matrix (2x3, 3x3 for Homography) that maps
+    coordinates of the current frame to the previous frame:
+        * ecc: ECC maximization on the given level of the image pyramid
+          (image downscaled by 2 ** pyramid_level)
+        * sparse: Lucas-Kanade optical flow of corner features and robust
+          fit of the warp
+    The grayscale pyramid level of the previous frame is kept. If a
+    cache directory is given, the warp matrices of every sequence are
+    stored and used in later runs with the same parameters instead of
+    estimating them again (then images are not needed).
+    """
+    def __init__(
+            self,
+            warp_mode='Euclidean',
+            estimator='ecc',
+            pyramid_level=0,
+            num_iter=100,
+            termination_eps=1e-5,
+            max_features=500,
+            cache_dir=None):
+        if estimator not in ['ecc', 'sparse']:
+            raise ValueError(f"Unknown camera motion estimator {estimator}")
+        self.warp_mode = warp_mode
+        self.estimator = estimator
+        self.pyramid_level = pyramid_level
+        self.num_iter = num_iter
+        self.termination_eps = termination_eps
+        self.max_features = max_features
+        self.cache_dir = cache_dir if cache_dir else None
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.seq_name = None
+        self.last_gray = None
+        self.warps = dict()
+        self.cached = False
+
+    def key(self, seq_name):
+        """
+        Cache key of sequence, contains all estimation parameters
+        """
+        params = json.dumps({
+            'seq': seq_name,
+            'warp_mode': self.warp_mode,
+            'estimator': self.estimator,
+            'pyramid_level': self.pyramid_level,
+            'num_iter': self.num_iter,
+            'termination_eps': self.termination_eps,
+            'max_features': self.max_features,
+            # sparse Euclidean warps are rigid from version 2 on
+            'version': 2}, sort_keys=True)
+        return seq_name + '_' + \
+            hashlib.sha1(params.encode()).hexdigest()[:16] + '.npz'
+
+    def start(self, seq_name):
+        """
+        Start sequence, returns if warp matrices of all frames are cached
+        """
+        self.seq_name = seq_name
+        self.last_gray = None
+        self.warps = dict()
+        self.cached = False
+        if self.cache_dir is None:
+            return False
+
+        path = osp.join(self.cache_dir, self.key(seq_name))
+        if osp.isfile(path):
+            try:
+                data = np.load(path)
+                self.warps = dict(zip(data['frames'].tolist(),
+                                      data['warps']))
+                self.cached = True
+                logger.info(f"Using cached camera motion of {seq_name}")
+            except (ValueError, OSError, KeyError):
+                logger.info(f"Removing corrupted camera motion {path}")
+                os.remove(path)
+        return self.cached
+
+    def finish(self):
+        """
+        Store warp matrices of sequence in cache
+        """
+        if self.cache_dir is None or self.cached or not len(self.warps):
+            return
+        frames = sorted(self.warps.keys())
+        np.savez(
+            osp.join(self.cache_dir, self.key(self.seq_name)),
+            frames=np.asarray(frames, dtype=np.int64),
+            warps=np.stack([self.warps[f] for f in frames]))
+
+    def identity(self):
+        return np.eye(3 if self.warp_mode == 'Homography' else 2, 3,
+                      dtype=np.float32)
+
+    def estimate(self, image, frame):
+        """
+        Warp matrix from frame to previous frame, None for the first
+        frame of the sequence. image is the RGB image tensor of frame, it
+        is not used if the warp matrices are cached.
+        """
+        if self.cached:
+            return self.warps.get(frame)
+
+        gray = to_gray(image)
+        for _ in range(self.pyramid_level):
+            gray = cv2.pyrDown(gray)
+        if self.estimator == 'sparse':
+            gray = np.clip(gray * 255, 0, 255).astype(np.uint8)
+
+        last_gray, self.last_gray = self.last_gray, gray
+        if last_gray is None:
+            return None
+
+        if self.estimator == 'ecc':
+            warp_matrix = self.ecc(gray, last_gray)
+        else:
+            warp_matrix = self.sparse(gray, last_gray)
+        warp_matrix = scale_warp(warp_matrix, 0.5 ** self.pyramid_level)
+        self.warps[frame] = warp_matrix
+
+        return warp_matrix
+
+    def ecc(self, gray, last_gray):
+        """
+        ECC alignment of previous frame to current frame, identity if
+        ECC does not converge
+        """
+        criteria = (
+            cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT,
+            self.num_iter,
+            self.termination_eps)
+        try:
+            _, warp_matrix = cv2.findTransformECC(
+                gray, last_gray, self.identity(), warp_modes[self.warp_mode],
+                criteria, None, 15)
+        except cv2.error:
+            logger.debug(f"ECC did not converge in {self.seq_name}")
+            warp_matrix = self.identity()
+        return warp_matrix
+
+    def sparse(self, gray, last_gray):
+        """
+        Fit warp to optical flow of corners of the current frame to the
+        previous frame, identity if not enough corners are tracked
+        """
+        pts = cv2.goodFeaturesToTrack(
+            gray, self.max_features, qualityLevel=0.01, minDistance=8,
+            blockSize=3)
+        if pts is None or pts.shape[0] < 4:
+            return self.identity()
+        last_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+            gray, last_gray, pts, None)
+        status = status[:, 0] == 1
+        pts, last_pts = pts[status, 0], last_pts[status, 0]
+        if pts.shape[0] < 4:
+            return self.identity()
+
+        if self.warp_mode == 'Translation':
+            warp_matrix = self.identity()
+            warp_matrix[:, 2] = np.median(last_pts - pts, axis=0)
+            return warp_matrix
+        elif self.warp_mode == 'Euclidean':
+            # similarity fit without scale like MOTION_EUCLIDEAN of ECC
+            warp_matrix, inliers = cv2.estimateAffinePartial2D(
+                pts, last_pts)
+            if warp_matrix is not None:
+                inliers = inliers[:, 0] == 1
+                warp_matrix = rigid_warp(
+                    warp_matrix, pts[inliers], last_pts[inliers])
+        elif self.warp_mode == 'Affine':
+            warp_matrix, _ = cv2.estimateAffine2D(pts, last_pts)
+        else:
+            warp_matrix, _ = cv2.findHomography(pts, last_pts, cv2.RANSAC)
+
+        if warp_matrix is None:
+            return self.identity()
+        return warp_matrix.astype(np.float32)
@@ -5,6 +5,8 @@ from numpy.core.fromnumeric import shape
 import torch
 from .MOT17_parser import MOTLoader
 from .bdd100k_parser import BDDLoader
+from .detection_index import DetectionIndex, DetectionBatch
+from .crop_engine import CropEngine
 import pandas as pd
 import numpy as np
 import PIL.Image as Image
@@ -15,6 +17,8 @@ import random
 import torch.nn.functional as F
 import logging
 import copy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from torchvision.transforms import ToTensor
 from torchvision import transforms
 from ReID.data.utils import make_transform_bot, make_transfor_obj_det, make_transform_IBN
@@ -23,6 +27,21 @@ from ReID.data.utils import make_transform_bot, make_transfor_obj_det, make_tran
 logger = logging.getLogger('AllReIDTracker.TrackingDataset')
 
 
+def keep_dets(dets, conf, det_conf=None, h_w_thresh=None):
+    """
+    Mask of detections (bbs used for tracking) with confidence >= det_conf
+    and height / width < h_w_thresh, None = no threshold
+    """
+    keep = np.ones(dets.shape[0], dtype=bool)
+    if h_w_thresh is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            h_w = (dets[:, 3] - dets[:, 1]) / (dets[:, 2] - dets[:, 0])
+        keep &= h_w < h_w_thresh
+    if det_conf is not None:
+        keep &= conf >= det_conf
+    return keep
+
+
 class TrackingDataset():
     def __init__(
             self,
@@ -63,6 +82,14 @@ class TrackingDataset():
             self.transform = make_transform_bot(
                 is_train=False, sz_crop=dataset_cfg['sz_crop'])
 
+        # batched crop and resize of all bbs of a frame
+        if dataset_cfg['batched_crops'] and net_type != "IBN":
+            self.crop_engine = CropEngine(
+                sz_crop=dataset_cfg['sz_crop'],
+                fixed_aspect_ratio=dataset_cfg['fixed_aspect_ratio'])
+        else:
+            self.crop_engine = None
+
         self.process()
 
     def __len__(self):
@@ -104,6 +131,9 @@ class TrackingDataset():
                 corresponding_gt = None
                 gt = None
 
+            # frame indexed detection storage for fast per frame access
+            det_index = DetectionIndex(dets, dets_unclipped)
+
             self.data.append(Sequence(name=seq, dets=dets, gt=gt,
                                       to_pil=self.to_pil,
                                       to_tensor=self.to_tensor,
@@ -113,7 +143,11 @@ class TrackingDataset():
                                       corresponding_gt=corresponding_gt,
                                       transform_det=self.transform_det,
                                       fixed_aspect_ratio=self.dataset_cfg['fixed_aspect_ratio'],
-                                      net_type=self.net_type))
+                                      net_type=self.net_type,
+                                      det_index=det_index,
+                                      prefetch=self.dataset_cfg['prefetch_frames'],
+                                      prefetch_workers=self.dataset_cfg['prefetch_workers'],
+                                      crop_engine=self.crop_engine))
 
     def __getitem__(self, idx):
         """Return the ith sequence converted"""
@@ -138,10 +172,17 @@ class Sequence():
             transform_det=None,
             use_unclipped_for_eval=True,
             fixed_aspect_ratio=0,
-            net_type='resnet50'):
+            net_type='resnet50',
+            det_index=None,
+            prefetch=0,
+            prefetch_workers=1,
+            crop_engine=None):
         # detections and ground truth
         self.dets = dets
         self.dets_unclipped = dets_unclipped
+        if det_index is None:
+            det_index = DetectionIndex(dets, dets_unclipped)
+        self.det_index = det_index
         self.gt = gt
         self.corresponding_gt = corresponding_gt
         self.name = name
@@ -151,19 +192,34 @@ class Sequence():
         self.to_pil = to_pil
         self.to_tensor = to_tensor
         self.transform = transform
+        self.crop_engine = crop_engine
 
         # parameters
         self.device = dev
-        self.num_frames = len(self.dets['frame'].unique())
+        self.num_frames = len(self.det_index)
         self.padding = padding
         self.random_patches = False
         self.transform_det = transform_det
         self.use_unclipped_for_eval = use_unclipped_for_eval
         self.fixed_aspect_ratio = fixed_aspect_ratio
+        # whole image is only needed for motion compensation
+        self.load_img_for_det = True
+        # crops are not needed if embeddings are cached
+        self.load_crops = True
+        # detections kept after filtering by confidence and aspect ratio
+        self.keep = None
+        self.num_filtered = 0
+
+        # background loading of the next frames
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
+        self._pool = None
+        self._queue = deque()
 
         logger.info("Padding of images {}".format(self.padding))
         logger.info("Using unclipped detections for evaluation {}".format(
             use_unclipped_for_eval))
+        logger.info("Prefetching {} frames".format(self.prefetch))
 
     def _get_random_patches(self, img, height_max: int = 256,
                             height_min: int = 64, width_max: int = 256,
@@ -188,18 +244,15 @@ class Sequence():
 
         return torch.stack(patches, 0).to(self.device)
 
-    def pads(self, img, row_unclipped):
-        left_pad = abs(int(row_unclipped['bb_left'])) if int(
-            row_unclipped['bb_left']) < 0 else 0
-        right_pad = abs(
-            int(
-                row_unclipped['bb_right']) -
-            img.shape[2]) if int(
-            row_unclipped['bb_right']) > img.shape[2] else 0
-        top_pad = abs(int(row_unclipped['bb_top'])) if int(
-            row_unclipped['bb_top']) < 0 else 0
-        bot_pad = abs(int(row_unclipped['bb_bot']) - img.shape[1]
-                      ) if int(row_unclipped['bb_bot']) > img.shape[1] else 0
+    def pads(self, img, box_unclipped):
+        """
+        Get size of pads for unclipped box (bb_left, bb_top, bb_right, bb_bot)
+        """
+        left, top, right, bot = [int(b) for b in box_unclipped]
+        left_pad = abs(left) if left < 0 else 0
+        right_pad = abs(right - img.shape[2]) if right > img.shape[2] else 0
+        top_pad = abs(top) if top < 0 else 0
+        bot_pad = abs(bot - img.shape[1]) if bot > img.shape[1] else 0
 
         to_pad = sum([left_pad, right_pad, top_pad, bot_pad])
 
@@ -209,7 +262,7 @@ class Sequence():
             self,
             padding,
             im,
-            row_unclipped,
+            box_unclipped,
             left_pad,
             right_pad,
             top_pad,
@@ -217,11 +270,9 @@ class Sequence():
 
         # if keeping fixed aspect ratio
         if self.fixed_aspect_ratio:
-            w = row_unclipped['bb_right'] + right_pad - \
-                row_unclipped['bb_left'] - left_pad
+            w = box_unclipped[2] + right_pad - box_unclipped[0] - left_pad
             h_fixed = w * self.fixed_aspect_ratio
-            h = row_unclipped['bb_bot'] + bot_pad - \
-                row_unclipped['bb_top'] - top_pad
+            h = box_unclipped[3] + bot_pad - box_unclipped[1] - top_pad
             dh = h_fixed - h
             bot_pad += dh
             bot_pad = round(bot_pad)
@@ -263,32 +314,32 @@ class Sequence():
 
         return im
 
-    def get_fixed_ratio(self, img, row):
-        w = row['bb_right'] - row['bb_left']
+    def get_fixed_ratio(self, img, box):
+        box = box.copy()
+        w = box[2] - box[0]
         h_fixed = w * self.fixed_aspect_ratio
-        h = row['bb_bot'] - row['bb_top']
+        h = box[3] - box[1]
         dh = h_fixed - h
-        row['bb_bot'] += dh
+        box[3] += dh
 
-        im = img[:, int(row['bb_top']):int(row['bb_bot']), int(
-            row['bb_left']):int(row['bb_right'])]
+        im = img[:, int(box[1]):int(box[3]), int(box[0]):int(box[2])]
 
-        return im, row
+        return im, box
 
-    def _get_images(self, path, dets_frame, dets_uncl_frame, padding='zero'):
+    def _get_images(self, path, rows, padding='zero'):
+        # no need to decode image if embeddings are cached
+        if not (self.load_crops or self.load_img_for_det or
+                self.random_patches):
+            img = None
         # get image
-        if self.net_type == 'IBN':
+        elif self.net_type == 'IBN':
             img = Image.open(path)
             img = np.asarray(img)
             img = Image.fromarray(img)
             img = self.to_tensor(img)
         else:
             img = self.to_tensor(Image.open(path).convert("RGB"))
-        img_for_det = copy.deepcopy(img)
-
-        # initialize return lists
-        res, dets, ids, vis, areas_out, conf, label = \
-            list(), list(), list(), list(), list(), list(), list()
+        img_for_det = copy.deepcopy(img) if self.load_img_for_det else None
 
         # generate random patches if BatchNorm stats are updated with those
         if self.random_patches:
@@ -296,33 +347,115 @@ class Sequence():
         else:
             random_patches = None
 
-        # iterate over bbs in frame
-        for ind, row in dets_frame.iterrows():
-            # get unclipped detections and bb (im)
-            row_unclipped = dets_uncl_frame.loc[ind]
+        # clipped and unclipped bbs of frame from detection index
+        boxes = self.det_index.boxes[rows]
+
+        # crop, resize and normalize bbs
+        if not self.load_crops:
+            res = None
+        elif self.crop_engine is not None:
+            res = self.crop_engine(
+                img.to(self.device), boxes[:, :4], boxes[:, 4:], padding)
+        else:
+            res = self._get_crops(img, boxes, padding)
+
+        # detections with confidence, labels, tracktor ids / gt ids and
+        # visibility as aligned arrays
+        dets = DetectionBatch(
+            self.get_dets(boxes),
+            conf=self.det_index.conf[rows],
+            label=self.det_index.label[rows],
+            gt_id=self.det_index.ids[rows],
+            vis=self.det_index.vis[rows])
+
+        # different scaling of networks
+        # res= tensor containing all the ROIs (Regions of Interest) of detected objects in each video frame.
+        if res is not None:
+            if self.net_type == "IBN":
+                res = res * 255
+            res = res.to(self.device)
+
+        if img_for_det is not None:
+            img_for_det = img_for_det.to(self.device)
+
+        return res, dets, random_patches, img_for_det
+
+    def get_dets(self, boxes):
+        """
+        Bbs used for tracking and evaluation from clipped and unclipped bbs
+        """
+        if self.padding or self.use_unclipped_for_eval:
+            return boxes[:, 4:].astype(np.float32)
+
+        dets = boxes[:, :4].copy()
+        if self.fixed_aspect_ratio:
+            dets[:, 3] += (dets[:, 2] - dets[:, 0]) * \
+                self.fixed_aspect_ratio - (dets[:, 3] - dets[:, 1])
+        return dets.astype(np.float32)
+
+    def set_filter(self, det_conf=None, h_w_thresh=None):
+        """
+        Only load detections with confidence >= det_conf and
+        height / width < h_w_thresh, None = keep all detections
+        """
+        if det_conf is None and h_w_thresh is None:
+            self.keep = None
+            self.num_filtered = 0
+            return
+
+        keep = keep_dets(
+            self.get_dets(self.det_index.boxes), self.det_index.conf,
+            det_conf, h_w_thresh)
+
+        self.keep = keep
+        self.num_filtered = int((~keep).sum())
+        logger.info("Filtered {} of {} detections of {} (det_conf {}, "
+                    "h_w_thresh {})".format(
+                        self.num_filtered, keep.shape[0], self.name,
+                        det_conf, h_w_thresh))
+
+    def frame_rows(self, idx):
+        """
+        Rows of the detections of the idx-th frame that are kept
+        """
+        rows = self.det_index.rows(idx)
+        if self.keep is None:
+            return rows
+        return rows.start + np.nonzero(self.keep[rows])[0]
 
+    def _get_crops(self, img, boxes, padding='zero'):
+        """
+        Crop, pad and transform bbs one after another using PIL
+        """
+        # all detections of frame filtered
+        if boxes.shape[0] == 0:
+            return torch.empty(0)
+
+        res = list()
+
+        # iterate over bbs in frame
+        for box, box_unclipped in zip(boxes[:, :4], boxes[:, 4:]):
             # if padding get size of pads
             if self.padding:
                 left_pad, right_pad, top_pad, bot_pad, to_pad = \
-                    self.pads(img, row_unclipped)
+                    self.pads(img, box_unclipped)
             else:
                 left_pad, right_pad, top_pad, bot_pad, to_pad = \
                     0, 0, 0, 0, False
-        
+
             # if keep fixed aspect ratio if not padding
             if self.fixed_aspect_ratio and not (to_pad and self.padding):
-                im, row = self.get_fixed_ratio(img, row)
+                im, box = self.get_fixed_ratio(img, box)
             # get crop of image
             else:
-                im = img[:, int(row['bb_top']):int(row['bb_bot']), int(
-                    row['bb_left']):int(row['bb_right'])]
+                im = img[:, int(box[1]):int(box[3]), int(box[0]):int(box[2])]
 
             # pad if part of bb outside of image
             if self.padding and to_pad:
                 im = self.pad_bbs(
                     padding,
                     im,
-                    row_unclipped,
+                    box_unclipped,
                     left_pad,
                     right_pad,
                     top_pad,
@@ -330,64 +463,65 @@ class Sequence():
 
             # transform bb
             im = self.to_pil(im)
-            # im.save(f'{ind}.jpg')
-            im = self.transform(im)
-
-            # append to bbs, detections, tracktor ids, ids and visibility
-            res.append(im)
-            if self.padding or self.use_unclipped_for_eval:
-                dets.append(np.array([row_unclipped['bb_left'],
-                                      row_unclipped['bb_top'],
-                                      row_unclipped['bb_right'],
-                                      row_unclipped['bb_bot']],
-                                     dtype=np.float32))
-            else:
-                dets.append(np.array([row['bb_left'], row['bb_top'], row[
-                    'bb_right'], row['bb_bot']], dtype=np.float32))
-
-            ids.append(row['id'])
-            vis.append(row['vis'])
-            conf.append(row['conf'])
-            label.append(row['label'])
-
-        # different scaling of networks
-        # res= tensor containing all the ROIs (Regions of Interest) of detected objects in each video frame.
-        if self.net_type == "IBN":
-            res = torch.stack(res, 0) * 255
-        else:
-            res = torch.stack(res, 0)
-
-        res = res.to(self.device)
+            res.append(self.transform(im))
 
-        return res, dets, ids, vis, random_patches, img_for_det.to(
-            self.device), conf, label
+        return torch.stack(res, 0)
     
     def __len__(self):
         return self.num_frames
 
     def __iter__(self):
-        self.frames = self.dets['frame'].unique()
+        self.frames = self.det_index.frames
         self.i = 0
+
+        # start loading the first frames in the background
+        self._stop_prefetch()
+        if self.prefetch > 0:
+            self._pool = ThreadPoolExecutor(max_workers=self.prefetch_workers)
+            self._next_prefetch = 0
+            self._fill_queue()
         return self
 
     def __next__(self):
         # iterate over frames
         if self.i < self.num_frames:
-            out = self._get(self.i)
+            if self._pool is not None:
+                # futures are queued in frame order --> deterministic order
+                out = self._queue.popleft().result()
+                self._fill_queue()
+            else:
+                out = self._get(self.i)
             self.i += 1
             return out
         else:
+            self._stop_prefetch()
             raise StopIteration
 
-    def _get(self, idx):
-        frame = self.frames[idx]
-        dets_frame = self.dets[self.dets['frame'] == frame]
-        dets_uncl_frame = self.dets_unclipped[self.dets_unclipped['frame'] == frame]
+    def _fill_queue(self):
+        """
+        Keep up to self.prefetch frames loading in the background
+        """
+        while len(self._queue) < self.prefetch and \
+                self._next_prefetch < self.num_frames:
+            self._queue.append(
+                self._pool.submit(self._get, self._next_prefetch))
+            self._next_prefetch += 1
+
+    def _stop_prefetch(self):
+        """
+        Cancel pending frames, e.g., if iteration was stopped early
+        """
+        if self._pool is not None:
+            for future in self._queue:
+                future.cancel()
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._queue = deque()
 
-        assert len(dets_frame['frame_path'].unique()) == 1
+    def _get(self, idx):
+        rows = self.frame_rows(idx)
+        path = self.det_index.frame_paths[idx]
 
-        img, dets_f, ids, vis, random_patches, img_for_det, conf, label = self._get_images(
-            dets_frame['frame_path'].unique()[0], dets_frame, dets_uncl_frame)
+        img, dets, random_patches, img_for_det = self._get_images(path, rows)
 
-        return (img, dets_frame['frame_path'].unique(
-            )[0], dets_f, ids, vis, random_patches, img_for_det, conf, label)
+        return img, path, dets, random_patches, img_for_det
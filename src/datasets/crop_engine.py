@@ -0,0 +1,235 @@
+import torch
+import numpy as np
+import torch.nn.functional as F
+import logging
+
+
+logger = logging.getLogger('AllReIDTracker.CropEngine')
+
+
+class CropEngine():
+    """
+    Batched crop, resize and normalization of all bounding boxes of a
+    frame. Replaces the per bounding box crop --> pad --> to_pil -->
+    make_transform_bot round trip of Sequence by one bilinear resampling
+    (grid_sample) of the frame tensor per group of bbs.
+
+    Every bb covers an image region (crop + pads) that is resized to
+    sz_crop. Sampling positions are clamped to the crop and the bilinear
+    weight that falls on padded pixels is used to blend in the fill value,
+    which gives the same result as resizing the padded crop:
+        * zero, mean, channel_wise_mean: batched
+        * others like circular: bbs that need padding fall back to
+          per bb padding and interpolation on tensors
+    Bbs that are downscaled are supersampled to approximate the
+    antialiasing of PIL.
+    """
+    fill_modes = ('zero', 'mean', 'channel_wise_mean')
+
+    def __init__(
+            self,
+            sz_crop=[384, 128],
+            mean=[0.485, 0.456, 0.406],
+            std=[0.299, 0.224, 0.225],
+            padding=True,
+            fixed_aspect_ratio=0,
+            max_sampling=4):
+        self.sz_crop = tuple(sz_crop)
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1)
+        self.std = torch.tensor(std).view(1, 3, 1, 1)
+        self.padding = padding
+        self.fixed_aspect_ratio = fixed_aspect_ratio
+        self.max_sampling = max_sampling
+
+    def regions(self, img_size, boxes, boxes_unclipped):
+        """
+        Get integer image regions (x0, y0, x1, y1) covered by the crops
+        including pads, the crops before padding and the pads
+        (left, right, top, bot). Follows Sequence.pads, Sequence.pad_bbs
+        and Sequence.get_fixed_ratio.
+        """
+        height, width = img_size
+        clipped = np.trunc(boxes).astype(np.int64)
+        unclipped = np.trunc(boxes_unclipped).astype(np.int64)
+
+        # size of pads
+        if self.padding:
+            left_pad = np.where(unclipped[:, 0] < 0, -unclipped[:, 0], 0)
+            top_pad = np.where(unclipped[:, 1] < 0, -unclipped[:, 1], 0)
+            right_pad = np.where(
+                unclipped[:, 2] > width, unclipped[:, 2] - width, 0)
+            bot_pad = np.where(
+                unclipped[:, 3] > height, unclipped[:, 3] - height, 0)
+        else:
+            left_pad = top_pad = right_pad = bot_pad = \
+                np.zeros(boxes.shape[0], dtype=np.int64)
+        to_pad = (left_pad + right_pad + top_pad + bot_pad) > 0
+
+        crops = clipped.copy()
+        pads = np.stack([left_pad, right_pad, top_pad, bot_pad], axis=1)
+
+        if self.fixed_aspect_ratio:
+            # padded bbs: adapt bottom pad
+            w = boxes_unclipped[:, 2] + right_pad - \
+                boxes_unclipped[:, 0] - left_pad
+            h = boxes_unclipped[:, 3] + bot_pad - \
+                boxes_unclipped[:, 1] - top_pad
+            fixed_pad = np.round(
+                bot_pad + w * self.fixed_aspect_ratio - h).astype(np.int64)
+            pads[:, 3] = np.where(to_pad, fixed_pad, pads[:, 3])
+
+            # other bbs: adapt bottom of crop, limited by image
+            bot = boxes[:, 3] + (boxes[:, 2] - boxes[:, 0]) * \
+                self.fixed_aspect_ratio - (boxes[:, 3] - boxes[:, 1])
+            bot = np.minimum(np.trunc(bot).astype(np.int64), height)
+            crops[:, 3] = np.where(to_pad, crops[:, 3], bot)
+
+        regions = np.stack([
+            crops[:, 0] - pads[:, 0],
+            crops[:, 1] - pads[:, 2],
+            crops[:, 2] + pads[:, 1],
+            crops[:, 3] + pads[:, 3]], axis=1)
+
+        return regions, crops, pads, to_pad
+
+    def __call__(self, img, boxes, boxes_unclipped, padding='zero'):
+        """
+        img: 3xHxW image tensor in [0, 1]
+        boxes, boxes_unclipped: Nx4 arrays (bb_left, bb_top, bb_right,
+            bb_bot) of clipped and unclipped bbs
+        Returns Nx3xsz_crop normalized encoder input
+        """
+        num = boxes.shape[0]
+        if num == 0:
+            return img.new_zeros((0, 3) + self.sz_crop)
+
+        regions, crops, pads, to_pad = self.regions(
+            (img.shape[1], img.shape[2]), boxes, boxes_unclipped)
+
+        # fill value of padded area
+        fill = img.new_zeros((num, 3, 1, 1))
+        if padding in ('mean', 'channel_wise_mean'):
+            for i in np.nonzero(to_pad)[0]:
+                im = img[:, crops[i, 1]:crops[i, 3], crops[i, 0]:crops[i, 2]]
+                if padding == 'mean':
+                    fill[i] = im.mean()
+                else:
+                    fill[i] = im.mean(dim=(1, 2)).view(3, 1, 1)
+
+        # normalizing the frame once is cheaper than normalizing all crops,
+        # resampling and padding commute with it
+        mean, std = self.mean.to(img.device), self.std.to(img.device)
+        img = (img - mean[0]) / std[0]
+        fill = (fill - mean) / std
+
+        # padding modes without fill value are padded per bb
+        if padding in self.fill_modes:
+            batched = np.ones(num, dtype=bool)
+        else:
+            batched = ~to_pad
+
+        # group bbs by number of samples per output pixel
+        sizes = regions[:, 2:] - regions[:, :2]
+        sampling = np.ceil(sizes[:, ::-1] / np.array(self.sz_crop))
+        sampling = np.clip(sampling, 1, self.max_sampling).astype(np.int64)
+        groups = np.unique(sampling[batched], axis=0)
+
+        # all bbs in one group
+        if batched.all() and groups.shape[0] == 1:
+            return self._resample(img, regions, crops, fill, groups[0])
+
+        res = img.new_empty((num, 3) + self.sz_crop)
+        for s in groups:
+            idx = np.nonzero(batched & (sampling == s).all(axis=1))[0]
+            res[torch.from_numpy(idx).to(img.device)] = self._resample(
+                img, regions[idx], crops[idx], fill[idx], s)
+        for i in np.nonzero(~batched)[0]:
+            res[i] = self._crop_single(img, crops[i], pads[i], padding)
+
+        return res
+
+    def _coords(self, start, end, crop_start, crop_end, size, sampling):
+        """
+        Sampling positions along one axis of resizing the regions
+        [start, end) to size and weight of samples inside of the crops
+        """
+        scale = (end - start) / size
+        pos = (torch.arange(size * sampling, dtype=start.dtype,
+                            device=start.device) + 0.5) / sampling
+        x = start[:, None] + pos[None, :] * scale[:, None] - 0.5
+
+        # resizing the padded crop clamps at its border
+        x = torch.min(torch.max(x, start[:, None]), end[:, None] - 1)
+
+        # bilinear weight that falls on pixels outside of the crop
+        x_low = x.floor()
+        alpha = x - x_low
+        outside_low = (x_low < crop_start[:, None]) | \
+            (x_low >= crop_end[:, None])
+        outside_high = (x_low + 1 < crop_start[:, None]) | \
+            (x_low + 1 >= crop_end[:, None])
+        outside = (1 - alpha) * outside_low + alpha * outside_high
+
+        # only sample pixels of the crop
+        x = torch.min(torch.max(x, crop_start[:, None]), crop_end[:, None] - 1)
+
+        return x, 1 - outside
+
+    def _resample(self, img, regions, crops, fill, sampling):
+        """
+        Crop and resize all given regions with one grid_sample call
+        """
+        num = regions.shape[0]
+        height, width = img.shape[1], img.shape[2]
+        regions = torch.from_numpy(regions).to(img)
+        crops = torch.from_numpy(crops).to(img)
+        sy, sx = int(sampling[0]), int(sampling[1])
+
+        ys, inside_y = self._coords(regions[:, 1], regions[:, 3], crops[:, 1],
+                                    crops[:, 3], self.sz_crop[0], sy)
+        xs, inside_x = self._coords(regions[:, 0], regions[:, 2], crops[:, 0],
+                                    crops[:, 2], self.sz_crop[1], sx)
+
+        # normalized pixel positions for grid_sample, all bbs stacked along
+        # the height of one grid
+        grid = torch.stack([
+            ((xs + 0.5) / width * 2 - 1)[:, None, :].expand(
+                -1, ys.shape[1], -1),
+            ((ys + 0.5) / height * 2 - 1)[:, :, None].expand(
+                -1, -1, xs.shape[1])], dim=-1)
+        res = F.grid_sample(
+            img.unsqueeze(0),
+            grid.reshape(1, -1, xs.shape[1], 2),
+            mode='bilinear',
+            padding_mode='border',
+            align_corners=False)
+        res = res.view(3, num, ys.shape[1], xs.shape[1]).transpose(0, 1)
+
+        # blend fill value into padded area of bbs that need padding
+        padded = (inside_y < 1).any(dim=1) | (inside_x < 1).any(dim=1)
+        if padded.any():
+            idx = torch.nonzero(padded).squeeze(1)
+            inside = inside_y[idx, None, :, None] * inside_x[idx, None, None, :]
+            res[idx] = fill[idx] + inside * (res[idx] - fill[idx])
+
+        # average supersampled positions
+        if sy > 1 or sx > 1:
+            res = F.avg_pool2d(res, (sy, sx))
+
+        return res
+
+    def _crop_single(self, img, crop, pads, padding):
+        """
+        Pad a single bb using torch padding modes, e.g., circular
+        """
+        im = img[:, crop[1]:crop[3], crop[0]:crop[2]]
+        left_pad, right_pad, top_pad, bot_pad = [int(p) for p in pads]
+        left_pad = min(left_pad, im.shape[2] - 1)
+        right_pad = min(right_pad, im.shape[2] - 1)
+        top_pad = min(top_pad, im.shape[1] - 1)
+        bot_pad = min(bot_pad, im.shape[1] - 1)
+        im = F.pad(im.unsqueeze(0), (left_pad, right_pad, top_pad, bot_pad),
+                   padding)
+
+        return F.interpolate(im, size=self.sz_crop, mode='bilinear',
+                             align_corners=False, antialias=True)[0]
@@ -0,0 +1,117 @@
+import numpy as np
+import torch
+import logging
+
+
+logger = logging.getLogger('AllReIDTracker.DetectionIndex')
+
+
+class DetectionIndex():
+    """
+    Compact per sequence detection storage. The detections are kept as
+    contiguous NumPy columns sorted by frame together with per frame
+    offsets, i.e., all detections of the i-th frame are stored at
+    rows offsets[i]:offsets[i+1]. Clipped and unclipped bounding boxes
+    are stored side by side:
+        boxes[:, :4] = clipped (bb_left, bb_top, bb_right, bb_bot)
+        boxes[:, 4:] = unclipped (bb_left, bb_top, bb_right, bb_bot)
+    """
+    box_cols = ['bb_left', 'bb_top', 'bb_right', 'bb_bot']
+
+    def __init__(self, dets, dets_unclipped=None):
+        if dets_unclipped is None:
+            dets_unclipped = dets
+
+        # loaders already sort by frame, stable sort keeps order within frame
+        dets = dets.sort_values(by='frame', kind='stable')
+        dets_unclipped = dets_unclipped.loc[dets.index]
+
+        # frame numbers and offsets of detections of every frame
+        frame_col = dets['frame'].values
+        self.frames, starts = np.unique(frame_col, return_index=True)
+        self.offsets = np.append(starts, frame_col.shape[0]).astype(np.int64)
+
+        # clipped and unclipped boxes side by side
+        self.boxes = np.concatenate([
+            dets[self.box_cols].values.astype(np.float64),
+            dets_unclipped[self.box_cols].values.astype(np.float64)], axis=1)
+
+        # per detection meta information
+        self.ids = dets['id'].values
+        self.vis = dets['vis'].values
+        self.conf = dets['conf'].values
+        self.label = dets['label'].values
+        if 'detection_id' in dets.columns:
+            self.detection_id = dets['detection_id'].values
+        else:
+            self.detection_id = np.arange(dets.shape[0])
+
+        # one image per frame
+        frame_paths = dets['frame_path'].values
+        same_frame = frame_col[1:] == frame_col[:-1]
+        assert (frame_paths[1:][same_frame] ==
+                frame_paths[:-1][same_frame]).all()
+        self.frame_paths = frame_paths[starts].tolist()
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    @property
+    def num_dets(self):
+        return self.boxes.shape[0]
+
+    def rows(self, idx):
+        """
+        Slice of the detections of the idx-th frame
+        """
+        return slice(self.offsets[idx], self.offsets[idx + 1])
+
+
+class DetectionBatch():
+    """
+    Detections of one frame as aligned arrays: boxes (num_dets x 4,
+    min x, min y, max x, max y), confidences, labels, gt ids and
+    visibility. The embeddings (num_dets x dim tensor) and the frame are
+    set by the tracker. Subsets index all arrays at once.
+    """
+    def __init__(self, boxes, conf, label, gt_id, vis, feats=None,
+                 frame=None):
+        self.boxes = boxes
+        self.conf = conf
+        self.label = label
+        self.gt_id = gt_id
+        self.vis = vis
+        self.feats = feats
+        self.frame = frame
+
+    def __len__(self):
+        return self.boxes.shape[0]
+
+    def subset(self, rows):
+        """
+        Detections at rows (indices) as new batch
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        feats = None
+        if self.feats is not None:
+            feats = self.feats[torch.from_numpy(rows).to(self.feats.device)]
+        return DetectionBatch(
+            self.boxes[rows], self.conf[rows], self.label[rows],
+            self.gt_id[rows], self.vis[rows], feats, self.frame)
+
+    def detection(self, i):
+        """
+        Fields of the i-th detection as dict for visualization and stored
+        features, feats are None if the detection was not embedded. The
+        tracking loop reads the aligned arrays directly (see
+        Track.add_from_batch).
+        """
+        return {
+            'bbox': self.boxes[i],
+            'feats': self.feats[i] if self.feats is not None else None,
+            'im_index': self.frame,
+            'gt_id': self.gt_id[i],
+            'vis': self.vis[i],
+            'conf': self.conf[i],
+            'frame': self.frame,
+            'label': self.label[i]}
@@ -0,0 +1,259 @@
+import os
+import os.path as osp
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+import logging
+
+
+logger = logging.getLogger('AllReIDTracker.EmbeddingCache')
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """
+    SHA1 checksum of a file, e.g., of the ReID weights
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def state_dict_checksum(net):
+    """
+    SHA1 checksum of network parameters and buffers if no weight file
+    is given
+    """
+    sha = hashlib.sha1()
+    for k, v in net.state_dict().items():
+        sha.update(k.encode())
+        sha.update(v.detach().cpu().contiguous().numpy().tobytes())
+    return sha.hexdigest()
+
+
+class EmbeddingCache():
+    """
+    Persistent on disk storage of ReID embeddings of all detections of a
+    sequence. Every sequence is stored as one .npy array of shape
+    num_dets x dim (rows in order of the DetectionIndex) that is memory
+    mapped when read, a .valid.npy mask of rows that were computed (the
+    sequence might filter detections) and a .json file with meta
+    information.
+
+    The cache key contains everything the embeddings depend on:
+        * sequence name, det file and checksum of detections
+          (bbs and detection_id)
+        * checksum of the ReID weights
+        * crop config (sz_crop, padding, fixed aspect ratio, batched
+          crops), net_type and output option
+    Entries of other keys are never read, i.e., changing any of these
+    invalidates the cache. The least recently used entries are removed
+    if the cache gets larger than max_size_gb.
+    """
+    def __init__(
+            self,
+            cache_dir,
+            weights_checksum,
+            params,
+            dtype='float16',
+            max_size_gb=20):
+        self.cache_dir = cache_dir
+        self.weights_checksum = weights_checksum
+        self.params = params
+        self.dtype = np.dtype(dtype)
+        self.max_size = int(max_size_gb * 1024 ** 3)
+        self.hits, self.misses = 0, 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._writer = None
+
+    def key(self, seq):
+        """
+        Cache key of sequence
+        """
+        det_index = seq.det_index
+        sha = hashlib.sha1()
+        sha.update(np.ascontiguousarray(det_index.boxes).tobytes())
+        sha.update(np.ascontiguousarray(
+            det_index.detection_id).astype(np.int64).tobytes())
+
+        key = {
+            'seq': seq.name,
+            'dets': sha.hexdigest(),
+            'weights': self.weights_checksum,
+            'dtype': self.dtype.name}
+        key.update(self.params)
+        key = json.dumps(key, sort_keys=True)
+
+        return seq.name + '_' + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def _paths(self, key):
+        return osp.join(self.cache_dir, key + '.npy'), \
+            osp.join(self.cache_dir, key + '.valid.npy'), \
+            osp.join(self.cache_dir, key + '.json')
+
+    def _load(self, seq, key):
+        """
+        Load memory mapped embeddings and mask of computed rows of entry,
+        None if entry does not exist or is outdated
+        """
+        npy, valid, meta = self._paths(key)
+        if not all(osp.isfile(p) for p in [npy, valid, meta]):
+            return None, None
+
+        try:
+            with open(meta, 'r') as f:
+                meta_data = json.load(f)
+            embeddings = np.load(npy, mmap_mode='r')
+            valid = np.load(valid)
+        except (ValueError, OSError, json.JSONDecodeError):
+            logger.info(f"Removing corrupted cache entry {key}")
+            self.remove(key)
+            return None, None
+
+        # detections have to be the same in the same order
+        if embeddings.shape[0] != seq.det_index.num_dets or \
+                valid.shape[0] != seq.det_index.num_dets or \
+                meta_data['detection_id'] != self.ids_checksum(seq):
+            logger.info(f"Removing outdated cache entry {key}")
+            self.remove(key)
+            return None, None
+
+        return embeddings, valid
+
+    def lookup(self, seq):
+        """
+        Get memory mapped embeddings of sequence or None if not all
+        detections loaded by the sequence are cached
+        """
+        key = self.key(seq)
+        embeddings, valid = self._load(seq, key)
+        keep = seq.keep if seq.keep is not None else slice(None)
+        if embeddings is None or not valid[keep].all():
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(self._paths(key)[2])
+        self.hits += 1
+
+        return embeddings
+
+    def ids_checksum(self, seq):
+        return hashlib.sha1(np.ascontiguousarray(
+            seq.det_index.detection_id).astype(np.int64).tobytes()).hexdigest()
+
+    def start(self, seq):
+        """
+        Start writing embeddings of sequence, array is allocated with the
+        first embeddings. Extends existing entries that miss detections.
+        """
+        key = self.key(seq)
+        embeddings, valid = self._load(seq, key)
+        if embeddings is not None:
+            npy, _, _ = self._paths(key)
+            shutil.copyfile(npy, npy + '.tmp')
+            embeddings = np.load(npy + '.tmp', mmap_mode='r+')
+        else:
+            valid = np.zeros(seq.det_index.num_dets, dtype=bool)
+
+        self._writer = {
+            'seq': seq,
+            'key': key,
+            'embeddings': embeddings,
+            'valid': valid}
+
+    def write(self, rows, feats):
+        """
+        Write embeddings of detections at rows (slice or indices of
+        DetectionIndex), returns the embeddings as they are read from the
+        cache (e.g., rounded to float16), so that tracking with and
+        without cache hits gives the same results
+        """
+        if self._writer is None:
+            return feats
+        device = feats.device
+        feats = feats.detach().float().cpu().numpy()
+        if self._writer['embeddings'] is None:
+            npy, _, _ = self._paths(self._writer['key'])
+            self._writer['embeddings'] = np.lib.format.open_memmap(
+                npy + '.tmp', mode='w+', dtype=self.dtype,
+                shape=(self._writer['seq'].det_index.num_dets,
+                       feats.shape[1]))
+        self._writer['embeddings'][rows] = feats
+        self._writer['valid'][rows] = True
+        return torch.from_numpy(
+            feats.astype(self.dtype).astype(np.float32)).to(device)
+
+    def finish(self):
+        """
+        Move embeddings of fully tracked sequence to cache
+        """
+        if self._writer is None:
+            return
+        writer, self._writer = self._writer, None
+        if writer['embeddings'] is None:
+            return
+
+        npy, valid, meta = self._paths(writer['key'])
+        writer['embeddings'].flush()
+        del writer['embeddings']
+        os.replace(npy + '.tmp', npy)
+        np.save(valid, writer['valid'])
+
+        with open(meta, 'w') as f:
+            json.dump({
+                'seq': writer['seq'].name,
+                'detection_id': self.ids_checksum(writer['seq']),
+                'weights': self.weights_checksum,
+                'params': self.params}, f)
+
+        logger.info(f"Cached embeddings of {writer['seq'].name} to {npy}")
+        self.enforce_size()
+
+    def remove(self, key):
+        for path in self._paths(key):
+            if osp.isfile(path):
+                os.remove(path)
+
+    def entries(self):
+        """
+        Cached entries as (last used, size in bytes, key)
+        """
+        entries = list()
+        for f in os.listdir(self.cache_dir):
+            if not f.endswith('.json'):
+                continue
+            key = f[:-5]
+            npy, valid, meta = self._paths(key)
+            size = sum(os.path.getsize(p) for p in [npy, valid, meta]
+                       if osp.isfile(p))
+            entries.append((os.path.getmtime(meta), size, key))
+        return entries
+
+    def enforce_size(self):
+        """
+        Remove least recently used entries until cache is smaller than
+        max_size
+        """
+        entries = sorted(self.entries())
+        size = sum(e[1] for e in entries)
+        while size > self.max_size and len(entries) > 1:
+            _, entry_size, key = entries.pop(0)
+            logger.info(f"Cache larger than max size, removing {key}")
+            self.remove(key)
+            size -= entry_size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            self.remove(key)
+
+    def get(self, embeddings, rows, device):
+        """
+        Embeddings of detections at rows as float tensor
+        """
+        return torch.from_numpy(
+            np.array(embeddings[rows], dtype=np.float32)).to(device)
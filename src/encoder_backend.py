@@ -0,0 +1,126 @@
+from abc import ABC, abstractmethod
+import logging
+import torch
+import torch.nn.functional as F
+
+
+logger = logging.getLogger('AllReIDTracker.EncoderBackend')
+
+
+class EncoderBackend(ABC):
+    """
+    Interface of ReID encoder backends. Calling a backend returns the
+    embeddings of a batch of crops for the output option ('plain': L2
+    normalized fc7, 'norm': fc7, 'neck': after bottleneck), independent
+    of how the encoder is run.
+    """
+    name = None
+
+    @abstractmethod
+    def __call__(self, crops, output_option='plain'):
+        pass
+
+
+class EagerBackend(EncoderBackend):
+    """
+    PyTorch module, get_encoder returns the module to use for the
+    current crops (e.g., the inference path of the encoder in eval mode)
+    """
+    name = 'eager'
+
+    def __init__(self, get_encoder, **kwargs):
+        self.get_encoder = get_encoder
+
+    def __call__(self, crops, output_option='plain'):
+        with torch.no_grad():
+            _, feats = self.get_encoder()(crops, output_option=output_option)
+        return feats
+
+
+class ExportedBackend(EncoderBackend):
+    """
+    Encoder exported with tools/export_encoder.py, the exported graph
+    maps crops to fc7 and the embeddings after the bottleneck (fc7 if
+    there is no bottleneck)
+    """
+    @abstractmethod
+    def run(self, crops):
+        """
+        fc7 and embeddings after the bottleneck of crops
+        """
+        pass
+
+    def __call__(self, crops, output_option='plain'):
+        fc7, feats_after = self.run(crops)
+        if output_option == 'plain':
+            return F.normalize(fc7, p=2, dim=1)
+        elif output_option == 'neck':
+            return feats_after
+        return fc7
+
+
+class TorchScriptBackend(ExportedBackend):
+    """
+    Traced and frozen TorchScript encoder, threads sets the number of
+    intra op threads of torch (process wide)
+    """
+    name = 'torchscript'
+
+    def __init__(self, path, device='cpu', threads=0, **kwargs):
+        if threads:
+            torch.set_num_threads(threads)
+        self.device = device
+        self.model = torch.jit.load(path, map_location=device)
+        self.model.eval()
+
+    def run(self, crops):
+        with torch.no_grad():
+            return self.model(crops.to(self.device))
+
+
+class OnnxRuntimeBackend(ExportedBackend):
+    """
+    ONNX encoder run by ONNX Runtime on CPU with all graph optimizations
+    (pip install onnxruntime), threads sets the number of intra op
+    threads of the session
+    """
+    name = 'onnxruntime'
+
+    def __init__(self, path, threads=0, **kwargs):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = \
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, crops):
+        fc7, feats_after = self.session.run(
+            None, {self.input_name: crops.cpu().numpy()})
+        return torch.from_numpy(fc7).to(crops.device), \
+            torch.from_numpy(feats_after).to(crops.device)
+
+
+backends = {
+    b.name: b for b in
+    [EagerBackend, TorchScriptBackend, OnnxRuntimeBackend]}
+
+
+def get_backend(backend_cfg, get_encoder, device='cpu'):
+    """
+    Get encoder backend of reid_net backend config, optional backends
+    raise an ImportError if their package is not installed
+    """
+    name = backend_cfg['name'] if backend_cfg is not None else 'eager'
+    if name not in backends:
+        raise ValueError(f"Unknown encoder backend {name}, "
+                         f"choose from {list(backends.keys())}")
+    if name == 'eager':
+        return EagerBackend(get_encoder)
+
+    logger.info(f"Using {name} encoder {backend_cfg['path']}")
+    return backends[name](
+        backend_cfg['path'], device=device, threads=backend_cfg['threads'])
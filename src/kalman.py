@@ -185,17 +185,82 @@ class KalmanFilter():
             self._std_weight_velocity * mean[:, 3]]
         sqr = np.square(np.r_[std_pos, std_vel]).T
 
-        motion_cov = []
-        for i in range(len(mean)):
-            motion_cov.append(np.diag(sqr[i]))
-        motion_cov = np.asarray(motion_cov)
+        # diagonal process noise of all states at once
+        diag = np.arange(8)
+        motion_cov = np.zeros((len(mean), 8, 8))
+        motion_cov[:, diag, diag] = sqr
 
         mean = np.dot(mean, self._motion_mat.T)
-        left = np.dot(self._motion_mat, covariance).transpose((1, 0, 2))
-        covariance = np.dot(left, self._motion_mat.T) + motion_cov
+        covariance = np.matmul(np.matmul(
+            self._motion_mat, covariance), self._motion_mat.T) + motion_cov
 
         return mean, covariance
 
+    def multi_project(self, mean, covariance):
+        """Project state distributions to measurement space (Vectorized
+        version of project).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 covariance matrices.
+
+        """
+        std = np.stack([
+            self._std_weight_position * mean[:, 3],
+            self._std_weight_position * mean[:, 3],
+            1e-1 * np.ones_like(mean[:, 3]),
+            self._std_weight_position * mean[:, 3]], axis=1)
+        diag = np.arange(4)
+        innovation_cov = np.zeros((len(mean), 4, 4))
+        innovation_cov[:, diag, diag] = np.square(std)
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
+    def multi_update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step (Vectorized version). The
+        Kalman gains of all states are computed with one batched solve.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the predicted states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the states.
+        measurement : ndarray
+            The Nx4 dimensional measurements (x, y, a, h).
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        # S K^T = H P^T
+        kalman_gain = np.linalg.solve(
+            projected_cov,
+            np.matmul(self._update_mat, covariance.transpose(0, 2, 1)))
+        kalman_gain = kalman_gain.transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.matmul(
+            kalman_gain, innovation[:, :, None])[:, :, 0]
+        new_covariance = covariance - np.matmul(np.matmul(
+            kalman_gain, projected_cov), kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
 
@@ -273,3 +338,139 @@ class KalmanFilter():
             return squared_maha
         else:
             raise ValueError('invalid distance metric')
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute squared Mahalanobis distances between N state
+        distributions and M measurements at once (Vectorized version of
+        gating_distance).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM array of squared Mahalanobis distances.
+
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        # solve L z = d for all states with all measurements as right hand
+        # sides
+        d = measurements[None, :, :] - mean[:, None, :]
+        cholesky_factor = np.linalg.cholesky(covariance)
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        return np.sum(z * z, axis=1)
+
+
+class KalmanStore():
+    """
+    Structure of arrays of the Kalman states of all tracks of a sequence,
+    Nx8 means and Nx8x8 covariances with one reusable slot per track.
+    Measurements of matched tracks are collected during the assignment
+    and corrected in one batched update (see update).
+    """
+    def __init__(self, kalman_filter, capacity=256):
+        self.kalman_filter = kalman_filter
+        self.slots = dict()
+        self.free = list(range(capacity - 1, -1, -1))
+        self.mean = np.zeros((capacity, 8))
+        self.covariance = np.zeros((capacity, 8, 8))
+        self.pending = dict()
+
+    def _grow(self):
+        """
+        Double number of slots
+        """
+        capacity = self.mean.shape[0]
+        self.mean = np.concatenate([self.mean, np.zeros_like(self.mean)])
+        self.covariance = np.concatenate(
+            [self.covariance, np.zeros_like(self.covariance)])
+        self.free = list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def initiate(self, track_id, measurement):
+        """
+        Initialize state of new track from measurement (x, y, a, h)
+        """
+        if not len(self.free):
+            self._grow()
+        s = self.free.pop()
+        self.slots[track_id] = s
+        self.mean[s], self.covariance[s] = self.kalman_filter.initiate(
+            measurement)
+
+    def remove(self, track_id):
+        s = self.slots.pop(track_id, None)
+        self.pending.pop(track_id, None)
+        if s is not None:
+            self.free.append(s)
+
+    def get_slots(self, track_ids):
+        return np.fromiter((self.slots[k] for k in track_ids),
+                           dtype=np.int64)
+
+    def add_measurement(self, track_id, measurement):
+        """
+        Add measurement of matched track, corrected in next update
+        """
+        self.pending[track_id] = measurement
+
+    def update(self):
+        """
+        Correct states of all tracks with pending measurements
+        """
+        if not len(self.pending):
+            return
+        slots = self.get_slots(self.pending.keys())
+        measurement = np.asarray(list(self.pending.values()))
+        self.mean[slots], self.covariance[slots] = \
+            self.kalman_filter.multi_update(
+                self.mean[slots], self.covariance[slots], measurement)
+        self.pending = dict()
+
+    def predict(self, active, inactive):
+        """
+        Predict states of active and inactive tracks, the height velocity
+        of inactive tracks is set to zero
+        """
+        inactive = self.get_slots(inactive)
+        self.mean[inactive, 7] = 0
+        slots = np.concatenate([self.get_slots(active), inactive])
+        if slots.shape[0]:
+            self.mean[slots], self.covariance[slots] = \
+                self.kalman_filter.multi_predict(
+                    self.mean[slots], self.covariance[slots])
+
+    def gating_distance(self, track_ids, measurements, only_position=False):
+        """
+        Squared Mahalanobis distances of tracks to measurements (x, y, a, h)
+        """
+        slots = self.get_slots(track_ids)
+        return self.kalman_filter.multi_gating_distance(
+            self.mean[slots], self.covariance[slots], measurements,
+            only_position)
+
+    def tlbr(self, track_ids):
+        """
+        Current bbs (min x, min y, max x, max y) of tracks
+        """
+        mean = self.mean[self.get_slots(track_ids), :4]
+        w, h = mean[:, 2] * mean[:, 3], mean[:, 3]
+        return np.stack([
+            mean[:, 0] - w / 2,
+            mean[:, 1] - h / 2,
+            mean[:, 0] + w / 2,
+            mean[:, 1] + h / 2], axis=1)
@@ -8,6 +8,8 @@ import logging
 import torchreid
 from src.eval_track_eval import evaluate_track_eval
 from src.eval_track_eval_bdd import evaluate_track_eval_bdd
+from src.embedding_cache import EmbeddingCache, file_checksum, \
+    state_dict_checksum
 import pandas as pd
 import json
 import sys
@@ -94,6 +96,13 @@ class Manager():
         self.loaders = self._get_loaders(dataset_cfg)
         self._get_models()
 
+        # recompute all cached embeddings
+        if self.tracker.embedding_cache is not None and \
+                reid_net_cfg['embedding_cache']['clear']:
+            logger.info("Clearing embedding cache {}".format(
+                reid_net_cfg['embedding_cache']['dir']))
+            self.tracker.embedding_cache.clear()
+
     def _evaluate(self, first=False, log=True):
         names = list()
 
@@ -116,17 +125,24 @@ class Manager():
 
         if log:
             logger.info(self.tracker.experiment)
+            if self.tracker.embedding_cache is not None:
+                logger.info(
+                    f"Embedding cache hits {self.tracker.embedding_cache.hits}"
+                    f", misses {self.tracker.embedding_cache.misses}")
+            if self.tracker_cfg['lazy_embeddings']['do']:
+                self.tracker.log_lazy_stats(
+                    'all sequences', self.tracker.lazy_stats)
             # self.tracker.experiment = yolox_dets_OnTheFly:1_each_sample2:0.8:LastFrame:0.9LenThresh:0RemUnconf:0.0LastNFrames:10NanFirst:1MM:1sum_0.4InactPat:50DetConf:0.35NewTrackConf:0.45
 
         mota, idf1 = 0, 0
 
         # EVALUATION TRACKEVAL
         if 'bdd' in self.dataset_cfg['mot_dir']:
-            _, _ = self.eval_track_eval_bdd(log)
+            self.track_eval_res, _ = self.eval_track_eval_bdd(log)
         elif 'Dance' in self.dataset_cfg['mot_dir']:
-            _, _ = self.eval_track_eval_dance(log)
+            self.track_eval_res, _ = self.eval_track_eval_dance(log)
         else:
-            _, _ = self.eval_track_eval(log)
+            self.track_eval_res, _ = self.eval_track_eval(log)
 
         return mota, idf1
 
@@ -136,7 +152,9 @@ class Manager():
                                net_type=self.net_type,
                                output=self.reid_net_cfg['output'],
                                data=self.dataset_cfg['det_file'],
-                               device=self.device)
+                               device=self.device,
+                               embedding_cache=self._get_embedding_cache(),
+                               backend_cfg=self.reid_net_cfg['backend'])
 
     def _get_encoder(self):
         self.net_type = self.reid_net_cfg['encoder_params']['net_type']
@@ -145,7 +163,47 @@ class Manager():
             self.reid_net_cfg['trained_on']['num_classes'],
             **self.reid_net_cfg['encoder_params'])
 
-        self.encoder = encoder.to(self.device)
+        # quantized encoder runs on CPU, crops are moved there
+        if self.reid_net_cfg['encoder_params']['precision'] == 'int8':
+            logger.info("Using INT8 encoder {} on CPU".format(
+                self.reid_net_cfg['encoder_params']['quantized_path']))
+            self.encoder = encoder
+        else:
+            self.encoder = encoder.to(self.device)
+
+    def _get_embedding_cache(self):
+        cache_cfg = self.reid_net_cfg['embedding_cache']
+        if not cache_cfg['do']:
+            return None
+
+        # checksum of weights, of loaded network if no weight file
+        pretrained_path = self.reid_net_cfg['encoder_params']['pretrained_path']
+        # quantized or exported weights give other embeddings
+        if self.reid_net_cfg['encoder_params']['precision'] == 'int8':
+            pretrained_path = \
+                self.reid_net_cfg['encoder_params']['quantized_path']
+        if self.reid_net_cfg['backend']['name'] != 'eager':
+            pretrained_path = self.reid_net_cfg['backend']['path']
+        if osp.isfile(pretrained_path):
+            weights_checksum = file_checksum(pretrained_path)
+        else:
+            weights_checksum = state_dict_checksum(self.encoder)
+
+        params = {
+            'det_file': self.dataset_cfg['det_file'],
+            'sz_crop': list(self.dataset_cfg['sz_crop']),
+            'padding': 'zero',
+            'fixed_aspect_ratio': self.dataset_cfg['fixed_aspect_ratio'],
+            'batched_crops': self.dataset_cfg['batched_crops'],
+            'net_type': self.net_type,
+            'output': self.reid_net_cfg['output']}
+
+        return EmbeddingCache(
+            cache_cfg['dir'],
+            weights_checksum,
+            params,
+            dtype=cache_cfg['dtype'],
+            max_size_gb=cache_cfg['max_size_gb'])
 
     def _get_loaders(self, dataset_cfg):
         # get loaders for test / val mode of current split
@@ -175,6 +233,8 @@ class Manager():
         self.tracker.experiment = experiment
         logger.info('Run first for adaption')
         self.tracker.encoder = self.encoder
+        # embeddings of adapted encoder can not be cached
+        self.tracker.embedding_cache = None
         if self.tracker_cfg['store_dist']:
             self.tracker.distance_ = distance
         self.encoder.train()
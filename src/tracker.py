@@ -1,4 +1,5 @@
 from collections import defaultdict
+import heapq
 import torch
 import os
 import numpy as np
@@ -7,8 +8,10 @@ import logging
 # from linear_assignment import solve_dense
 from scipy.optimize import linear_sum_assignment as solve_dense
 import json
-from src.tracking_utils import get_proxy, Track, multi_predict, get_iou_kalman
+from src.tracking_utils import get_proxy, Track, TrackStore, \
+    multi_predict, get_iou_kalman, segment_reduce, reset_peak_rss, peak_rss
 from src.base_tracker import BaseTracker
+from src.assignment import solve_decomposed, restrict_blocks
 from tqdm import tqdm
 
 
@@ -23,7 +26,9 @@ class Tracker(BaseTracker):
             net_type='resnet50',
             output='plain',
             data='tracktor_preprocessed_files.txt',
-            device='cpu'):
+            device='cpu',
+            embedding_cache=None,
+            backend_cfg=None):
         super(
             Tracker,
             self).__init__(
@@ -32,7 +37,9 @@ class Tracker(BaseTracker):
             net_type,
             output,
             data,
-            device)
+            device,
+            embedding_cache,
+            backend_cfg)
         self.short_experiment = defaultdict(list)
         self.inact_patience = self.tracker_cfg['inact_patience']
 
@@ -50,23 +57,45 @@ class Tracker(BaseTracker):
 
         # initalize variables for sequence
         self.setup_seq(seq, first)
+        reset_peak_rss()
 
         # batch norm experiemnts I - before iterating over sequence
         self.normalization_before(seq, first=first)
+
+        # use cached embeddings or cache them while tracking
+        embeddings = None
+        use_cache = self.use_embedding_cache(first)
+        if use_cache:
+            embeddings = self.embedding_cache.lookup(seq)
+            if embeddings is not None:
+                logger.info(f"Using cached embeddings of {seq.name}")
+                seq.load_crops = False
+            else:
+                self.embedding_cache.start(seq)
         self.prev_frame = 0
         i = 0
+        # encode crops of several frames at once, not while adapting the
+        # encoder to the sequence or if embeddings are cached
+        batched = self.tracker_cfg['encoder_batching']['lookahead'] > 1 \
+            and not first and embeddings is None
+        frames = self.batched_features(seq) if batched else \
+            ((frame_data, None) for frame_data in seq)
+        # only crops of detections without an unambiguous motion match are
+        # encoded, see lazy_association
+        lazy = self.tracker_cfg['lazy_embeddings']['do'] and not first
         # iterate over frames
-        for frame_data in tqdm(seq, total=len(seq)):
-            frame, path, boxes, gt_ids, vis, \
-                random_patches, whole_im, conf, label = frame_data #gt_ids is the only information coming from gt and gt_corresponding in BDDLoader (bdd100k_parser.py)
+        for frame_data, batch_feats in tqdm(frames, total=len(seq)):
+            frame, path, detections, random_patches, whole_im = frame_data #detections.gt_id is the only information coming from gt and gt_corresponding in BDDLoader (bdd100k_parser.py)
             # "frame" is a tensor containing all the ROIs (Regions of Interest) of detected objects in each video frame.
             # log if in training mode
             if i == 0:
                 logger.info(f'Network in training mode: {self.encoder.training}')
             self.i = i # is an integer zero-based frame id (no additional digits like frame_id)
 
-            # batch norm experiments II on the fly
-            self.normalization_experiments(random_patches, frame, i, seq)
+            # batch norm experiments II on the fly, not for frames without
+            # detections
+            if len(detections):
+                self.normalization_experiments(random_patches, frame, i, seq)
 
             # get frame id (is a 6 digits number)
             if 'bdd' in path:
@@ -75,38 +104,42 @@ class Tracker(BaseTracker):
             else:
                 self.frame_id = int(path.split(os.sep)[-1][:-4])
 
-            # detections of current frame
-            detections = list()
-
             # forward pass
             # 512-dim vector per ROI of bboxes
-            feats = self.get_features(frame)
+            self.lazy_crops = None
+            if embeddings is not None:
+                feats = self.embedding_cache.get(
+                    embeddings, seq.frame_rows(i), self.device)
+            # all detections of frame filtered
+            elif len(detections) == 0:
+                feats = None
+            # crops are encoded while associating
+            elif lazy:
+                feats = None
+                self.lazy_crops = frame
+                self.seq_lazy_stats['detections'] += len(detections)
+                self.seq_lazy_stats['frames'] += 1
+            else:
+                feats = batch_feats if batched else self.get_features(frame)
+                # track on the embeddings as stored in the cache
+                if use_cache:
+                    feats = self.embedding_cache.write(
+                        seq.frame_rows(i), feats)
 
             # if just feeding for bn stats update
             if first:
                 continue
 
-            # iterate over bbs in current frame
-            for f, b, gt_id, v, c, l in zip(feats, boxes, gt_ids, vis, conf, label):
-                if (b[3] - b[1]) / (b[2] - b[0]
-                                    ) < self.tracker_cfg['h_w_thresh']:
-                    if c < self.tracker_cfg['det_conf']:
-                        continue
-
-                    detection = {
-                        'bbox': b,
-                        'feats': f,
-                        'im_index': self.frame_id,
-                        'gt_id': gt_id,
-                        'vis': v,
-                        'conf': c,
-                        'frame': self.frame_id,
-                        'label': l}
-                    detections.append(detection)
-
-                    # store features
-                    if self.store_feats:
-                        self.add_feats_to_storage(detections)
+            # detections of current frame, bbs below det_conf or above
+            # h_w_thresh are already filtered by the sequence unless
+            # BatchNorm experiments use all bbs
+            detections.feats = feats
+            detections.frame = self.frame_id
+            detections = self.filter_detections(detections)
+
+            # store features
+            if self.store_feats:
+                self.add_feats_to_storage(detections)
 
             # apply motion compensation to stored track positions
             if self.motion_model_cfg['motion_compensation']:
@@ -125,13 +158,35 @@ class Tracker(BaseTracker):
             # increase count
             i += 1
 
+        # store camera motion of sequence
+        if self.camera_motion is not None:
+            self.camera_motion.finish()
+
+        # store embeddings of sequence
+        if use_cache:
+            if embeddings is None:
+                self.embedding_cache.finish()
+            seq.load_crops = True
+
         # just fed for bn stats update
         if first:
             logger.info('Done with pre-tracking feed...')
             return
 
-        # add inactive tracks to active tracks for evaluation
-        self.tracks.update(self.inactive_tracks)
+        logger.info(f"Peak RSS of {seq.name}: {peak_rss():.1f} MB")
+
+        # crops and encoder calls saved by lazy embeddings
+        if lazy:
+            self.log_lazy_stats(seq.name, self.seq_lazy_stats)
+            for k, v in self.seq_lazy_stats.items():
+                self.lazy_stats[k] += v
+
+        # add inactive and archived tracks to active tracks for evaluation
+        # in the order they became inactive
+        self.tracks.update(sorted(
+            list(self.inactive_tracks.items()) +
+            list(self.archived_tracks.items()),
+            key=lambda t: t[1].inactive_order))
 
         # write results
         # self.output_dir = 'out'
@@ -156,30 +211,226 @@ class Tracker(BaseTracker):
         
         input('press enter to continue \n')
 
+    def batched_features(self, seq):
+        """
+        Frame data of seq with the reid features of its crops (None
+        without detections). The crops of up to lookahead frames, or
+        until batch_size crops are gathered, are fed through the encoder
+        in one call and split per frame again.
+        """
+        lookahead = self.tracker_cfg['encoder_batching']['lookahead']
+        batch_size = self.tracker_cfg['encoder_batching']['batch_size']
+        # iter of sequence restarts it, frames are taken with next
+        frames = iter(seq)
+        while True:
+            pending, num = list(), 0
+            while len(pending) < lookahead and num < batch_size:
+                frame_data = next(frames, None)
+                if frame_data is None:
+                    break
+                pending.append(frame_data)
+                num += len(frame_data[2])
+            if not len(pending):
+                return
+
+            sizes = [len(frame_data[2]) for frame_data in pending]
+            if num:
+                feats = self.get_features(torch.cat([
+                    frame_data[0] for frame_data, size in zip(pending, sizes)
+                    if size]))
+                feats = torch.split(feats, sizes)
+            else:
+                feats = [None] * len(pending)
+
+            for frame_data, size, f in zip(pending, sizes, feats):
+                yield frame_data, f if size else None
+
+    def lazy_features(self, rows):
+        """
+        Reid features of the crops of the current frame at rows (lazy
+        embeddings), None if there are no rows
+        """
+        self.seq_lazy_stats['embedded'] += len(rows)
+        if not len(rows):
+            return None
+        self.seq_lazy_stats['calls'] += 1
+        return self.get_features(self.lazy_crops[
+            torch.from_numpy(rows).to(self.lazy_crops.device)])
+
+    def lazy_association(self, detections):
+        """
+        Ambiguity driven lazy embeddings: a detection is assigned to an
+        active track by motion alone if the IoU distance of the pair is
+        below 1 - min_iou and all other pairs of the detection and of the
+        track (with active and inactive tracks) are worse by at least
+        margin, i.e., the appearance distance could not change the
+        assignment. The track needs the same label and an embedding of
+        the last refresh frames, so that the gallery of tracks that become
+        inactive later on stays up to date. Matched tracks are held out
+        of the association of the current frame and only the other
+        detections are encoded. Returns the other detections with their
+        features, their rows and the held out tracks {id: (row, track)}.
+        """
+        lazy_cfg = self.tracker_cfg['lazy_embeddings']
+        track_ids = list(self.tracks.keys())
+        col_ids = np.asarray(track_ids + list(self.curr_it.keys()))
+
+        # motion distance of all detections and tracks, tracks are moved
+        # only once per frame
+        if self.kalman:
+            iou = get_iou_kalman(self.kalman_tlbrs, detections.boxes)
+        else:
+            self.motion()
+            self.motion_stepped = True
+            iou = self.get_motion_dist(detections, self.curr_it).numpy()
+        iou = np.asarray(iou, dtype=np.float64)
+
+        # best active track of every detection and second best pair of
+        # the detection and of the track
+        rows = np.arange(len(detections))
+        best = iou[:, :len(track_ids)].argmin(axis=1)
+        best_dist = iou[rows, best]
+        others = iou.copy()
+        others[rows, best] = np.inf
+        row_second = others.min(axis=1)
+        others = iou[:, best]
+        others[rows, rows] = np.inf
+        col_second = others.min(axis=0)
+
+        last_embedded = np.asarray(
+            [self.tracks[k].last_embedded for k in track_ids])[best]
+        unambiguous = (best_dist <= 1 - lazy_cfg['min_iou']) & \
+            (row_second >= best_dist + lazy_cfg['margin']) & \
+            (col_second >= best_dist + lazy_cfg['margin']) & \
+            (self.track_store.labels_of(track_ids)[best] ==
+             detections.label) & \
+            (self.frame_id - last_embedded < lazy_cfg['refresh'])
+
+        # a track is held out for at most one detection (ties if margin
+        # is 0), the other detections are encoded
+        cand = np.nonzero(unambiguous)[0]
+        cand = cand[np.lexsort((best_dist[cand], best[cand]))]
+        _, first = np.unique(best[cand], return_index=True)
+        unambiguous[:] = False
+        unambiguous[cand[first]] = True
+
+        # hold out matched tracks
+        held = dict()
+        for r in np.nonzero(unambiguous)[0].tolist():
+            k = track_ids[best[r]]
+            held[k] = (r, self.tracks.pop(k))
+        if self.kalman and len(held):
+            self.kalman_tlbrs = self.kalman_tlbrs[
+                ~np.isin(col_ids, list(held.keys()))]
+
+        # encode other detections
+        rows = rows[~unambiguous]
+        detections = detections.subset(rows)
+        detections.feats = self.lazy_features(rows)
+        return detections, rows, held
+
+    def add_held(self, detections, rows, held, tr_ids):
+        """
+        Add detections without embedding to their held out tracks, returns
+        track ids of all detections given the track ids of detections at
+        rows
+        """
+        all_tr_ids = [None for _ in range(len(detections))]
+        for r, k in zip(rows.tolist(), tr_ids):
+            all_tr_ids[r] = k
+        for k, (r, track) in held.items():
+            self.tracks[k] = track
+            track.add_from_batch(detections, r)
+            all_tr_ids[r] = k
+        return all_tr_ids
+
+    def new_track(self, detections, j):
+        """
+        Start new track with the j-th detection of the frame, the aligned
+        arrays of the DetectionBatch are passed directly
+        """
+        self.tracks[self.id] = Track(
+            self.id, detections.boxes[j],
+            detections.feats[j] if detections.feats is not None else None,
+            detections.frame, detections.gt_id[j], detections.vis[j],
+            detections.conf[j], detections.frame, detections.label[j],
+            kalman=self.kalman,
+            kalman_store=self.kalman_store,
+            gallery=self.gallery,
+            retention=self.retention,
+            results=self.results,
+            motion_buffer=self.motion_buffer,
+            track_store=self.track_store)
+        self.id += 1
+        return self.id - 1
+
+    def log_lazy_stats(self, name, stats):
+        """
+        Log fraction of crops and frames that were not encoded
+        """
+        logger.info(
+            f"Lazy embeddings of {name}: encoded {stats['embedded']} of "
+            f"{stats['detections']} crops "
+            f"({1 - stats['embedded'] / max(stats['detections'], 1):.1%} "
+            f"saved), encoder called in {stats['calls']} of "
+            f"{stats['frames']} frames")
+
     def _track(self, detections, i):
-        # get inactive tracks with inactive < patience
+        # get inactive tracks with inactive < patience, expired tracks are
+        # moved to the archive
         # self.curr_it is Current Inactive Tracks, a dictionary of {k:track}
         # k=unique track ID for each track, track= track objects
-        self.curr_it = {k: track for k, track in self.inactive_tracks.items()
-                        if track.inactive_count <= self.inact_patience}
+        self.expire_inactive()
+        self.curr_it = dict(self.inactive_tracks)
+        self.motion_stepped = False
+
+        # lazy embeddings: without active tracks all detections need
+        # their embeddings
+        if self.lazy_crops is not None and not (i > 0 and len(self.tracks)):
+            detections.feats = self.lazy_features(np.arange(len(detections)))
 
         # just add all bbs to self.tracks / intitialize in the first frame
         if len(self.tracks) == 0 and len(self.curr_it) == 0:
             tr_ids = list()
-            for detection in detections:#detections is series of all detected objects, each called detection, in one frame
-                self.tracks[self.id] = Track(
-                    track_id=self.id,
-                    **detection,
-                    kalman=self.kalman,
-                    kalman_filter=self.kalman_filter)
-                tr_ids.append(self.id)
-                self.id += 1
+            for j in range(len(detections)):#detections are all detected objects in one frame
+                tr_ids.append(self.new_track(detections, j))
 
         # association over frames for frame > 0
         # i = frame number
         elif i > 0:
+            held = dict()
+            # predict kalman states of all tracks
+            if len(detections) > 0 and self.kalman and \
+                    self.motion_model_cfg['apply_motion_model']:
+                self.kalman_tlbrs = multi_predict(
+                    self.tracks,
+                    self.curr_it,
+                    self.kalman_store)
+
+            # lazy embeddings: detections with an unambiguous motion match
+            # are assigned to their active track directly, only the other
+            # detections are encoded and associated
+            if self.lazy_crops is not None and len(detections) > 0 and \
+                    len(self.tracks):
+                all_detections = detections
+                detections, rows, held = self.lazy_association(detections)
+
             # get hungarian matching
-            if len(detections) > 0:
+            if len(detections) > 0 and len(self.tracks) + len(self.curr_it):
+
+                # gate pairs of detections and tracks before computing
+                # appearance distances
+                self.feasible = None
+                if self.kalman and \
+                        self.motion_model_cfg['apply_motion_model'] and \
+                        self.tracker_cfg['gating']['do']:
+                    self.feasible = self.gating(detections, self.curr_it)
+
+                # detections and tracks of every class are associated
+                # separately
+                self.blocks = None
+                if self.tracker_cfg['class_blocks']:
+                    self.blocks = self.class_blocks(detections, self.curr_it)
 
                 # get proxy features of tracks first and compute distance then
                 if not self.tracker_cfg['avg_inact']['proxy'] == 'each_sample':
@@ -191,7 +442,7 @@ class Tracker(BaseTracker):
                     dist, row, col, ids = self.get_hungarian_each_sample(
                         detections, sep=self.tracker_cfg['assign_separately'])
             else:
-                dist, row, col, ids = 0, 0, 0, 0
+                dist, row, col, ids = 0, [], [], []
 
             if dist is not None:
                 # get bb assignment
@@ -203,50 +454,89 @@ class Tracker(BaseTracker):
                     ids=ids,
                     sep=self.tracker_cfg['assign_separately']) #assign_separately=0
 
+            # add detections of held out tracks
+            if len(held):
+                tr_ids = self.add_held(all_detections, rows, held, tr_ids)
+
+        # correct kalman states of all matched tracks at once
+        if self.kalman:
+            self.kalman_store.update()
+
         return tr_ids
 
-    def last_frame(self, ids, tracks, x, nan_over_classes, labels_dets):
+    def last_frame(self, ids, tracks, x, nan_over_classes, labels_dets,
+                   x_normalized=False, feasible=None, blocks=None):
         """
-        Get distance of detections to last frame of tracks
+        Get distance of detections to last frame of tracks, only of
+        feasible pairs if gated and within class blocks if given
         """
-        y = torch.stack([t.feats for t in tracks.values()])
+        y = self.track_store.feats_of(tracks.keys())
         ids.extend([i for i in tracks.keys()])
-        dist = self.dist(x, y).T
+        dist = self.gated_dist(
+            x, y, feasible, x_normalized=x_normalized, blocks=blocks).T
 
         # set distance between matches of different classes to nan
-        if nan_over_classes:
-            labels = np.array([t.label[-1] for t in tracks.values()])
+        if nan_over_classes and blocks is None:
+            labels = self.track_store.labels_of(tracks.keys())
             label_mask = np.atleast_2d(labels).T == np.atleast_2d(labels_dets)
             dist[~label_mask] = np.nan
         return dist
 
-    def proxy_dist(self, tr, x, nan_over_classes, labels_dets):
+    def proxy_dist(self, ids, tracks, x, nan_over_classes, labels_dets,
+                   x_normalized=False, feasible=None, blocks=None):
         """
-        Compute proxy distances using all detections in given track
+        Compute proxy distances using all detections in given tracks,
+        i.e., one distance computation to the packed embeddings of all
+        tracks and reduction over the segments of every track. If gated,
+        only detections and tracks with a feasible pair are used. If
+        class blocks are given, every block is computed on its own.
         """
-        # get distance between detections and all dets of track
-        y = torch.stack(tr.past_feats)
-        dist = self.dist(x, y)
+        if blocks is not None:
+            ids.extend([i for i in tracks.keys()])
+            track_list = list(tracks.items())
+            return self.blockwise(
+                lambda rows, cols: self.proxy_dist(
+                    list(), dict(track_list[c] for c in cols),
+                    x[torch.from_numpy(rows).to(x.device)], False, None,
+                    x_normalized, feasible[np.ix_(rows, cols)]
+                    if feasible is not None else None).T,
+                blocks, (x.shape[0], len(track_list))).T
 
-        # reduce
-        if self.tracker_cfg['avg_inact']['num'] == 1:
-            dist = np.min(dist, axis=1)
-        elif self.tracker_cfg['avg_inact']['num'] == 2:
-            dist = np.mean(dist, axis=1)
-        elif self.tracker_cfg['avg_inact']['num'] == 3:
-            dist = np.max(dist, axis=1)
-        elif self.tracker_cfg['avg_inact']['num'] == 4:
-            dist = (np.max(dist, axis=1) + np.min(dist, axis=1))/2
-        elif self.tracker_cfg['avg_inact']['num'] == 5:
-            dist = np.median(dist, axis=1)
+        ids.extend([i for i in tracks.keys()])
+        track_ids = list(tracks.keys())
+        if feasible is not None:
+            rows = np.nonzero(feasible.any(axis=1))[0]
+            cols = np.nonzero(feasible.any(axis=0))[0]
+            x = x[torch.from_numpy(rows).to(x.device)]
+            track_ids = [track_ids[c] for c in cols]
+
+        if len(track_ids) and x.shape[0]:
+            # get distance between detections and all dets of all tracks
+            y, offsets, counts = self.gallery.segments(track_ids)
+            dist = self.dist(x, y, x_normalized=x_normalized,
+                             y_normalized=self.gallery.normalize)
+
+            # reduce
+            dist = segment_reduce(
+                dist, offsets, counts, self.tracker_cfg['avg_inact']['num'])
+        else:
+            dist = np.zeros((x.shape[0], len(track_ids)), dtype=np.float32)
+
+        # infeasible pairs
+        if feasible is not None:
+            gated = np.full(feasible.shape, np.nan, dtype=dist.dtype)
+            gated[np.ix_(rows, cols)] = dist
+            gated[~feasible] = np.nan
+            dist = gated
 
         # nan over classes
         if nan_over_classes:
-            label_mask = np.atleast_2d(np.array(tr.label[-1])) == \
+            labels = self.track_store.labels_of(tracks.keys())
+            label_mask = np.atleast_2d(labels) == \
                 np.atleast_2d(labels_dets).T
-            dist[~label_mask.squeeze()] = np.nan
+            dist[~label_mask] = np.nan
 
-        return dist
+        return dist.T
 
     def get_hungarian_each_sample(
             self, detections, nan_over_classes=True, sep=False):
@@ -255,13 +545,25 @@ class Tracker(BaseTracker):
         to all detections in given track
         """
 
-        # get new detections
-        x = torch.stack([t['feats'] for t in detections])
+        # get new detections, normalized once for all tracks
+        x, x_normalized = self.normalize_feats(detections.feats)
         dist_all, ids = list(), list()
 
+        # feasible pairs of active and inactive tracks if gated
+        feasible_act, feasible_inact = None, None
+        if self.feasible is not None:
+            feasible_act = self.feasible[:, :len(self.tracks)]
+            feasible_inact = self.feasible[:, len(self.tracks):]
+
+        # class blocks of active and inactive tracks
+        num_tracks = len(self.tracks) + len(self.curr_it)
+        blocks_act = restrict_blocks(
+            self.blocks, cols=np.arange(len(self.tracks)))
+        blocks_inact = restrict_blocks(
+            self.blocks, cols=np.arange(len(self.tracks), num_tracks))
+
         # if setting dist values between classes to nan before hungarian
-        if nan_over_classes:
-            labels_dets = np.array([t['label'] for t in detections])
+        labels_dets = detections.label
 
         # distance to active tracks
         if len(self.tracks) > 0:
@@ -269,17 +571,16 @@ class Tracker(BaseTracker):
             # just compute distance to last detection of active track
             if not self.tracker_cfg['avg_act']['do'] and len(detections) > 0:
                 dist = self.last_frame(
-                    ids, self.tracks, x, nan_over_classes, labels_dets)
+                    ids, self.tracks, x, nan_over_classes, labels_dets,
+                    x_normalized, feasible_act, blocks_act)
                 dist_all.extend([d for d in dist])
 
             # if use each sample for active frames
             else:
-                for id, tr in self.tracks.items():
-                    # get distance between detections and all dets of track
-                    ids.append(id)
-                    dist = self.proxy_dist(
-                        tr, x, nan_over_classes, labels_dets)
-                    dist_all.append(dist)
+                dist = self.proxy_dist(
+                    ids, self.tracks, x, nan_over_classes, labels_dets,
+                    x_normalized, feasible_act, blocks_act)
+                dist_all.extend([d for d in dist])
 
         # get number of active tracks
         num_active = len(ids)
@@ -289,14 +590,14 @@ class Tracker(BaseTracker):
         if len(curr_it) > 0:
             if not self.tracker_cfg['avg_inact']['do']:
                 dist = self.last_frame(
-                    ids, curr_it, x, nan_over_classes, labels_dets)
+                    ids, curr_it, x, nan_over_classes, labels_dets,
+                    x_normalized, feasible_inact, blocks_inact)
                 dist_all.extend([d for d in dist])
             else:
-                for id, tr in curr_it.items():
-                    ids.append(id)
-                    dist = self.proxy_dist(
-                        tr, x, nan_over_classes, labels_dets)
-                    dist_all.append(dist)
+                dist = self.proxy_dist(
+                    ids, curr_it, x, nan_over_classes, labels_dets,
+                    x_normalized, feasible_inact, blocks_inact)
+                dist_all.extend([d for d in dist])
 
         # stack all distances
         dist = np.vstack(dist_all).T
@@ -313,23 +614,29 @@ class Tracker(BaseTracker):
         # update thresholds
         self.update_thresholds(dist, num_active, len(curr_it))#updating self.act_reid_thresh and self.inact_reid_thresh
 
+        # track ids of the columns
+        col_ids = list(self.tracks.keys()) + list(curr_it.keys())
+
         # get motion distance
         if self.motion_model_cfg['apply_motion_model']:#apply_motion_model= 1
 
             # simple linear motion model
             if not self.kalman:#kalman=0
-                self.motion()# Applies a simple linear motion model that considers the last n_steps steps
-                # calculating "track.pos" based on velocity of previous frames
-                iou = self.get_motion_dist(detections, curr_it)
-
-            # kalman fiter
+                # tracks are moved only once per frame (lazy embeddings)
+                if not self.motion_stepped:
+                    self.motion()# Applies a simple linear motion model that considers the last n_steps steps
+                    # calculating "track.pos" based on velocity of previous frames
+                iou = self.get_motion_dist(detections, curr_it, self.blocks)
+
+            # kalman fiter, states were predicted before gating
+            elif self.blocks is not None:
+                iou = self.blockwise(
+                    lambda rows, cols: get_iou_kalman(
+                        self.kalman_tlbrs[cols], detections.boxes[rows]),
+                    self.blocks, (len(detections), len(col_ids)), fill=1,
+                    dtype=np.float64)
             else:
-                self.motion(only_vel=True)
-                stracks = multi_predict(
-                    self.tracks,
-                    curr_it,
-                    self.shared_kalman)
-                iou = get_iou_kalman(stracks, detections)
+                iou = get_iou_kalman(self.kalman_tlbrs, detections.boxes)
 
             # combine motion distances
             dist = self.combine_motion_appearance(iou, dist)
@@ -345,14 +652,26 @@ class Tracker(BaseTracker):
                 dist[:, num_active:] <= self.inact_reid_thresh, dist[:, num_active:], dist[:, num_active:] + large_value)
                 # dist[:, num_active:] <= self.inact_reid_thresh, dist[:, num_active:], np.nan)
 
+        # pairs outside of the gate can not be assigned
+        if self.feasible is not None:
+            dist[~self.feasible] = large_value
+
         # solve at once
         if not sep: #if based on sep value in "combine_motion_appearance" dist of active and inactive was not separate
             # np.savetxt("dist_matrix.txt", dist, fmt='%.6f')
-            row, col = solve_dense(dist)
+            row, col = self.solve_feasible(
+                dist, self.feasible,
+                self.column_thresh(num_active, dist.shape[1]), col_ids,
+                self.blocks)
         # solve active first and inactive later
         else:
             dist_act = dist[:, :num_active]
-            row, col = solve_dense(dist_act)
+            row, col = self.solve_feasible(
+                dist_act, self.feasible[:, :num_active]
+                if self.feasible is not None else None,
+                self.column_thresh(num_active, num_active),
+                col_ids[:num_active],
+                restrict_blocks(self.blocks, cols=np.arange(num_active)))
             if num_active > 0:
                 dist_inact = dist[:, num_active:]
             else:
@@ -361,6 +680,80 @@ class Tracker(BaseTracker):
 
         return dist, row, col
 
+    def column_thresh(self, num_active, num_cols):
+        """
+        Matching threshold of every track column, None if the thresholds of
+        the columns are not determined yet. Adaptive thresholds ('every'
+        or 'tbd') are determined by update_thresholds as soon as there are
+        active or inactive tracks, only thresholds of existing columns are
+        needed.
+        """
+        num_inactive = num_cols - num_active
+        if (num_active and isinstance(self.act_reid_thresh, str)) or \
+                (num_inactive and isinstance(self.inact_reid_thresh, str)):
+            return None
+        return np.r_[
+            np.full(num_active, self.act_reid_thresh, dtype=np.float64),
+            np.full(num_inactive, self.inact_reid_thresh, dtype=np.float64)]
+
+    def solve_feasible(self, dist, feasible=None, thresh=None, col_ids=None,
+                       blocks=None):
+        """
+        Solve assignment with the configured solver backend, indices
+        refer to the full cost matrix. Pairs below the matching thresholds
+        of the columns (and inside of the gate) are feasible, if
+        decomposed every connected component of feasible pairs is solved
+        on its own. The dense scipy solve without decomposition is solved
+        on all detections and tracks with at least one pair inside of the
+        gate. col_ids are the track ids of the columns. If class blocks
+        are given, every block is solved on its own.
+        """
+        if blocks is not None:
+            results = self.map_blocks(
+                lambda rows, cols: self.solve_block(
+                    dist[np.ix_(rows, cols)],
+                    feasible[np.ix_(rows, cols)]
+                    if feasible is not None else None,
+                    thresh[cols] if thresh is not None else None,
+                    [col_ids[c] for c in cols]
+                    if col_ids is not None else None),
+                blocks)
+            row = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+                rows[r] for (rows, _), (r, _) in zip(blocks, results)])
+            col = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+                cols[c] for (_, cols), (_, c) in zip(blocks, results)])
+            order = np.argsort(row, kind='stable')
+            return row[order], col[order]
+
+        return self.solve_block(
+            dist, feasible, thresh, col_ids, pool=self.lap_pool)
+
+    def solve_block(self, dist, feasible=None, thresh=None, col_ids=None,
+                    pool=None):
+        """
+        Solve assignment of one block, large components are solved in the
+        thread pool if given
+        """
+        lap_cfg = self.tracker_cfg['lap']
+        if thresh is not None and \
+                (lap_cfg['decompose'] or self.lap_solver.name != 'scipy'):
+            below = dist < thresh
+            if feasible is not None:
+                below &= feasible
+            return solve_decomposed(
+                dist, below,
+                solver=self.lap_solver,
+                col_ids=col_ids,
+                pool=pool,
+                min_parallel=lap_cfg['min_parallel'],
+                min_decompose=40000 if lap_cfg['decompose'] else np.inf)
+        if feasible is None:
+            return solve_dense(dist)
+        rows = np.nonzero(feasible.any(axis=1))[0]
+        cols = np.nonzero(feasible.any(axis=0))[0]
+        row, col = solve_dense(dist[np.ix_(rows, cols)])
+        return rows[row], cols[col]
+
     def get_hungarian_with_proxy(self, detections, sep=False):
         """
         Use proxy feature vectors for distance computation
@@ -370,7 +763,7 @@ class Tracker(BaseTracker):
         y_inactive, y = None, None
 
         # x = ReId features of detected objects at current frame
-        x = torch.stack([t['feats'] for t in detections])
+        x = detections.feats
 
         # Get active track proxies
         if len(self.tracks) > 0:
@@ -382,15 +775,15 @@ class Tracker(BaseTracker):
                     tracker_cfg=self.tracker_cfg,
                     mv_avg=self.mv_avg) #mv_avg =moving average, initialized with empty dict at setup_seq
             else:
-                y = torch.stack(# y is assembling ReID features of all detections (active tracks) in current frame
-                    [track.feats for track in self.tracks.values()])
+                # y is assembling ReID features of last detections of all
+                # active tracks
+                y = self.track_store.feats_of(self.tracks.keys())
             ids += list(self.tracks.keys())
         # get num active tracks
         num_active = len(ids)
 
         # get inactive tracks with inactive < patience
-        curr_it = {k: track for k, track in self.inactive_tracks.items()
-                   if track.inactive_count <= self.inact_patience}
+        curr_it = self.curr_it
         # get inactive track proxies
         if len(curr_it) > 0:
             if self.tracker_cfg['avg_inact']['do']:
@@ -400,8 +793,7 @@ class Tracker(BaseTracker):
                     tracker_cfg=self.tracker_cfg,
                     mv_avg=self.mv_avg)
             else:
-                y_inactive = torch.stack([track.feats
-                                         for track in curr_it.values()])
+                y_inactive = self.track_store.feats_of(curr_it.keys())
 
             # Concatenating ReID features of active and inactive tracks
             if len(self.tracks) > 0:
@@ -414,17 +806,12 @@ class Tracker(BaseTracker):
         # if no active or inactive tracks --> return and instantiate all dets
         # new
         elif len(curr_it) == 0 and len(self.tracks) == 0:
-            for detection in detections:
-                self.tracks[self.id] = Track(
-                    track_id=self.id,
-                    **detection,
-                    kalman=self.kalman,
-                    kalman_filter=self.kalman_filter)
-                self.id += 1
+            for j in range(len(detections)):
+                self.new_track(detections, j)
             return None, None, None, None
 
         # get distance between proxy features and detection features
-        dist = self.dist(x, y)
+        dist = self.gated_dist(x, y, self.feasible, blocks=self.blocks)
 
         # solve hungarian
         dist, row, col = self.solve_hungarian(
@@ -432,6 +819,25 @@ class Tracker(BaseTracker):
 
         return dist, row, col, ids
 
+    def expire_inactive(self):
+        """
+        Move inactive tracks that were not seen for more than
+        inact_patience frames up to the previous frame to the archive.
+        Inactive tracks are kept in a min-heap of last seen frames, entries
+        of tracks that were reactivated in the meantime are skipped.
+        """
+        while len(self.expiry) and \
+                self.expiry[0][0] < self.prev_frame - self.inact_patience:
+            last_seen, k = heapq.heappop(self.expiry)
+            track = self.inactive_tracks.get(k)
+            if track is not None and track.last_seen == last_seen:
+                self.archived_tracks[k] = self.inactive_tracks.pop(k)
+                self.gallery.remove(k)
+                self.motion_buffer.remove(k)
+                self.track_store.remove(k)
+                if self.kalman:
+                    self.kalman_store.remove(k)
+
     def assign(self, detections, dist, row, col, ids, sep=False):
         """
         Filter hungarian assignments using matching thresholds
@@ -439,6 +845,7 @@ class Tracker(BaseTracker):
         """
         # assign tracks from hungarian
         active_tracks = list()
+        assigned = set()
         tr_ids = [None for _ in range(len(detections))]
         if len(detections) > 0:
             if not sep:
@@ -449,31 +856,36 @@ class Tracker(BaseTracker):
                     row, col, dist, detections, active_tracks, ids, tr_ids)
 
         # move tracks not used to inactive tracks
-        keys = list(self.tracks.keys()) # self.tracks[self.id] => keys=self.id
-        for k in keys:
-            if k not in active_tracks:#If self.tracker_cfg['remove_unconfirmed'] is set to False, 
-                unconfirmed = len(#all tracks are considered unconfirmed regardless of the number of detections they have.
-                    self.tracks[k]) >= 2 if self.tracker_cfg['remove_unconfirmed'] else True
-                if unconfirmed:
-                    self.inactive_tracks[k] = self.tracks[k]
-                    self.inactive_tracks[k].inactive_count = 0
-                del self.tracks[k]
-
-        # increase inactive count by one
-        for k in self.inactive_tracks.keys():
-            self.inactive_tracks[k].inactive_count += self.frame_id - \
-                self.prev_frame
+        keys = np.fromiter(self.tracks.keys(), dtype=np.int64,
+                           count=len(self.tracks))
+        unused = keys[~np.isin(keys, np.asarray(active_tracks, dtype=np.int64))]
+        inactivated = list()
+        for k in unused.tolist():
+            #If self.tracker_cfg['remove_unconfirmed'] is set to False, 
+            unconfirmed = len(#all tracks are considered unconfirmed regardless of the number of detections they have.
+                self.tracks[k]) >= 2 if self.tracker_cfg['remove_unconfirmed'] else True
+            if unconfirmed:
+                self.inactive_tracks[k] = self.tracks[k]
+                self.inactive_tracks[k].inactive_order = \
+                    self.num_inactivated
+                self.num_inactivated += 1
+                heapq.heappush(
+                    self.expiry, (self.tracks[k].last_seen, k))
+                inactivated.append(k)
+            else:
+                self.gallery.remove(k)
+                self.motion_buffer.remove(k)
+                self.track_store.remove(k)
+                if self.kalman:
+                    self.kalman_store.remove(k)
+            del self.tracks[k]
+        self.track_store.set_state(inactivated, TrackStore.INACTIVE)
 
         # start new track with unassigned detections if conf > thresh
-        for i in range(len(detections)):
-            if i not in assigned and detections[i]['conf'] > self.tracker_cfg['new_track_conf']:
-                self.tracks[self.id] = Track(
-                    track_id=self.id,
-                    **detections[i],
-                    kalman=self.kalman,
-                    kalman_filter=self.kalman_filter)
-                tr_ids[i] = self.id
-                self.id += 1
+        new = detections.conf > self.tracker_cfg['new_track_conf']
+        new[list(assigned)] = False
+        for i in np.nonzero(new)[0].tolist():
+            tr_ids[i] = self.new_track(detections, i)
         return tr_ids
 
     def assign_act_inact_same_time(
@@ -489,32 +901,37 @@ class Tracker(BaseTracker):
         Assign active and inactive at the same time
         """
         # assigned contains all new detections that have been assigned
-        assigned = list()
-        for r, c in zip(row, col):
-
-            # assign tracks to active tracks if reid distance < thresh
-            if ids[c] in self.tracks.keys() and \
-                    dist[r, c] < self.act_reid_thresh:
-
-                self.tracks[ids[c]].add_detection(**detections[r])
-                active_tracks.append(ids[c])
-                assigned.append(r)
-                tr_ids[r] = ids[c]
-
-            # assign tracks to inactive tracks if reid distance < thresh
-            elif ids[c] in self.inactive_tracks.keys() and \
-                    dist[r, c] < self.inact_reid_thresh:
-                # move inactive track to active
-                self.tracks[ids[c]] = self.inactive_tracks[ids[c]]
-                del self.inactive_tracks[ids[c]]
-                self.tracks[ids[c]].inactive_count = 0
-
-                self.tracks[ids[c]].add_detection(**detections[r])
-                active_tracks.append(ids[c])
-                assigned.append(r)
-                tr_ids[r] = ids[c]
-
-        return set(assigned)
+        row = np.asarray(row, dtype=np.int64)
+        col = np.asarray(col, dtype=np.int64)
+        if row.shape[0] == 0:
+            return set()
+
+        # assign to active tracks if reid distance < act thresh and to
+        # inactive tracks if reid distance < inact thresh, a threshold is
+        # only used if there are pairs of its kind (adaptive thresholds
+        # are not determined before)
+        track_ids = np.asarray(ids, dtype=np.int64)[col]
+        active = self.track_store.state[
+            self.track_store.get_slots(track_ids)] == TrackStore.ACTIVE
+        accept = np.zeros(row.shape[0], dtype=bool)
+        for kind, thresh in [(active, self.act_reid_thresh),
+                             (~active, self.inact_reid_thresh)]:
+            if kind.any():
+                accept[kind] = dist[row[kind], col[kind]] < thresh
+
+        row, track_ids = row[accept].tolist(), track_ids[accept].tolist()
+        reactivated = list()
+        for r, k, a in zip(row, track_ids, active[accept].tolist()):
+            # move inactive track to active
+            if not a:
+                self.tracks[k] = self.inactive_tracks.pop(k)
+                reactivated.append(k)
+            self.tracks[k].add_from_batch(detections, r)
+            tr_ids[r] = k
+        self.track_store.set_state(reactivated, TrackStore.ACTIVE)
+        active_tracks.extend(track_ids)
+
+        return set(row)
 
     def assign_separatly(
             self,
@@ -547,13 +964,21 @@ class Tracker(BaseTracker):
 
             if len(u) != 0:
                 dist[1] = dist[1][u, :]
-
-                row_inact, col_inact = solve_dense(dist[1])
+                feasible = self.feasible[u, dist[0].shape[1]:] \
+                    if self.feasible is not None else None
+
+                row_inact, col_inact = self.solve_feasible(
+                    dist[1], feasible,
+                    self.column_thresh(0, dist[1].shape[1]),
+                    ids[dist[0].shape[1]:],
+                    restrict_blocks(
+                        self.blocks, rows=np.asarray(u),
+                        cols=np.arange(dist[0].shape[1], len(ids))))
                 assigned_2 = self.assign_act_inact_same_time(
                     row=row_inact,
                     col=col_inact,
                     dist=dist[1],
-                    detections=[t for i, t in enumerate(detections) if i in u],
+                    detections=detections.subset(u),
                     active_tracks=active_tracks,
                     ids=ids[dist[0].shape[1]:],
                     tr_ids=tr_ids)
@@ -9,6 +9,8 @@ from torch.autograd import Variable
 from src.kalman import KalmanFilter
 from cython_bbox import bbox_overlaps as bbox_ious
 import torch.nn.functional as F
+import resource
+from collections import defaultdict, deque
 
 
 mot_fps = {
@@ -52,6 +54,37 @@ def box_area(boxes):
     return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
 
 
+def cosine_distance(x, y, x_normalized=False, y_normalized=False,
+                    dtype='float32'):
+    """
+    Cosine distance 1 - x y^T of L2-normalized features using one matrix
+    multiplication (no N x D x M intermediate), dtype of accumulation
+    either 'float32' or 'float16'
+    """
+    if not x_normalized:
+        x = F.normalize(x, p=2, dim=1)
+    if not y_normalized:
+        y = F.normalize(y, p=2, dim=1)
+    dtype = getattr(torch, dtype)
+    sim = torch.mm(x.to(dtype), y.to(dtype).t()).float()
+
+    return 1 - sim
+
+
+def euclidean_distance(x, y, dtype='float32'):
+    """
+    Euclidean distance using ||x||^2 + ||y||^2 - 2 x y^T, i.e., one matrix
+    multiplication, dtype of accumulation either 'float32' or 'float16'
+    """
+    x2 = (x * x).sum(dim=1)
+    y2 = (y * y).sum(dim=1)
+    dtype = getattr(torch, dtype)
+    xy = torch.mm(x.to(dtype), y.to(dtype).t()).float()
+    dist = x2[:, None] + y2[None, :] - 2 * xy
+
+    return dist.clamp_(min=0).sqrt_()
+
+
 def bisoftmax(x, y):
     feats = torch.mm(x, y.t())/0.1
     d2t_scores = feats.softmax(dim=1)
@@ -74,43 +107,20 @@ def get_proxy(curr_it, mode='inact', tracker_cfg=None, mv_avg=None):
     for i, it in curr_it.items():
         # take last bb only
         if proxy == 'last':
-            f = it.past_feats[-1]
-
-        # take the first only
-        elif avg == 'first':
-            f = it.past_feats[0]
+            f = it.feats
 
         # moving average of features
         elif proxy == 'mv_avg':
             if i not in mv_avg.keys():
-                f = it.past_feats[-1]
+                f = it.feats
             else:
-                f = mv_avg[i] * avg + it.past_feats[-1] * (1-avg)
+                f = mv_avg[i] * avg + it.feats * (1-avg)
             mv_avg[i] = f
 
-        # take all if all or number of features < avg
-        elif avg == 'all' or len(it.past_feats) < avg:
-            if proxy == 'mean':
-                f = torch.mean(torch.stack(it.past_feats), dim=0)
-            elif proxy == 'median':
-                f = torch.median(torch.stack(it.past_feats), dim=0)[0]
-            elif proxy == 'mode':
-                f = torch.mode(torch.stack(it.past_feats), dim=0)[0]
-            elif proxy == 'meannorm':
-                f = F.normalize(torch.mean(torch.stack(
-                    it.past_feats), dim=0), p=2, dim=0)
-
-        # get proxy of last avg number of frames
+        # mean, median, mode or meannorm of all or last avg number of
+        # frames, maintained by track
         else:
-            if proxy == 'mean':
-                f = torch.mean(torch.stack(it.past_feats[-avg:]), dim=0)
-            elif proxy == 'median':
-                f = torch.median(torch.stack(it.past_feats[-avg:]), dim=0)[0]
-            elif proxy == 'mode':
-                f = torch.mode(torch.stack(it.past_feats[-avg:]), dim=0)[0]
-            elif proxy == 'meannorm':
-                f = F.normalize(torch.mean(torch.stack(
-                    it.past_feats[-avg:]), dim=0), p=2, dim=1)
+            f = it.proxy_feats(proxy, avg)
 
         feats.append(f)
 
@@ -243,6 +253,491 @@ def tlrb_to_xyah(tlrb):
     return ret
 
 
+def segment_reduce(dist, offsets, counts, mode):
+    """
+    Reduce distances dist (num_dets x num_rows) over contiguous segments of
+    columns given by offsets and counts, mode corresponds to
+    avg_inact num: 1 = min, 2 = mean, 3 = max, 4 = (max + min) / 2,
+    5 = median. Returns num_dets x num_segments.
+    """
+    if mode == 1:
+        return np.minimum.reduceat(dist, offsets, axis=1)
+    elif mode == 2:
+        return (np.add.reduceat(dist.astype(np.float64), offsets, axis=1) /
+                counts).astype(dist.dtype)
+    elif mode == 3:
+        return np.maximum.reduceat(dist, offsets, axis=1)
+    elif mode == 4:
+        return (np.maximum.reduceat(dist, offsets, axis=1) +
+                np.minimum.reduceat(dist, offsets, axis=1)) / 2
+    elif mode == 5:
+        # sort within segments by shifting every segment by its index
+        seg = np.repeat(np.arange(counts.shape[0]), counts)
+        span = np.float64(np.nanmax(dist) - np.nanmin(dist)) + 1
+        order = np.argsort(dist + seg * span, axis=1)
+        sorted_dist = np.take_along_axis(dist, order, axis=1)
+        low = sorted_dist[:, offsets + (counts - 1) // 2]
+        high = sorted_dist[:, offsets + counts // 2]
+        return (low + high) / 2
+
+
+class FeatureGallery():
+    """
+    Packed storage of the embeddings of all detections of all tracks of
+    a sequence. Embeddings are appended to one contiguous matrix and
+    owner stores the track id of every row, rows of a set of tracks are
+    gathered per frame as contiguous segments (see segments). rows keeps
+    the rows of every track in order of its embedding bank.
+    """
+    def __init__(self, normalize=False, capacity=1024):
+        self.normalize = normalize
+        self.feats = None
+        self.owner = np.full(capacity, -1, dtype=np.int64)
+        self.rows = defaultdict(list)
+        self.size = 0
+        self.num_removed = 0
+
+    def append(self, track_id, feats):
+        """
+        Append embedding of new detection of track
+        """
+        if self.normalize:
+            feats = F.normalize(feats, p=2, dim=0)
+        if self.feats is None:
+            self.feats = feats.new_empty(
+                (self.owner.shape[0], feats.shape[0]))
+        elif self.size == self.owner.shape[0]:
+            # double capacity
+            self.feats = torch.cat([self.feats, torch.empty_like(self.feats)])
+            self.owner = np.concatenate(
+                [self.owner, np.full_like(self.owner, -1)])
+        self.feats[self.size] = feats
+        self.owner[self.size] = track_id
+        self.rows[track_id].append(self.size)
+        self.size += 1
+
+    def replace(self, track_id, j, feats):
+        """
+        Replace j-th embedding of track
+        """
+        if self.normalize:
+            feats = F.normalize(feats, p=2, dim=0)
+        self.feats[self.rows[track_id][j]] = feats
+
+    def remove_first(self, track_id):
+        """
+        Remove oldest embedding of track
+        """
+        self.owner[self.rows[track_id].pop(0)] = -1
+        self.num_removed += 1
+        self.compact()
+
+    def remove(self, track_id):
+        """
+        Remove all embeddings of track
+        """
+        rows = self.rows.pop(track_id, [])
+        self.owner[rows] = -1
+        self.num_removed += len(rows)
+        self.compact()
+
+    def compact(self):
+        """
+        Move rows together if more than half of the rows are removed
+        """
+        if self.num_removed <= self.size / 2:
+            return
+        keep = np.nonzero(self.owner[:self.size] >= 0)[0]
+        new_rows = np.full(self.size, -1, dtype=np.int64)
+        new_rows[keep] = np.arange(keep.shape[0])
+
+        self.feats[:keep.shape[0]] = self.feats[
+            torch.from_numpy(keep).to(self.feats.device)]
+        self.owner[:keep.shape[0]] = self.owner[keep]
+        self.owner[keep.shape[0]:] = -1
+        for track_id, rows in self.rows.items():
+            self.rows[track_id] = new_rows[rows].tolist()
+        self.size = keep.shape[0]
+        self.num_removed = 0
+
+    def segments(self, track_ids):
+        """
+        Get embeddings of given tracks as one matrix in which the rows of
+        every track form a contiguous segment (in order of track_ids,
+        within segment in order of detections) and segment offsets and
+        lengths
+        """
+        owner = self.owner[:self.size]
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+
+        # segment index of every row, -1 if track not requested
+        seg_of_id = np.full(
+            max(owner.max(), track_ids.max()) + 2, -1, dtype=np.int64)
+        seg_of_id[track_ids + 1] = np.arange(track_ids.shape[0])
+        seg = seg_of_id[owner + 1]
+
+        rows = np.nonzero(seg >= 0)[0]
+        rows = rows[np.argsort(seg[rows], kind='stable')]
+        counts = np.bincount(seg[rows], minlength=track_ids.shape[0])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        feats = self.feats[torch.from_numpy(rows).to(self.feats.device)]
+
+        return feats, offsets, counts
+
+
+class RetentionPolicy():
+    """
+    How much of the history of a track is kept in memory:
+        * motion history (positions and frames in the MotionBuffer,
+          labels as ring buffers) of motion_len entries (last_n_frames
+          of motion model)
+        * embeddings used for proxies: all (feats = 0), the last feats
+          or a reservoir sample of feats embeddings
+    Output only fields are spilled to a ResultBuffer.
+    """
+    def __init__(self, motion_len=None, feats=0, feats_sampling='last',
+                 seed=0):
+        self.motion_len = motion_len
+        self.feats = feats
+        self.feats_sampling = feats_sampling
+        self.rng = np.random.RandomState(seed)
+
+    def buffer(self):
+        return deque(maxlen=self.motion_len)
+
+
+class TrackStore():
+    """
+    Per track state of all tracks of a sequence in contiguous arrays, one
+    index-stable slot per track (slots of removed tracks are reused):
+    latest embedding, label of last detection, state (active or inactive)
+    and frame of last detection. Positions and velocities are kept in the
+    MotionBuffer. Slots are looked up with an array indexed by track id,
+    so attributes of many tracks are gathered without iterating over
+    Track objects.
+    """
+    ACTIVE, INACTIVE = 1, 2
+
+    def __init__(self, capacity=256):
+        self.slot_of = np.full(capacity, -1, dtype=np.int64)
+        self.free = list(range(capacity - 1, -1, -1))
+        self.feats = None
+        self.label = np.zeros(capacity, dtype=np.float64)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+
+    def _grow(self):
+        """
+        Double number of slots
+        """
+        capacity = self.state.shape[0]
+        for k in ['label', 'state', 'last_seen']:
+            col = getattr(self, k)
+            setattr(self, k, np.concatenate([col, np.zeros_like(col)]))
+        if self.feats is not None:
+            self.feats = torch.cat([self.feats, torch.zeros_like(self.feats)])
+        self.free = list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def add(self, track_id):
+        """
+        Get slot of new track, it starts as active track
+        """
+        if track_id >= self.slot_of.shape[0]:
+            self.slot_of = np.concatenate([self.slot_of, np.full(
+                max(track_id + 1, self.slot_of.shape[0]), -1,
+                dtype=np.int64)])
+        if not len(self.free):
+            self._grow()
+        s = self.free.pop()
+        self.slot_of[track_id] = s
+        self.state[s] = self.ACTIVE
+        return s
+
+    def update(self, track_id, feats, label, frame):
+        """
+        Store latest embedding, label and frame of detection of track, the
+        embedding is kept if the detection was not embedded (feats None)
+        """
+        s = self.slot_of[track_id]
+        if feats is not None:
+            if self.feats is None:
+                self.feats = feats.new_zeros(
+                    (self.state.shape[0], ) + feats.shape)
+            self.feats[s] = feats
+        self.label[s] = label
+        self.last_seen[s] = frame
+
+    def remove(self, track_id):
+        if track_id < self.slot_of.shape[0] and self.slot_of[track_id] >= 0:
+            self.state[self.slot_of[track_id]] = 0
+            self.free.append(self.slot_of[track_id])
+            self.slot_of[track_id] = -1
+
+    def get_slots(self, track_ids):
+        return self.slot_of[np.fromiter(track_ids, dtype=np.int64)]
+
+    def set_state(self, track_ids, state):
+        self.state[self.get_slots(track_ids)] = state
+
+    def feats_of(self, track_ids):
+        """
+        Latest embeddings of tracks as one matrix
+        """
+        slots = torch.from_numpy(self.get_slots(track_ids))
+        return self.feats[slots.to(self.feats.device)]
+
+    def labels_of(self, track_ids):
+        return self.label[self.get_slots(track_ids)]
+
+
+class MotionBuffer():
+    """
+    Preallocated motion state of all tracks of a sequence, one slot per
+    track: the last length positions and frames of detections
+    (chronological, oldest first), the current position and velocity.
+    The linear motion model of all tracks is computed in one vectorized
+    pass over these arrays (see step). Slots of removed tracks are reused.
+    The step axis starts with at most 16 steps and is doubled on demand up
+    to length.
+    """
+    def __init__(self, length=None, capacity=256):
+        self.length = length
+        self.slots = dict()
+        self.free = list(range(capacity - 1, -1, -1))
+        steps = min(length, 16) if length is not None else 16
+        self.last_pos = np.zeros((capacity, steps, 4), dtype=np.float32)
+        self.frames = np.zeros((capacity, steps), dtype=np.float64)
+        self.num = np.zeros(capacity, dtype=np.int64)
+        self.pos = np.zeros((capacity, 4), dtype=np.float64)
+        self.v = np.zeros((capacity, 4), dtype=np.float64)
+
+    def _grow(self):
+        """
+        Double number of slots
+        """
+        capacity = self.num.shape[0]
+        for k in ['last_pos', 'frames', 'num', 'pos', 'v']:
+            col = getattr(self, k)
+            setattr(self, k, np.concatenate([col, np.zeros_like(col)]))
+        self.free = list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _grow_steps(self):
+        """
+        Double number of steps, at most length steps
+        """
+        steps = self.last_pos.shape[1]
+        new = steps if self.length is None else \
+            min(steps, self.length - steps)
+        self.last_pos = np.concatenate([self.last_pos, np.zeros(
+            (self.last_pos.shape[0], new, 4), dtype=self.last_pos.dtype)],
+            axis=1)
+        self.frames = np.concatenate([self.frames, np.zeros(
+            (self.frames.shape[0], new), dtype=self.frames.dtype)], axis=1)
+
+    def add(self, track_id, bbox, frame):
+        """
+        Add detection of track, the oldest one is dropped if length
+        detections are stored already
+        """
+        if track_id not in self.slots:
+            if not len(self.free):
+                self._grow()
+            s = self.free.pop()
+            self.slots[track_id] = s
+            self.num[s] = 0
+            self.v[s] = 0
+        s = self.slots[track_id]
+
+        n = self.num[s]
+        if n == self.last_pos.shape[1]:
+            if self.length is not None and n >= self.length:
+                self.last_pos[s, :-1] = self.last_pos[s, 1:]
+                self.frames[s, :-1] = self.frames[s, 1:]
+                n -= 1
+            else:
+                self._grow_steps()
+        self.last_pos[s, n] = bbox
+        self.frames[s, n] = frame
+        self.num[s] = n + 1
+        self.pos[s] = bbox
+
+    def remove(self, track_id):
+        s = self.slots.pop(track_id, None)
+        if s is not None:
+            self.free.append(s)
+
+    def get_slots(self, track_ids):
+        return np.fromiter((self.slots[k] for k in track_ids),
+                           dtype=np.int64)
+
+    def history(self, track_id):
+        """
+        Stored positions and frames of track, oldest first (views)
+        """
+        s = self.slots[track_id]
+        return self.last_pos[s, :self.num[s]], self.frames[s, :self.num[s]]
+
+    def velocity(self, slots, center_only=False, approximate=False):
+        """
+        Mean velocity between consecutive stored positions of tracks at
+        slots (per frame, per detection if approximate). Velocities of
+        the center are returned as (vx, vy, vx, vy) if center_only.
+        """
+        # only steps up to the longest stored history of the tracks
+        steps = max(int(self.num[slots].max()), 1) if slots.shape[0] else 1
+        last_pos = self.last_pos[slots, :steps]
+        if center_only:
+            center = np.stack([
+                (last_pos[:, :, 0] + last_pos[:, :, 2]) / 2,
+                (last_pos[:, :, 1] + last_pos[:, :, 3]) / 2], axis=2)
+            vs = center[:, 1:] - center[:, :-1]
+        else:
+            vs = last_pos[:, 1:] - last_pos[:, :-1]
+
+        # mask pairs beyond the stored positions
+        num_pairs = self.num[slots] - 1
+        valid = np.arange(vs.shape[1])[None, :] < num_pairs[:, None]
+        if approximate:
+            vs = np.where(valid[:, :, None], vs, 0)
+        else:
+            frames = self.frames[slots, :steps]
+            dt = np.where(valid, frames[:, 1:] - frames[:, :-1], 1)
+            vs = np.where(valid[:, :, None], vs / dt[:, :, None], 0)
+        v = vs.sum(axis=1) / np.maximum(num_pairs, 1)[:, None]
+
+        if center_only:
+            v = np.concatenate([v, v], axis=1)
+        return v
+
+    def step(self, active, inactive, center_only=False, approximate=False):
+        """
+        Linear motion step of all tracks: the velocity of active tracks
+        with more than one detection is updated to the mean velocity over
+        the stored positions, all tracks are moved by their velocity
+        """
+        active = self.get_slots(active)
+        active = active[self.num[active] > 1]
+        if active.shape[0]:
+            self.v[active] = self.velocity(active, center_only, approximate)
+
+        slots = np.concatenate([active, self.get_slots(inactive)])
+        if slots.shape[0]:
+            self.pos[slots] = self.pos[slots] + self.v[slots]
+
+    def positions(self, track_ids):
+        return self.pos[self.get_slots(track_ids)]
+
+    def warp(self, track_ids, warp_matrix):
+        """
+        Warp stored positions of given tracks in place with a 2x3 affine
+        or 3x3 homography warp matrix (e.g., from ECC), all corners are
+        transformed in one batched matrix product
+        """
+        # only positions up to the number of stored detections
+        slots = self.get_slots(track_ids)
+        valid = np.arange(self.last_pos.shape[1])[None, :] < \
+            self.num[slots][:, None]
+        rows, steps = np.nonzero(valid)
+        if not rows.shape[0]:
+            return
+        slots = slots[rows]
+
+        # corners as homogeneous points
+        warp_matrix = np.asarray(warp_matrix, dtype=np.float64)
+        corners = self.last_pos[slots, steps].reshape(-1, 2)
+        corners = np.concatenate(
+            [corners, np.ones((corners.shape[0], 1))], axis=1)
+        warped = corners @ warp_matrix.T
+        if warp_matrix.shape[0] == 3:
+            warped = warped[:, :2] / warped[:, 2:]
+        self.last_pos[slots, steps] = warped.reshape(-1, 4)
+
+
+class ResultBuffer():
+    """
+    Columnar storage of output only fields of all detections of all
+    tracks of a sequence (track id, image index, bb, label, gt id and
+    visibility)
+    """
+    def __init__(self, capacity=4096):
+        self.size = 0
+        self.track_id = np.empty(capacity, dtype=np.int64)
+        self.im_index = np.empty(capacity, dtype=np.int64)
+        self.bbox = np.empty((capacity, 4), dtype=np.float32)
+        self.label = None
+        self.gt_id = np.empty(capacity, dtype=np.float64)
+        self.vis = np.empty(capacity, dtype=np.float64)
+
+    def append(self, track_id, im_index, bbox, label, gt_id, vis):
+        if self.label is None:
+            self.label = np.empty(
+                self.track_id.shape[0], dtype=np.asarray(label).dtype)
+        elif self.size == self.track_id.shape[0]:
+            # double capacity
+            for k in ['track_id', 'im_index', 'bbox', 'label', 'gt_id',
+                      'vis']:
+                col = getattr(self, k)
+                setattr(self, k, np.concatenate([col, np.empty_like(col)]))
+        i = self.size
+        self.track_id[i] = track_id
+        self.im_index[i] = im_index
+        self.bbox[i] = bbox
+        self.label[i] = label
+        self.gt_id[i] = gt_id
+        self.vis[i] = vis
+        self.size += 1
+
+    def tracks(self, track_ids):
+        """
+        Get {..., i: {im_index: [x1, y1, x2, y2, label], ...}, ...} of
+        given tracks in order of track_ids and of detections
+        """
+        results = defaultdict(dict)
+        track_ids = np.asarray(list(track_ids), dtype=np.int64)
+        if self.size == 0 or track_ids.shape[0] == 0:
+            return results
+
+        # position of track in track_ids, -1 if not requested
+        track_id = self.track_id[:self.size]
+        pos_of_id = np.full(
+            max(track_id.max(), track_ids.max()) + 1, -1, dtype=np.int64)
+        pos_of_id[track_ids] = np.arange(track_ids.shape[0])
+        pos = pos_of_id[track_id]
+        rows = np.nonzero(pos >= 0)[0]
+        rows = rows[np.argsort(pos[rows], kind='stable')]
+        for i, im_index, bbox, label in zip(
+                self.track_id[rows].tolist(), self.im_index[rows].tolist(),
+                self.bbox[rows].tolist(), self.label[rows].tolist()):
+            results[i][im_index] = bbox + [label]
+        return results
+
+
+def reset_peak_rss():
+    """
+    Reset peak resident set size of process (Linux only)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    Peak resident set size of process in MB since last reset
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
 class Track():
     def __init__(
             self,
@@ -255,90 +750,219 @@ class Track():
             frame,
             label,
             kalman=False,
-            kalman_filter=None):
+            kalman_store=None,
+            gallery=None,
+            retention=None,
+            results=None,
+            motion_buffer=None,
+            track_store=None):
         self.kalman = kalman
         self.xyah = tlrb_to_xyah(copy.deepcopy(bbox))
-        if self.kalman:
-            self.kalman_filter = kalman_filter
-            self.mean, self.covariance = self.kalman_filter.initiate(
-                measurement=tlrb_to_xyah(bbox))
         self.track_id = track_id
-        self.pos = bbox
-        self.bbox = list()
-        self.bbox.append(bbox)
-
-        # init variables for motion model
-        self.last_pos = list()
-        self.last_pos.append(self.pos)
-        self.last_v = np.array([0, 0, 0, 0])
-        self.last_vc = np.array([0, 0])
-
-        # embedding feature list of detections
+        if self.kalman:
+            self.kalman_store = kalman_store
+            self.kalman_store.initiate(self.track_id, tlrb_to_xyah(bbox))
+        self.retention = retention if retention is not None \
+            else RetentionPolicy()
+        self.results = results
+        self.num_dets = 0
+
+        # positions, frames and velocity for motion model
+        self.motion_buffer = motion_buffer if motion_buffer is not None \
+            else MotionBuffer(self.retention.motion_len, capacity=1)
+
+        # latest embedding, label, state and frame of last detection
+        self.track_store = track_store if track_store is not None \
+            else TrackStore(capacity=1)
+        self.track_store.add(self.track_id)
+
+        # embedding feature list of detections and number of embeddings
+        # offered to it (detections without embedding are not counted)
         self.past_feats = list()
-        self.feats = feats
-        self.past_feats.append(feats)
-
-        # image index list of detections
-        self.past_im_indices = list()
-        self.past_im_indices.append(im_index)
-        self.im_index = im_index
-
-        # corresponding gt ids of detections
-        self.gt_id = gt_id
-        self.past_gt_ids = list()
-        self.past_gt_ids.append(gt_id)
-
-        # corresponding gt visibilities of detections
-        self.gt_vis = vis
-        self.past_gt_vis = list()
-        self.past_gt_vis.append(vis)
+        self.num_offered = 0
+        self.gallery = gallery
 
-        # initialize inactive count
-        self.inactive_count = 0
-        self.past_frames = list()
-        self.past_frames.append(frame)
+        # incrementally maintained proxies: sum of all and of the last n
+        # embeddings, proxies computed since the last detection
+        self.feats_sum = None
+        self.window_sums = dict()
+        self.proxies = dict()
 
-        # conf of current det
-        self.conf = conf
+        # labels of detections
+        self.label = self.retention.buffer()
 
-        self.past_vs = list()
+        # order in which track became inactive and frame of last detection
+        # with embedding
+        self.inactive_order = None
+        self.last_embedded = None
 
-        # labels of detections
-        self.label = list()
-        self.label.append(label)
+        self.add_detection(
+            bbox, feats, im_index, gt_id, vis, conf, frame, label)
 
     def __len__(self):
-        return len(self.last_pos)
+        return self.num_dets
 
     def add_detection(
             self, bbox, feats, im_index, gt_id, vis, conf, frame, label):
         # update all lists / states
-        self.pos = bbox
-        self.last_pos.append(bbox)
-        self.bbox.append(bbox)
+        self.num_dets += 1
+        self.motion_buffer.add(self.track_id, bbox, frame)
+        self.track_store.update(self.track_id, feats, label, frame)
+        self.label.append(label)
 
-        self.feats = feats
-        self.past_feats.append(feats)
+        # detections without embedding (lazy embeddings) keep the
+        # embedding bank of the track
+        if feats is not None:
+            self.add_feats(feats)
+            self.last_embedded = frame
 
-        self.past_im_indices.append(im_index)
         self.im_index = im_index
-
         self.gt_id = gt_id
-        self.past_gt_ids.append(gt_id)
         self.gt_vis = vis
-        self.past_gt_vis.append(vis)
-
         self.conf = conf
-        self.past_frames.append(frame)
-        self.label.append(label)
 
-        if self.kalman:
-            self.mean, self.covariance = self.kalman_filter.update(
-                self.mean, self.covariance, tlrb_to_xyah(bbox))
+        # output only fields
+        if self.results is not None:
+            self.results.append(
+                self.track_id, im_index, bbox, label, gt_id, vis)
+
+        # corrected with all matched tracks in KalmanStore.update
+        if self.kalman and self.num_dets > 1:
+            self.kalman_store.add_measurement(
+                self.track_id, tlrb_to_xyah(bbox))
+
+    def add_from_batch(self, detections, i):
+        """
+        Add i-th detection of a DetectionBatch, the aligned arrays are
+        read directly
+        """
+        self.add_detection(
+            detections.boxes[i],
+            detections.feats[i] if detections.feats is not None else None,
+            detections.frame, detections.gt_id[i], detections.vis[i],
+            detections.conf[i], detections.frame, detections.label[i])
+
+    def add_feats(self, feats):
+        """
+        Add embedding to embedding bank of track following the retention
+        policy
+        """
+        self.feats = feats
+        self.proxies = dict()
+        self.num_offered += 1
+        size = self.retention.feats
+        if not size or len(self.past_feats) < size:
+            self.past_feats.append(feats)
+            if self.gallery is not None:
+                self.gallery.append(self.track_id, feats)
+
+            # update running sums
+            self.feats_sum = feats.clone() if self.feats_sum is None \
+                else self.feats_sum + feats
+            for n in self.window_sums.keys():
+                self.window_sums[n] = self.window_sums[n] + feats
+                if len(self.past_feats) > n:
+                    self.window_sums[n] -= self.past_feats[-n - 1]
+
+        # reservoir sampling: keep with probability size / num_offered
+        elif self.retention.feats_sampling == 'reservoir':
+            j = self.retention.rng.randint(self.num_offered)
+            if j < size:
+                self.feats_sum = self.feats_sum + feats - self.past_feats[j]
+                # only windows of the last n embeddings that contain j
+                for n in self.window_sums.keys():
+                    if j >= len(self.past_feats) - n:
+                        self.window_sums[n] = self.window_sums[n] + feats - \
+                            self.past_feats[j]
+                self.past_feats[j] = feats
+                if self.gallery is not None:
+                    self.gallery.replace(self.track_id, j, feats)
+
+        # keep last size embeddings
+        else:
+            self.feats_sum = self.feats_sum + feats - self.past_feats[0]
+            self.past_feats.append(feats)
+            for n in self.window_sums.keys():
+                self.window_sums[n] = self.window_sums[n] + feats - \
+                    self.past_feats[-n - 1]
+            self.past_feats.pop(0)
+            if self.gallery is not None:
+                self.gallery.remove_first(self.track_id)
+                self.gallery.append(self.track_id, feats)
+
+    def proxy_feats(self, proxy, avg):
+        """
+        Proxy feature (mean, median, mode or meannorm) of all (avg = 'all'
+        or less than avg embeddings) or the last avg embeddings. Only
+        recomputed if the track got a new detection, means use running
+        sums.
+        """
+        if (proxy, avg) in self.proxies:
+            return self.proxies[(proxy, avg)]
+
+        use_all = avg == 'all' or len(self.past_feats) < avg
+        if proxy in ['mean', 'meannorm']:
+            if use_all:
+                f = self.feats_sum / len(self.past_feats)
+            else:
+                if avg not in self.window_sums:
+                    self.window_sums[avg] = torch.sum(
+                        torch.stack(self.past_feats[-avg:]), dim=0)
+                f = self.window_sums[avg] / avg
+            if proxy == 'meannorm':
+                f = F.normalize(f, p=2, dim=0)
+        else:
+            feats = torch.stack(
+                self.past_feats if use_all else self.past_feats[-avg:])
+            if proxy == 'median':
+                f = torch.median(feats, dim=0)[0]
+            elif proxy == 'mode':
+                f = torch.mode(feats, dim=0)[0]
+
+        self.proxies[(proxy, avg)] = f
+        return f
+
+    @property
+    def last_seen(self):
+        """
+        Frame of last detection, inactive count = current frame - last_seen
+        """
+        return self.track_store.last_seen[
+            self.track_store.slot_of[self.track_id]]
+
+    @property
+    def pos(self):
+        return self.motion_buffer.pos[self.motion_buffer.slots[self.track_id]]
+
+    @pos.setter
+    def pos(self, pos):
+        self.motion_buffer.pos[self.motion_buffer.slots[self.track_id]] = pos
+
+    @property
+    def last_v(self):
+        return self.motion_buffer.v[self.motion_buffer.slots[self.track_id]]
+
+    @property
+    def last_pos(self):
+        return self.motion_buffer.history(self.track_id)[0]
+
+    @property
+    def past_frames(self):
+        return self.motion_buffer.history(self.track_id)[1]
+
+    @property
+    def mean(self):
+        if not self.kalman:
+            return None
+        return self.kalman_store.mean[self.kalman_store.slots[self.track_id]]
+
+    @property
+    def covariance(self):
+        return self.kalman_store.covariance[
+            self.kalman_store.slots[self.track_id]]
 
     def update_v(self, v):
-        self.past_vs.append(v)
-        self.last_v = v
+        self.motion_buffer.v[self.motion_buffer.slots[self.track_id]] = v
 
     @property
     # @jit(nopython=True)
@@ -347,7 +971,7 @@ class Track():
                 width, height)`.
         """
         if self.mean is None:
-            return self.bbox.copy()
+            return self.pos.copy()
         ret = self.mean[:4].copy()
         ret[2] *= ret[3]
         ret[:2] -= ret[2:] / 2
@@ -365,39 +989,23 @@ class Track():
         return ret
 
 
-def multi_predict(active, inactive, shared_kalman):
-    state = list()
-    act = [v for v in active.values()]
-    state.extend([1]*len(act))
-    inact = [v for v in inactive.values()]
-    state.extend([0]*len(inact))
-    stracks = act + inact
-    if len(stracks) > 0:
-        multi_mean = np.asarray([st.mean.copy() for st in stracks])
-        multi_covariance = np.asarray([st.covariance for st in stracks])
-        for i, (st, act) in enumerate(zip(stracks, state)):
-            if act != 1:
-                multi_mean[i][7] = 0
-        multi_mean, multi_covariance = shared_kalman.multi_predict(
-            multi_mean, multi_covariance)
-        for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
-            stracks[i].mean = mean
-            stracks[i].covariance = cov
-
-    return stracks
-
-
-def get_iou_kalman(tracklets, detections):
+def multi_predict(active, inactive, kalman_store):
+    """
+    Predict Kalman states of active and inactive tracks in one batch,
+    returns predicted bbs (min x, min y, max x, max y)
+    """
+    kalman_store.predict(active.keys(), inactive.keys())
+    return kalman_store.tlbr(list(active.keys()) + list(inactive.keys()))
+
+
+def get_iou_kalman(tlbrs, boxes):
     """
     Compute cost based on IoU
-    :type atracks: list[STrack]
-    :type btracks: list[STrack]
+    :type tlbrs: np.ndarray
+    :type boxes: np.ndarray (boxes of detections)
     :rtype cost_matrix np.ndarray
     """
-
-    atlbrs = [track.tlbr for track in tracklets]
-    btlbrs = [track['bbox'] for track in detections]
-    _ious = ious(atlbrs, btlbrs)
+    _ious = ious(tlbrs, boxes)
     cost_matrix = 1 - _ious
 
     return cost_matrix.T
@@ -410,13 +1018,13 @@ def ious(atlbrs, btlbrs):
     :type atlbrs: list[tlbr] | np.ndarray
     :rtype ious np.ndarray
     """
-    ious = np.zeros((len(atlbrs), len(btlbrs)), dtype=np.float)
+    ious = np.zeros((len(atlbrs), len(btlbrs)), dtype=np.float64)
     if ious.size == 0:
         return ious
 
     ious = bbox_ious(
-        np.ascontiguousarray(atlbrs, dtype=np.float),
-        np.ascontiguousarray(btlbrs, dtype=np.float)
+        np.ascontiguousarray(atlbrs, dtype=np.float64),
+        np.ascontiguousarray(btlbrs, dtype=np.float64)
     )
 
     return ious
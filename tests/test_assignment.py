@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+from src.assignment import DenseSolver, LAPSolver, get_solver, solvers, \
+    label_blocks, solve_decomposed
+from src.base_tracker import BaseTracker
+from src.tracker import Tracker
+
+
+def lap_tracker(decompose):
+    return SimpleNamespace(
+        tracker_cfg={'lap': {'decompose': decompose, 'min_parallel': 10000}},
+        lap_solver=DenseSolver())
+
+
+def sparse_costs(rng, num_rows, num_cols, thresh):
+    dist = rng.uniform(0, 1, (num_rows, num_cols))
+    # few feasible pairs per row, i.e., several components
+    dist[rng.uniform(0, 1, dist.shape) > 0.1] += 1
+    return dist, dist < thresh
+
+
+def test_decomposed_matches_dense_on_masked_costs():
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        dist, feasible = sparse_costs(rng, 60, 80, 0.5)
+        row, col = solve_decomposed(dist, feasible, min_decompose=0)
+        row_d, col_d = solve_decomposed(dist, feasible, min_decompose=np.inf)
+        assert row.shape == row_d.shape
+        np.testing.assert_allclose(
+            dist[row, col].sum(), dist[row_d, col_d].sum())
+        assert feasible[row, col].all()
+
+
+def test_default_solve_is_dense_scipy_on_raw_costs():
+    # pairs above the threshold are not masked without decomposition
+    dist = np.array([[0.5, 0.61], [0.55, 10]])
+    row, col = Tracker.solve_block(lap_tracker(0), dist, None, np.full(2, 0.6))
+    row_d, col_d = linear_sum_assignment(dist)
+    np.testing.assert_array_equal(row, row_d)
+    np.testing.assert_array_equal(col, col_d)
+    assert col[row == 1].tolist() == [0]
+
+    rng = np.random.RandomState(1)
+    dist = rng.uniform(0, 2, (30, 25))
+    row, col = Tracker.solve_block(lap_tracker(0), dist, None, np.ones(25))
+    row_d, col_d = linear_sum_assignment(dist)
+    np.testing.assert_array_equal(row, row_d)
+    np.testing.assert_array_equal(col, col_d)
+
+
+@pytest.mark.parametrize('name', [s for s in solvers if s != 'scipy'])
+def test_solver_matches_dense_solver(name):
+    try:
+        solver = get_solver(name)
+    except ImportError:
+        pytest.skip(f'{name} solver is not installed')
+    dense = DenseSolver()
+    rng = np.random.RandomState(2)
+    col_ids = np.arange(50)
+    for shape in [(12, 15), (15, 12), (40, 40)] * 5:
+        dist, feasible = sparse_costs(rng, *shape, 0.5)
+        # same tracks over frames to also use warm starts
+        ids = col_ids[:shape[1]]
+        row, col = solver.solve(dist, feasible, ids)
+        row_d, col_d = dense.solve(dist, feasible)
+        assert feasible[row, col].all()
+        assert len(set(row.tolist())) == row.shape[0]
+        assert len(set(col.tolist())) == col.shape[0]
+        assert row.shape == row_d.shape
+        np.testing.assert_allclose(
+            dist[row, col].sum(), dist[row_d, col_d].sum(), atol=1e-4)
+
+
+def test_solver_without_solve_fails_at_construction():
+    class NoSolve(LAPSolver):
+        name = 'no_solve'
+
+    with pytest.raises(TypeError):
+        NoSolve()
+
+
+def test_class_blocks_match_single_matrix_with_nan_over_classes():
+    rng = np.random.RandomState(3)
+    large_value = 1e6
+    for decompose in [0, 1]:
+        tracker = lap_tracker(decompose)
+        tracker.lap_pool = None
+        tracker.map_blocks = lambda fn, blocks: BaseTracker.map_blocks(
+            tracker, fn, blocks)
+        tracker.solve_block = lambda *args, **kwargs: Tracker.solve_block(
+            tracker, *args, **kwargs)
+        for _ in range(10):
+            labels_dets = rng.randint(0, 3, 25)
+            labels_tracks = rng.randint(0, 3, 30)
+            thresh = np.full(30, 0.5)
+            # pairs of different classes and above threshold as in
+            # solve_hungarian with nan_first
+            dist = rng.uniform(0, 1, (25, 30))
+            dist[labels_dets[:, None] != labels_tracks[None, :]] = large_value
+            dist = np.where(dist <= thresh, dist, dist + large_value)
+
+            blocks = label_blocks(labels_dets, labels_tracks)
+            row, col = Tracker.solve_feasible(
+                tracker, dist, None, thresh, None, blocks)
+            row_d, col_d = Tracker.solve_feasible(
+                tracker, dist, None, thresh, None, None)
+            keep, keep_d = dist[row, col] < thresh[col], \
+                dist[row_d, col_d] < thresh[col_d]
+            np.testing.assert_array_equal(row[keep], row_d[keep_d])
+            np.testing.assert_array_equal(col[keep], col_d[keep_d])
+
+
+def test_column_thresh_only_needs_thresholds_of_existing_columns():
+    tracker = SimpleNamespace(act_reid_thresh='tbd', inact_reid_thresh=0.5)
+    np.testing.assert_array_equal(
+        Tracker.column_thresh(tracker, 0, 3), np.full(3, 0.5))
+    assert Tracker.column_thresh(tracker, 2, 3) is None
+    tracker.act_reid_thresh = 0.3
+    np.testing.assert_array_equal(
+        Tracker.column_thresh(tracker, 2, 3), [0.3, 0.3, 0.5])
@@ -0,0 +1,36 @@
+import numpy as np
+import cv2
+from src.camera_motion import CameraMotion, rigid_warp
+
+
+def rotation(angle):
+    return np.array([[np.cos(angle), -np.sin(angle)],
+                     [np.sin(angle), np.cos(angle)]])
+
+
+def test_rigid_warp_removes_scale():
+    rng = np.random.RandomState(0)
+    pts = rng.uniform(0, 300, (50, 2))
+    rot, t = rotation(0.05), np.array([3.0, -2.0])
+    last_pts = pts @ rot.T + t
+
+    # similarity fit of scaled points has a scale, rigid warp does not
+    similarity = np.concatenate([1.1 * rot, t[:, None]], axis=1)
+    warp = rigid_warp(similarity, pts, last_pts)
+    np.testing.assert_allclose(warp[:, :2], rot, atol=1e-12)
+    np.testing.assert_allclose(warp[:, 2], t, atol=1e-9)
+
+
+def test_sparse_euclidean_is_rigid():
+    rng = np.random.RandomState(0)
+    img = cv2.GaussianBlur(
+        (rng.uniform(0, 255, (240, 320))).astype(np.uint8), (5, 5), 0)
+    # previous frame is the current frame zoomed, rotated and moved
+    m = cv2.getRotationMatrix2D((160, 120), 2, 1.05)
+    m[:, 2] += [4, -3]
+    last = cv2.warpAffine(img, m, (320, 240))
+
+    motion = CameraMotion(warp_mode='Euclidean', estimator='sparse')
+    warp = motion.sparse(img, last)
+    np.testing.assert_allclose(
+        warp[:, :2] @ warp[:, :2].T, np.eye(2), atol=1e-5)
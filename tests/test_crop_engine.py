@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+from torchvision.transforms import ToTensor
+from src.datasets.TrackingDataset import Sequence
+from src.datasets.crop_engine import CropEngine
+from ReID.data.utils import make_transform_bot
+
+# The batched engine resamples with grid_sample, the PIL path with PIL
+# resize, the normalized crops differ by interpolation noise only
+MEAN_ABS_TOL = 0.01
+MIN_COSINE = 0.999
+SZ_CROP = [384, 128]
+
+
+def make_image(img_size):
+    torch.manual_seed(0)
+    img = torch.rand(1, 3, img_size[0] // 16, img_size[1] // 16)
+    img = F.interpolate(img, size=img_size, mode='bilinear',
+                        align_corners=False)[0]
+    img = img + 0.05 * torch.rand(img.shape)
+    return (img.clamp(0, 1) * 255).round() / 255
+
+
+def make_dets(num_boxes, img_size):
+    rng = np.random.RandomState(0)
+    h, w = img_size
+    width = rng.uniform(10, 80, num_boxes)
+    height = width * rng.uniform(1.5, 3.5, num_boxes)
+    dets_unclipped = pd.DataFrame({
+        'frame': 1, 'id': -1,
+        'bb_left': rng.uniform(-0.3 * width, w - 0.7 * width),
+        'bb_top': rng.uniform(-0.3 * height, h - 0.7 * height),
+        'conf': 1.0, 'label': 1, 'vis': -1, 'frame_path': '000001.jpg'})
+    dets_unclipped['bb_right'] = dets_unclipped['bb_left'] + width
+    dets_unclipped['bb_bot'] = dets_unclipped['bb_top'] + height
+    dets = dets_unclipped.copy()
+    for col, m in [('bb_left', w), ('bb_right', w), ('bb_top', h),
+                   ('bb_bot', h)]:
+        dets[col] = np.clip(dets[col].values, 0, m).astype(int)
+    return dets, dets_unclipped
+
+
+def test_batched_crops_match_pil_crops():
+    img_size = (240, 320)
+    img = make_image(img_size)
+    dets, dets_unclipped = make_dets(12, img_size)
+    for fixed_aspect_ratio in [0, 2.5]:
+        seq = Sequence(
+            name='synthetic', dets=dets, gt=None,
+            to_pil=transforms.ToPILImage(), to_tensor=ToTensor(),
+            transform=make_transform_bot(is_train=False, sz_crop=SZ_CROP),
+            dets_unclipped=dets_unclipped,
+            fixed_aspect_ratio=fixed_aspect_ratio)
+        engine = CropEngine(
+            sz_crop=SZ_CROP, fixed_aspect_ratio=fixed_aspect_ratio)
+        boxes = seq.det_index.boxes[seq.det_index.rows(0)]
+        for padding in ['zero', 'mean', 'channel_wise_mean', 'circular']:
+            res_pil = seq._get_crops(img, boxes, padding)
+            res = engine(img, boxes[:, :4], boxes[:, 4:], padding)
+            assert res.shape == res_pil.shape
+            assert (res - res_pil).abs().mean() < MEAN_ABS_TOL
+            assert F.cosine_similarity(
+                res.flatten(1), res_pil.flatten(1), dim=1).min() > MIN_COSINE
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from torchvision import transforms
+from torchvision.transforms import ToTensor
+from src.base_tracker import BaseTracker
+from src.datasets.TrackingDataset import Sequence
+from ReID.data.utils import make_transform_bot
+
+
+def make_sequence(tmp_path, num_frames):
+    rng = np.random.RandomState(0)
+    rows = list()
+    for frame in range(1, num_frames + 1):
+        path = str(tmp_path / f'{frame:06d}.png')
+        Image.fromarray(rng.randint(0, 255, (120, 160, 3)).astype(
+            np.uint8)).save(path)
+        for _ in range(rng.randint(0, 6)):
+            left, top = rng.uniform(0, 100), rng.uniform(0, 40)
+            rows.append({
+                'frame': frame, 'id': -1, 'bb_left': left, 'bb_top': top,
+                'bb_right': left + rng.uniform(10, 50),
+                'bb_bot': top + rng.uniform(10, 70),
+                'conf': rng.uniform(0, 1), 'label': 1, 'vis': -1,
+                'frame_path': path})
+    dets = pd.DataFrame(rows)
+    return Sequence(
+        name='synthetic', dets=dets, gt=None,
+        to_pil=transforms.ToPILImage(), to_tensor=ToTensor(),
+        transform=make_transform_bot(is_train=False, sz_crop=[64, 32]),
+        dets_unclipped=dets.copy())
+
+
+def test_filtered_loading_matches_filter_after_embedding(tmp_path):
+    det_conf, h_w_thresh = 0.4, 2.0
+    seq = make_sequence(tmp_path, 6)
+    expected = list(seq)
+    seq.set_filter(det_conf, h_w_thresh)
+    out = list(seq)
+
+    for (crops, _, dets, _, _), (crops_e, _, dets_e, _, _) in \
+            zip(out, expected):
+        # filter of the original tracking loop on all detections
+        keep = [i for i, (b, c) in enumerate(zip(dets_e.boxes, dets_e.conf))
+                if (b[3] - b[1]) / (b[2] - b[0]) < h_w_thresh and
+                c >= det_conf]
+        np.testing.assert_array_equal(dets.boxes, dets_e.boxes[keep])
+        np.testing.assert_array_equal(dets.conf, dets_e.conf[keep])
+        if len(keep):
+            assert torch.equal(crops, crops_e[keep])
+        else:
+            assert crops.numel() == 0
+    num_dets = [sum(len(frame_data[2]) for frame_data in frames)
+                for frames in [expected, out]]
+    assert seq.num_filtered == num_dets[0] - num_dets[1]
+
+
+def test_bn_experiments_on_bbs_filter_after_loading(tmp_path):
+    det_conf, h_w_thresh = 0.4, 2.0
+    seq = make_sequence(tmp_path, 6)
+    seq.set_filter(det_conf, h_w_thresh)
+    expected = list(seq)
+    # BatchNorm experiments load all detections and filter them after the
+    # forward pass
+    seq.set_filter()
+    for running_mean_seq in [0, 1]:
+        tracker = SimpleNamespace(tracker_cfg=dict(
+            det_conf=det_conf, h_w_thresh=h_w_thresh,
+            running_mean_seq=running_mean_seq, **{k: 0 for k in [
+                'several_frames', 'running_mean_seq_reset', 'first_batch',
+                'first_batch_reset', 'every_frame_several_frames']}))
+        tracker.bn_stats_on_bbs = lambda: BaseTracker.bn_stats_on_bbs(
+            tracker)
+        for (_, _, dets, _, _), (_, _, dets_e, _, _) in zip(seq, expected):
+            filtered = BaseTracker.filter_detections(tracker, dets)
+            if running_mean_seq:
+                np.testing.assert_array_equal(filtered.boxes, dets_e.boxes)
+            else:
+                assert filtered is dets
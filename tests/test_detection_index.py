@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import torch
+from src.datasets.detection_index import DetectionBatch, DetectionIndex
+from src.tracking_utils import Track
+
+
+def random_dets(rng, num):
+    frame = rng.randint(1, 20, num)
+    boxes = rng.uniform(-20, 500, (num, 4))
+    return pd.DataFrame({
+        'frame': frame,
+        'bb_left': boxes[:, 0],
+        'bb_top': boxes[:, 1],
+        'bb_right': boxes[:, 0] + boxes[:, 2],
+        'bb_bot': boxes[:, 1] + boxes[:, 3],
+        'id': rng.randint(-1, 30, num),
+        'vis': rng.uniform(0, 1, num),
+        'conf': rng.uniform(0, 1, num),
+        'label': rng.randint(0, 3, num),
+        'frame_path': [f'img/{f:06d}.jpg' for f in frame]})
+
+
+def test_index_matches_pandas_frame_filtering():
+    rng = np.random.RandomState(0)
+    dets_unclipped = random_dets(rng, 300)
+    dets = dets_unclipped.copy()
+    dets[DetectionIndex.box_cols] = dets[DetectionIndex.box_cols].clip(0)
+    index = DetectionIndex(dets, dets_unclipped)
+
+    assert index.frames.tolist() == sorted(dets['frame'].unique())
+    for i, frame in enumerate(index.frames):
+        # boolean filtering per frame of the original Sequence._get
+        frame_dets = dets[dets['frame'] == frame]
+        frame_unclipped = dets_unclipped[dets_unclipped['frame'] == frame]
+        rows = index.rows(i)
+        np.testing.assert_array_equal(
+            index.boxes[rows, :4], frame_dets[DetectionIndex.box_cols].values)
+        np.testing.assert_array_equal(
+            index.boxes[rows, 4:],
+            frame_unclipped[DetectionIndex.box_cols].values)
+        for attr, col in [('ids', 'id'), ('vis', 'vis'), ('conf', 'conf'),
+                          ('label', 'label')]:
+            np.testing.assert_array_equal(
+                getattr(index, attr)[rows], frame_dets[col].values)
+        assert index.frame_paths[i] == frame_dets['frame_path'].iloc[0]
+
+
+def test_batch_detections_match_per_detection_dicts():
+    rng = np.random.RandomState(1)
+    num = 6
+    boxes = rng.uniform(0, 100, (num, 4)).astype(np.float32)
+    conf, label = rng.uniform(0, 1, num), rng.randint(0, 3, num)
+    gt_id, vis = rng.randint(-1, 10, num), rng.uniform(0, 1, num)
+    feats = torch.randn(num, 8)
+    batch = DetectionBatch(boxes, conf, label, gt_id, vis, feats, frame=7)
+
+    # per detection dicts of the original tracking loop
+    expected = [{
+        'bbox': b, 'feats': f, 'im_index': 7, 'gt_id': g, 'vis': v,
+        'conf': c, 'frame': 7, 'label': lab}
+        for b, f, g, v, c, lab in zip(boxes, feats, gt_id, vis, conf, label)]
+
+    rows = [4, 1, 2]
+    sub = batch.subset(rows)
+    assert len(sub) == len(rows)
+    for i, j in enumerate(rows):
+        det, ref = sub.detection(i), expected[j]
+        assert det.keys() == ref.keys()
+        for k in ref:
+            if isinstance(ref[k], torch.Tensor):
+                assert torch.equal(det[k], ref[k])
+            else:
+                np.testing.assert_array_equal(det[k], ref[k])
+
+    # detections without embeddings
+    assert DetectionBatch(
+        boxes, conf, label, gt_id, vis).subset(rows).detection(0)['feats'] \
+        is None
+
+
+def test_track_from_batch_matches_track_from_detection_dict():
+    rng = np.random.RandomState(2)
+    num = 4
+    batch = DetectionBatch(
+        rng.uniform(0, 100, (num, 4)).astype(np.float32),
+        rng.uniform(0, 1, num), rng.randint(0, 3, num),
+        rng.randint(-1, 10, num), rng.uniform(0, 1, num),
+        torch.randn(num, 8), frame=3)
+    track = Track(0, **batch.detection(0))
+    track_batch = Track(0, **batch.detection(0))
+    for i in range(1, num):
+        track.add_detection(**batch.detection(i))
+        track_batch.add_from_batch(batch, i)
+    batch.feats = None
+    track.add_detection(**batch.detection(1))
+    track_batch.add_from_batch(batch, 1)
+
+    assert len(track) == len(track_batch) == num + 1
+    for a, b in zip(track.past_feats, track_batch.past_feats):
+        assert torch.equal(a, b)
+    np.testing.assert_array_equal(track.last_pos, track_batch.last_pos)
+    assert list(track.label) == list(track_batch.label)
+    for k in ['im_index', 'gt_id', 'gt_vis', 'conf', 'last_seen']:
+        assert getattr(track, k) == getattr(track_batch, k)
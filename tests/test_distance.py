@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+import numpy as np
+import torch
+import torch.nn.functional as F
+from src.base_tracker import BaseTracker
+
+
+def dist_tracker(distance, dist_dtype='float32'):
+    return SimpleNamespace(tracker_cfg={
+        'use_bism': 0, 'distance': distance, 'dist_dtype': dist_dtype})
+
+
+def reference_dist(x, y, distance):
+    """
+    Broadcasted cosine distance of the original BaseTracker.dist, the
+    original euclidean branch reduced over the wrong dimension and is
+    replaced by cdist
+    """
+    if distance == 'cosine':
+        dist = 1 - F.cosine_similarity(x[:, :, None], y.t()[None, :, :])
+    else:
+        dist = torch.cdist(x, y)
+    return dist.numpy()
+
+
+def test_dist_matches_reference_dist():
+    torch.manual_seed(0)
+    x, y = torch.randn(7, 128), torch.randn(11, 128)
+    for distance in ['cosine', 'euclidean']:
+        ref = reference_dist(x, y, distance)
+        dist = BaseTracker.dist(dist_tracker(distance), x, y)
+        np.testing.assert_allclose(dist, ref, atol=1e-5)
+
+    # pre-normalized features
+    ref = reference_dist(x, y, 'cosine')
+    dist = BaseTracker.dist(
+        dist_tracker('cosine'), F.normalize(x), F.normalize(y),
+        x_normalized=True, y_normalized=True)
+    np.testing.assert_allclose(dist, ref, atol=1e-5)
+
+    # half precision accumulation
+    dist = BaseTracker.dist(dist_tracker('cosine', 'float16'), x, y)
+    np.testing.assert_allclose(dist, ref, atol=2e-3)
+
+
+def test_gated_dist_matches_dense_dist_on_feasible_pairs():
+    torch.manual_seed(1)
+    x, y = torch.randn(9, 64), torch.randn(6, 64)
+    feasible = np.random.RandomState(0).uniform(0, 1, (9, 6)) < 0.4
+    for distance in ['cosine', 'euclidean']:
+        tracker = dist_tracker(distance)
+        tracker.dist = lambda *args: BaseTracker.dist(tracker, *args)
+        dense = BaseTracker.dist(tracker, x, y)
+        dist = BaseTracker.gated_dist(tracker, x, y, feasible)
+        assert np.isnan(dist[~feasible]).all()
+        np.testing.assert_allclose(dist[feasible], dense[feasible], atol=1e-5)
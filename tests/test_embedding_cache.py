@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+import numpy as np
+import torch
+from src.embedding_cache import EmbeddingCache
+
+
+def sequence(num_dets):
+    det_index = SimpleNamespace(
+        boxes=np.arange(num_dets * 4, dtype=np.float64).reshape(-1, 4),
+        detection_id=np.arange(num_dets),
+        num_dets=num_dets)
+    return SimpleNamespace(name='MOT17-02', det_index=det_index, keep=None)
+
+
+def test_miss_tracks_on_values_of_hit(tmp_path):
+    for dtype in ['float16', 'float32']:
+        cache = EmbeddingCache(
+            str(tmp_path / dtype), 'weights', {}, dtype=dtype)
+        seq = sequence(10)
+        feats = torch.randn(10, 32)
+
+        # miss: embeddings are written and read back
+        assert cache.lookup(seq) is None
+        cache.start(seq)
+        written = torch.cat([cache.write(slice(0, 4), feats[:4]),
+                             cache.write(slice(4, 10), feats[4:])])
+        cache.finish()
+
+        # hit
+        embeddings = cache.lookup(seq)
+        read = cache.get(embeddings, slice(0, 10), 'cpu')
+        assert torch.equal(written, read)
+        if dtype == 'float32':
+            assert torch.equal(written, feats)
@@ -0,0 +1,33 @@
+import pytest
+import torch
+from ReID.net.resnet import resnet50
+from src.encoder_backend import EagerBackend, EncoderBackend, \
+    ExportedBackend, TorchScriptBackend
+from tools.export_encoder import export_torchscript
+
+
+def test_backend_without_run_fails_at_construction():
+    class NoRun(ExportedBackend):
+        name = 'no_run'
+
+    with pytest.raises(TypeError):
+        NoRun()
+    with pytest.raises(TypeError):
+        EncoderBackend()
+
+
+def test_torchscript_backend_matches_eager(tmp_path):
+    torch.manual_seed(0)
+    encoder = resnet50(pretrained=False, neck=1, num_classes=10).eval()
+    x = torch.randn(2, 3, 128, 64)
+    path = str(tmp_path / 'encoder.pt')
+    with torch.no_grad():
+        export_torchscript(encoder, x, path)
+
+    eager = EagerBackend(lambda: encoder)
+    backend = TorchScriptBackend(path)
+    x = torch.randn(3, 3, 128, 64)
+    for output in ['plain', 'norm', 'neck']:
+        ref = eager(x, output)
+        diff = (backend(x, output) - ref).abs().max() / ref.abs().max()
+        assert diff < 1e-4
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+import torch
+from ReID.net.resnet import resnet50
+from src.tracker import Tracker
+
+
+def test_batched_features_match_per_frame_features():
+    torch.manual_seed(0)
+    encoder = resnet50(pretrained=False, neck=1, num_classes=10).eval()
+
+    def get_features(crops):
+        with torch.no_grad():
+            return encoder(crops, output_option='plain')[1]
+
+    # frames as (crops, image, detections), including frames without
+    # detections
+    seq = list()
+    for num in [3, 0, 5, 1, 0, 0, 4, 2]:
+        seq.append((torch.randn(num, 3, 128, 64), None, [None] * num))
+
+    for lookahead, batch_size in [(1, 64), (3, 64), (8, 4), (8, 64)]:
+        tracker = SimpleNamespace(
+            get_features=get_features, tracker_cfg={'encoder_batching': {
+                'lookahead': lookahead, 'batch_size': batch_size}})
+        out = list(Tracker.batched_features(tracker, seq))
+        assert [frame_data for frame_data, _ in out] == seq
+        for (crops, _, dets), (_, feats) in zip(seq, out):
+            if not len(dets):
+                assert feats is None
+                continue
+            assert torch.allclose(
+                feats, get_features(crops), rtol=1e-4, atol=1e-5)
@@ -0,0 +1,37 @@
+import heapq
+from types import SimpleNamespace
+import numpy as np
+import torch
+from src.tracker import Tracker
+from src.tracking_utils import Track, FeatureGallery, MotionBuffer, \
+    TrackStore, RetentionPolicy, ResultBuffer
+
+
+def test_expired_tracks_leave_gallery():
+    tracker = SimpleNamespace(
+        gallery=FeatureGallery(normalize=True),
+        motion_buffer=MotionBuffer(length=10),
+        track_store=TrackStore(),
+        inactive_tracks=dict(), archived_tracks=dict(), expiry=list(),
+        inact_patience=5, kalman=False)
+    for k, frame in enumerate([1, 20]):
+        track = Track(
+            track_id=k, bbox=np.array([0, 0, 10, 20], dtype=np.float32),
+            feats=torch.randn(8), im_index=frame, gt_id=-1, vis=-1,
+            conf=1, frame=frame, label=1, gallery=tracker.gallery,
+            retention=RetentionPolicy(), results=ResultBuffer(),
+            motion_buffer=tracker.motion_buffer,
+            track_store=tracker.track_store)
+        track.add_detection(
+            np.array([1, 1, 11, 21], dtype=np.float32), torch.randn(8),
+            frame + 1, -1, -1, 1, frame + 1, 1)
+        tracker.inactive_tracks[k] = track
+        heapq.heappush(tracker.expiry, (track.last_seen, k))
+
+    tracker.prev_frame = 21
+    Tracker.expire_inactive(tracker)
+
+    assert list(tracker.archived_tracks.keys()) == [0]
+    assert 0 not in tracker.gallery.rows
+    _, _, counts = tracker.gallery.segments([0, 1])
+    assert counts.tolist() == [0, 2]
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+import numpy as np
+import torch
+from src.base_tracker import BaseTracker
+from src.tracker import Tracker
+from src.tracking_utils import FeatureGallery, RetentionPolicy, Track
+
+
+def make_tracks(gallery, num_tracks, retention=None, seed=0):
+    rng = np.random.RandomState(seed)
+    torch.manual_seed(seed)
+    tracks = dict()
+    bbox = np.array([0, 0, 10, 20], dtype=np.float32)
+    for k in range(num_tracks):
+        for frame in range(rng.randint(1, 12)):
+            feats = torch.randn(32)
+            if frame == 0:
+                tracks[k] = Track(
+                    k, bbox, feats, frame, -1, 1, 1, frame, 0,
+                    gallery=gallery, retention=retention)
+            else:
+                tracks[k].add_detection(
+                    bbox, feats, frame, -1, 1, 1, frame, 0)
+    return tracks
+
+
+def reference_proxy_dist(tracker, tr, x, num):
+    """
+    Per track proxy distance of the original Tracker.proxy_dist
+    """
+    dist = BaseTracker.dist(tracker, x, torch.stack(tr.past_feats))
+    if num == 1:
+        return np.min(dist, axis=1)
+    elif num == 2:
+        return np.mean(dist, axis=1)
+    elif num == 3:
+        return np.max(dist, axis=1)
+    elif num == 4:
+        return (np.max(dist, axis=1) + np.min(dist, axis=1)) / 2
+    elif num == 5:
+        return np.median(dist, axis=1)
+
+
+def test_proxy_dist_matches_per_track_proxy_dist():
+    for retention in [None, RetentionPolicy(feats=4)]:
+        gallery = FeatureGallery(normalize=True, capacity=4)
+        tracks = make_tracks(gallery, 9, retention)
+        # removed tracks leave holes in and compact the gallery
+        for k in [1, 4, 5, 6, 8]:
+            gallery.remove(k)
+            tracks.pop(k)
+
+        x = torch.randn(5, 32)
+        for num in [1, 2, 3, 4, 5]:
+            tracker = SimpleNamespace(
+                gallery=gallery, tracker_cfg={
+                    'use_bism': 0, 'distance': 'cosine',
+                    'dist_dtype': 'float32', 'avg_inact': {'num': num}})
+            tracker.dist = lambda *args, **kwargs: BaseTracker.dist(
+                tracker, *args, **kwargs)
+            ids = list()
+            dist = Tracker.proxy_dist(tracker, ids, tracks, x, False, None)
+            ref = np.stack([
+                reference_proxy_dist(tracker, tr, x, num)
+                for tr in tracks.values()])
+            assert ids == list(tracks.keys())
+            np.testing.assert_allclose(dist, ref, atol=1e-5)
@@ -0,0 +1,66 @@
+import numpy as np
+from src.kalman import KalmanFilter, KalmanStore
+
+
+def random_measurements(rng, num):
+    return np.stack([
+        rng.uniform(0, 1920, num),
+        rng.uniform(0, 1080, num),
+        rng.uniform(0.3, 0.6, num),
+        rng.uniform(20, 300, num)], axis=1)
+
+
+def test_store_matches_per_track_filter():
+    rng = np.random.RandomState(0)
+    kf = KalmanFilter()
+    # small capacity to also exercise growing of the store
+    store = KalmanStore(kf, capacity=2)
+    num_tracks = 7
+    states = dict()
+    for k, m in enumerate(random_measurements(rng, num_tracks)):
+        store.initiate(k, m)
+        states[k] = kf.initiate(m)
+
+    for _ in range(20):
+        inactive = [k for k in states if rng.rand() < 0.3]
+        active = [k for k in states if k not in inactive]
+        for k in inactive:
+            states[k][0][7] = 0
+        for k in states:
+            states[k] = kf.predict(*states[k])
+        store.predict(active, inactive)
+
+        matched = [k for k in active if rng.rand() < 0.7]
+        for k, m in zip(matched, random_measurements(rng, len(matched))):
+            states[k] = kf.update(*states[k], m)
+            store.add_measurement(k, m)
+        store.update()
+
+        slots = store.get_slots(states.keys())
+        np.testing.assert_allclose(
+            store.mean[slots], np.stack([s[0] for s in states.values()]),
+            rtol=1e-7, atol=1e-7)
+        np.testing.assert_allclose(
+            store.covariance[slots],
+            np.stack([s[1] for s in states.values()]), rtol=1e-7, atol=1e-7)
+
+
+def test_store_gating_matches_per_track_gating():
+    rng = np.random.RandomState(1)
+    kf = KalmanFilter()
+    store = KalmanStore(kf)
+    states = dict()
+    for k, m in enumerate(random_measurements(rng, 5)):
+        store.initiate(k, m)
+        states[k] = kf.predict(*kf.initiate(m))
+    store.predict(list(states.keys()), [])
+
+    measurements = random_measurements(rng, 9)
+    for only_position in [False, True]:
+        expected = np.stack([
+            kf.gating_distance(*states[k], measurements, only_position)
+            for k in states])
+        np.testing.assert_allclose(
+            store.gating_distance(
+                list(states.keys()), measurements, only_position),
+            expected, rtol=1e-7)
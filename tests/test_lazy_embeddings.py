@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+import numpy as np
+import torch
+from src.datasets.detection_index import DetectionBatch
+from src.tracker import Tracker
+
+
+def lazy_tracker(track_boxes, margin):
+    num_tracks = len(track_boxes)
+    return SimpleNamespace(
+        tracker_cfg={'lazy_embeddings': {
+            'min_iou': 0.5, 'margin': margin, 'refresh': 5}},
+        tracks={k: SimpleNamespace(last_embedded=9)
+                for k in range(num_tracks)},
+        curr_it=dict(),
+        kalman=True,
+        kalman_tlbrs=np.asarray(track_boxes, dtype=np.float64),
+        track_store=SimpleNamespace(
+            labels_of=lambda ids: np.ones(len(list(ids)))),
+        frame_id=10,
+        lazy_features=lambda rows: torch.zeros(len(rows), 4))
+
+
+def detections(boxes):
+    n = len(boxes)
+    return DetectionBatch(
+        np.asarray(boxes, dtype=np.float64), np.ones(n), np.ones(n),
+        -np.ones(n), -np.ones(n), frame=10)
+
+
+def test_track_is_held_out_for_one_detection_only():
+    # two identical detections are unambiguous with margin 0
+    tracker = lazy_tracker([[0, 0, 10, 20], [100, 100, 110, 120]], 0)
+    dets = detections([[0, 0, 10, 20], [0, 0, 10, 20], [100, 100, 110, 121]])
+    rest, rows, held = Tracker.lazy_association(tracker, dets)
+
+    assert sorted((r, k) for k, (r, _) in held.items()) == [(0, 0), (2, 1)]
+    assert rows.tolist() == [1]
+    assert rest.feats.shape[0] == 1
+    assert len(tracker.tracks) == 0
+
+
+def test_ambiguous_detections_are_encoded():
+    tracker = lazy_tracker([[0, 0, 10, 20]], 0.2)
+    dets = detections([[0, 0, 10, 20], [1, 0, 11, 20]])
+    rest, rows, held = Tracker.lazy_association(tracker, dets)
+
+    assert len(held) == 0
+    assert rows.tolist() == [0, 1]
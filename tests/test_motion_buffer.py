@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+from src.tracking_utils import MotionBuffer, warp_pos
+
+
+def reference_velocity(boxes, frames, length):
+    """
+    Mean velocity of the last length boxes like the list based motion
+    model
+    """
+    boxes = np.asarray(boxes[-length:], dtype=np.float64)
+    frames = np.asarray(frames[-length:], dtype=np.float64)
+    return ((boxes[1:] - boxes[:-1]) / (frames[1:] - frames[:-1])[:, None]
+            ).mean(axis=0)
+
+
+def fill(buffer, rng, num_tracks, num_dets):
+    history = dict()
+    for k in range(num_tracks):
+        boxes = rng.uniform(0, 100, (num_dets[k], 4)).astype(np.float32)
+        frames = np.cumsum(rng.randint(1, 3, num_dets[k])).astype(float)
+        for b, f in zip(boxes, frames):
+            buffer.add(k, b, f)
+        history[k] = (boxes, frames)
+    return history
+
+
+def test_huge_length_is_not_preallocated():
+    buffer = MotionBuffer(length=100000000)
+    assert buffer.last_pos.shape[1] == 16
+    buffer.add(0, np.zeros(4), 1)
+
+
+def test_velocity_matches_list_motion_model():
+    rng = np.random.RandomState(0)
+    for length in [3, 20, None]:
+        buffer = MotionBuffer(length=length, capacity=2)
+        num_dets = [2, 5, 40, 17]
+        history = fill(buffer, rng, len(num_dets), num_dets)
+        if length is not None:
+            assert buffer.last_pos.shape[1] <= length
+        v = buffer.velocity(buffer.get_slots(range(len(num_dets))))
+        for k, (boxes, frames) in history.items():
+            np.testing.assert_allclose(
+                v[k], reference_velocity(
+                    boxes, frames, length or len(boxes)), rtol=1e-5)
+
+
+def test_warp_matches_per_box_warp():
+    rng = np.random.RandomState(1)
+    buffer = MotionBuffer(length=5, capacity=2)
+    history = fill(buffer, rng, 4, [1, 3, 8, 5])
+    warp_matrix = np.array(
+        [[0.99, -0.02, 3.5], [0.02, 0.99, -1.5]], dtype=np.float32)
+    expected = {k: np.stack([
+        np.squeeze(warp_pos(np.atleast_2d(pos), torch.from_numpy(
+            warp_matrix))) for pos in buffer.history(k)[0]])
+        for k in history}
+    # only track 0 and 2 are warped
+    before = buffer.history(1)[0].copy()
+    buffer.warp([0, 2], warp_matrix)
+    for k in [0, 2]:
+        np.testing.assert_allclose(
+            buffer.history(k)[0], expected[k], rtol=1e-5, atol=1e-3)
+    np.testing.assert_array_equal(buffer.history(1)[0], before)
+
+    # homography with the same affine part gives the same positions
+    homography = np.concatenate([warp_matrix, [[0, 0, 1]]])
+    buffer.warp([3], homography)
+    np.testing.assert_allclose(
+        buffer.history(3)[0], expected[3], rtol=1e-5, atol=1e-3)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from torchvision import transforms
+from torchvision.transforms import ToTensor
+from src.datasets.TrackingDataset import Sequence
+from ReID.data.utils import make_transform_bot
+
+
+def make_sequence(tmp_path, num_frames, prefetch):
+    rng = np.random.RandomState(0)
+    rows = list()
+    for frame in range(1, num_frames + 1):
+        path = str(tmp_path / f'{frame:06d}.png')
+        Image.fromarray(rng.randint(0, 255, (120, 160, 3)).astype(
+            np.uint8)).save(path)
+        for _ in range(rng.randint(1, 4)):
+            left, top = rng.uniform(0, 100), rng.uniform(0, 40)
+            rows.append({
+                'frame': frame, 'id': -1, 'bb_left': left, 'bb_top': top,
+                'bb_right': left + rng.uniform(10, 50),
+                'bb_bot': top + rng.uniform(30, 70), 'conf': 1.0,
+                'label': 1, 'vis': -1, 'frame_path': path})
+    dets = pd.DataFrame(rows)
+    return Sequence(
+        name='synthetic', dets=dets, gt=None,
+        to_pil=transforms.ToPILImage(), to_tensor=ToTensor(),
+        transform=make_transform_bot(is_train=False, sz_crop=[64, 32]),
+        dets_unclipped=dets.copy(), prefetch=prefetch, prefetch_workers=2)
+
+
+def test_prefetched_frames_match_sequential_frames(tmp_path):
+    expected = list(make_sequence(tmp_path, 6, 0))
+    seq = make_sequence(tmp_path, 6, 2)
+    # stopped early and restarted iteration starts from the first frame
+    next(iter(seq))
+    out = list(seq)
+
+    assert len(out) == len(expected)
+    for (img, path, dets, _, img_for_det), \
+            (img_e, path_e, dets_e, _, img_for_det_e) in zip(out, expected):
+        assert path == path_e
+        assert torch.equal(img, img_e)
+        assert torch.equal(img_for_det, img_for_det_e)
+        np.testing.assert_array_equal(dets.boxes, dets_e.boxes)
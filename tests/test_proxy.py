@@ -0,0 +1,61 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from src.tracking_utils import RetentionPolicy, Track, get_proxy
+
+
+def reference_proxy(past_feats, proxy, avg):
+    """
+    Proxy of the original get_proxy, recomputed from the embedding bank
+    """
+    feats = torch.stack(
+        past_feats if avg == 'all' or len(past_feats) < avg
+        else past_feats[-avg:])
+    if proxy == 'mean':
+        return torch.mean(feats, dim=0)
+    elif proxy == 'median':
+        return torch.median(feats, dim=0)[0]
+    elif proxy == 'mode':
+        return torch.mode(feats, dim=0)[0]
+    elif proxy == 'meannorm':
+        return F.normalize(torch.mean(feats, dim=0), p=2, dim=0)
+
+
+def test_incremental_proxy_matches_recomputed_proxy():
+    rng = np.random.RandomState(0)
+    torch.manual_seed(0)
+    bbox = np.array([0, 0, 10, 20], dtype=np.float32)
+    for retention in [None, RetentionPolicy(feats=6),
+                      RetentionPolicy(feats=6, feats_sampling='reservoir')]:
+        tracks = {k: Track(k, bbox, torch.randn(16), 0, -1, 1, 1, 0, 0,
+                           retention=retention) for k in range(4)}
+        for frame in range(1, 15):
+            for k, tr in tracks.items():
+                if rng.rand() < 0.7:
+                    tr.add_detection(
+                        bbox, torch.randn(16), frame, -1, 1, 1, frame, 0)
+            for proxy in ['mean', 'median', 'mode', 'meannorm']:
+                for avg in ['all', 3, 6, 10]:
+                    cfg = {'avg_inact': {'num': avg, 'proxy': proxy}}
+                    feats = get_proxy(tracks, tracker_cfg=cfg)
+                    ref = torch.stack([
+                        reference_proxy(tr.past_feats, proxy, avg)
+                        for tr in tracks.values()])
+                    assert torch.allclose(feats, ref, atol=1e-5)
+
+
+def test_window_sums_are_kept_when_bank_is_full():
+    torch.manual_seed(0)
+    bbox = np.array([0, 0, 10, 20], dtype=np.float32)
+    for sampling in ['last', 'reservoir']:
+        tr = Track(0, bbox, torch.randn(16), 0, -1, 1, 1, 0, 0,
+                   retention=RetentionPolicy(feats=4, feats_sampling=sampling))
+        for frame in range(1, 30):
+            tr.add_detection(bbox, torch.randn(16), frame, -1, 1, 1, frame, 0)
+            if frame > 3:
+                # window sums are updated, not recomputed from the bank
+                assert {3, 4} <= set(tr.window_sums.keys())
+            for avg in [3, 4]:
+                assert torch.allclose(
+                    tr.proxy_feats('mean', avg),
+                    reference_proxy(tr.past_feats, 'mean', avg), atol=1e-5)
@@ -0,0 +1,39 @@
+import pytest
+import torch
+import torch.nn.functional as F
+from ReID.net.resnet import resnet50
+from ReID.net.quantization import QuantizedResNet, load_quantized, \
+    save_quantized
+
+# INT8 embeddings are an approximation of the fp32 embeddings, the
+# quantize_encoder tool reports a minimum cosine similarity of about 0.996
+# with random weights, the test allows a bit of slack for other engines
+MIN_COSINE = 0.98
+
+pytestmark = pytest.mark.skipif(
+    'x86' not in torch.backends.quantized.supported_engines,
+    reason='x86 quantization engine not available')
+
+
+def test_int8_encoder_matches_fp32_encoder(tmp_path):
+    torch.manual_seed(0)
+    model = resnet50(pretrained=False, neck=1, num_classes=10).eval()
+    quantized = QuantizedResNet(model, sz_crop=(128, 64))
+    for _ in range(4):
+        quantized.calibrate(torch.randn(8, 3, 128, 64))
+    quantized.convert()
+
+    x = torch.randn(6, 3, 128, 64)
+    with torch.no_grad():
+        for output in ['plain', 'norm', 'neck']:
+            ref = model(x, output_option=output)[1]
+            logits, feats = quantized(x, output_option=output)
+            assert logits is None
+            assert feats.shape == ref.shape
+            assert F.cosine_similarity(feats, ref).min() > MIN_COSINE
+
+        # stored and restored encoder gives the same embeddings
+        path = str(tmp_path / 'encoder_int8.pth')
+        save_quantized(quantized, path)
+        restored = load_quantized(model, path)
+        assert torch.equal(restored(x)[1], quantized(x)[1])
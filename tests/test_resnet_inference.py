@@ -0,0 +1,40 @@
+import torch
+from ReID.net.resnet import resnet50
+
+
+def random_batchnorm_stats(model):
+    """
+    Non trivial BatchNorm statistics and affine parameters such that
+    folding them into the convolutions is actually checked
+    """
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, torch.nn.BatchNorm2d) or \
+                    isinstance(m, torch.nn.BatchNorm1d):
+                m.running_mean.uniform_(-0.1, 0.1)
+                m.running_var.uniform_(0.5, 1.5)
+                m.weight.uniform_(0.5, 1.5)
+                m.bias.uniform_(-0.1, 0.1)
+
+
+def test_inference_model_matches_eval_forward():
+    torch.manual_seed(0)
+    model = resnet50(pretrained=False, neck=1, num_classes=10)
+    random_batchnorm_stats(model)
+    model.eval()
+    x = torch.randn(3, 3, 128, 64)
+
+    for channels_last in [True, False]:
+        fused = model.inference_model(channels_last=channels_last)
+        for output in ['plain', 'norm', 'neck']:
+            # checkpointed forward of the training path and the plain
+            # forward without gradients
+            with torch.enable_grad():
+                ref = model(x, output_option=output)[1].detach()
+            with torch.no_grad():
+                plain = model(x, output_option=output)[1]
+                logits, feats = fused(x, output_option=output)
+            assert logits is None
+            assert torch.allclose(plain, ref, rtol=1e-5, atol=1e-6)
+            diff = (feats - ref).abs().max() / ref.abs().max()
+            assert diff < 1e-4
@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+from src.tracking_utils import MotionBuffer, ResultBuffer, RetentionPolicy, \
+    Track
+
+
+def add_detections(rng, retention, num_tracks=4, num_frames=12, lazy=0):
+    """
+    Tracks with shared buffers and lists of everything that was added,
+    like the unbounded lists of the original Track. A fraction lazy of
+    the later detections has no embedding (lazy embeddings).
+    """
+    results = ResultBuffer(capacity=8)
+    motion_buffer = MotionBuffer(retention.motion_len, capacity=2)
+    tracks, history = dict(), dict()
+    for frame in range(num_frames):
+        for k in range(num_tracks):
+            if frame > 0 and rng.rand() < 0.3:
+                continue
+            left, top = rng.uniform(0, 100, 2)
+            det = dict(
+                bbox=np.array([left, top, left + 10, top + 20],
+                              dtype=np.float32),
+                feats=torch.randn(8) if k not in tracks or
+                rng.rand() >= lazy else None, im_index=frame, gt_id=k, vis=1.0,
+                conf=1.0, frame=frame, label=int(rng.randint(2)))
+            if k not in tracks:
+                tracks[k] = Track(
+                    k, retention=retention, results=results,
+                    motion_buffer=motion_buffer, **det)
+                history[k] = list()
+            else:
+                tracks[k].add_detection(**det)
+            history[k].append(det)
+    return tracks, history, results
+
+
+def test_results_match_unbounded_history():
+    rng = np.random.RandomState(0)
+    torch.manual_seed(0)
+    tracks, history, results = add_detections(
+        rng, RetentionPolicy(motion_len=3, feats=4))
+
+    # make_results of the original tracker on the full lists
+    expected = {k: {d['im_index']: d['bbox'].tolist() + [d['label']]
+                    for d in dets} for k, dets in history.items()}
+    assert results.tracks(tracks.keys()) == expected
+
+    for k, tr in tracks.items():
+        dets = history[k]
+        assert len(tr) == len(dets)
+        for f, d in zip(tr.past_feats, dets[-4:]):
+            assert torch.equal(f, d['feats'])
+        np.testing.assert_array_equal(
+            tr.last_pos, np.stack([d['bbox'] for d in dets[-3:]]))
+        assert list(tr.label) == [d['label'] for d in dets[-3:]]
+
+
+def test_reservoir_keeps_sample_of_embeddings():
+    rng = np.random.RandomState(1)
+    torch.manual_seed(1)
+    tracks, history, _ = add_detections(
+        rng, RetentionPolicy(feats=3, feats_sampling='reservoir'), lazy=0.6)
+    for k, tr in tracks.items():
+        added = [d['feats'] for d in history[k] if d['feats'] is not None]
+        assert tr.num_offered == len(added)
+        assert len(tr.past_feats) == min(3, len(added))
+        for f in tr.past_feats:
+            assert any(f is a for a in added)
+        # running sum follows the sample
+        assert torch.allclose(
+            tr.feats_sum, torch.stack(tr.past_feats).sum(dim=0), atol=1e-5)
+
+
+def test_reservoir_is_uniform_over_embeddings():
+    # every embedding is kept with probability size / number of
+    # embeddings, also with many detections without embedding
+    retention = RetentionPolicy(feats=2, feats_sampling='reservoir')
+    bbox = np.array([0, 0, 10, 20], dtype=np.float32)
+    num_tracks, num_embeddings = 2000, 10
+    kept = np.zeros(num_embeddings)
+    for k in range(num_tracks):
+        feats = [torch.full((1, ), float(n)) for n in range(num_embeddings)]
+        tr = Track(k, bbox, feats[0], 0, -1, 1, 1, 0, 0, retention=retention)
+        for frame, f in enumerate(feats[1:]):
+            for _ in range(3):
+                tr.add_detection(bbox, None, frame, -1, 1, 1, frame, 0)
+            tr.add_detection(bbox, f, frame, -1, 1, 1, frame, 0)
+        for f in tr.past_feats:
+            kept[int(f.item())] += 1
+    np.testing.assert_allclose(
+        kept / num_tracks, 2 / num_embeddings, atol=0.04)
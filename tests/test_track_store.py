@@ -0,0 +1,50 @@
+import numpy as np
+import torch
+from src.tracking_utils import TrackStore
+
+
+def test_store_matches_per_track_state():
+    rng = np.random.RandomState(0)
+    torch.manual_seed(0)
+    # small capacity to also exercise growing and reuse of slots
+    store = TrackStore(capacity=2)
+    state, next_id = dict(), 0
+    for frame in range(30):
+        if rng.rand() < 0.5 or not len(state):
+            feats = torch.randn(8)
+            store.add(next_id)
+            store.update(next_id, feats, 0, frame)
+            state[next_id] = dict(
+                state=TrackStore.ACTIVE, feats=feats, label=0,
+                last_seen=frame)
+            next_id += 1
+        for k in list(state.keys()):
+            p = rng.rand()
+            if p < 0.1:
+                store.remove(k)
+                state.pop(k)
+            elif p < 0.3:
+                store.set_state([k], TrackStore.INACTIVE)
+                state[k]['state'] = TrackStore.INACTIVE
+            elif p < 0.7:
+                # detections without embedding keep the last embedding
+                feats = torch.randn(8) if p < 0.6 else None
+                label = int(rng.randint(3))
+                store.update(k, feats, label, frame)
+                if feats is not None:
+                    state[k]['feats'] = feats
+                state[k].update(label=label, last_seen=frame)
+
+        ids = list(state.keys())
+        if not len(ids):
+            continue
+        slots = store.get_slots(ids)
+        assert len(set(slots.tolist())) == len(ids)
+        assert torch.equal(
+            store.feats_of(ids), torch.stack([state[k]['feats'] for k in ids]))
+        np.testing.assert_array_equal(
+            store.labels_of(ids), [state[k]['label'] for k in ids])
+        np.testing.assert_array_equal(
+            store.last_seen[slots], [state[k]['last_seen'] for k in ids])
+        np.testing.assert_array_equal(
+            store.state[slots], [state[k]['state'] for k in ids])
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import time
+import numpy as np
+import cv2
+import torch
+from src.camera_motion import CameraMotion
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Compare camera motion estimators (full resolution '
+                    'ECC, ECC on pyramid levels, sparse optical flow) on '
+                    'synthetic frames with known camera motion')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--num_frames', type=int, default=5)
+    parser.add_argument('--warp_mode', default='Euclidean')
+    parser.add_argument('--num_iter', type=int, default=100)
+    parser.add_argument('--levels', type=int, nargs='+', default=[0, 1, 2])
+    return parser.parse_args()
+
+
+def make_frames(width, height, num_frames, rng):
+    """
+    Smooth random texture seen by a camera that moves by a small
+    rotation and translation every frame, returns image tensors and warp
+    matrices from every frame to the previous one
+    """
+    texture = rng.uniform(0, 1, (height // 8, width // 8, 3))
+    texture = cv2.resize(texture.astype(np.float32), (width, height),
+                         interpolation=cv2.INTER_CUBIC)
+    texture = cv2.GaussianBlur(texture, (5, 5), 0)
+
+    frames, warps = [torch.from_numpy(texture.transpose(2, 0, 1).copy())], \
+        list()
+    image = texture
+    for _ in range(num_frames - 1):
+        angle = rng.uniform(-0.3, 0.3)
+        shift = rng.uniform(-6, 6, 2)
+        warp = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
+        warp[:, 2] += shift
+        # current frame at x is previous frame at warp x
+        image = cv2.warpAffine(
+            image, warp, (width, height),
+            flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_REFLECT)
+        frames.append(torch.from_numpy(image.transpose(2, 0, 1).copy()))
+        warps.append(warp)
+
+    return frames, warps
+
+
+def corner_error(warp, ref, width, height):
+    """
+    Mean distance of image corners mapped with estimated and true warp
+    """
+    corners = np.array([[0, 0, 1], [width, 0, 1], [0, height, 1],
+                        [width, height, 1]], dtype=np.float64)
+    def apply(w):
+        p = corners @ np.asarray(w, dtype=np.float64).T
+        return p[:, :2] / p[:, 2:] if p.shape[1] == 3 else p
+    return np.linalg.norm(apply(warp) - apply(ref), axis=1).mean()
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    frames, warps = make_frames(
+        args.width, args.height, args.num_frames, rng)
+
+    estimators = [('ecc', level) for level in args.levels] + \
+        [('sparse', level) for level in args.levels]
+    for estimator, level in estimators:
+        camera_motion = CameraMotion(
+            warp_mode=args.warp_mode,
+            estimator=estimator,
+            pyramid_level=level,
+            num_iter=args.num_iter)
+        camera_motion.start('benchmark')
+
+        errors = list()
+        t = time.perf_counter()
+        for i, frame in enumerate(frames):
+            warp = camera_motion.estimate(frame, i)
+            if warp is not None:
+                errors.append(corner_error(
+                    warp, warps[i - 1], args.width, args.height))
+        t = (time.perf_counter() - t) / (len(frames) - 1)
+
+        logger.info(f"{estimator:6s} level {level}: "
+                    f"{1000 * t:8.2f} ms / frame, "
+                    f"corner error {np.mean(errors):.3f} px")
+
+
+if __name__ == '__main__':
+    main(init_args())
@@ -0,0 +1,126 @@
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+from torchvision.transforms import ToTensor
+from src.datasets.TrackingDataset import Sequence
+from src.datasets.crop_engine import CropEngine
+from ReID.data.utils import make_transform_bot
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Check numeric equivalence and speed of the batched '
+                    'crop engine against the per bb PIL path')
+    parser.add_argument('--num_boxes', type=int, default=150)
+    parser.add_argument('--img_size', type=int, nargs=2, default=[1080, 1920])
+    parser.add_argument('--sz_crop', type=int, nargs=2, default=[384, 128])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--tol', type=float, default=0.05,
+                        help='Maximum mean absolute difference of the '
+                             'normalized crops')
+    return parser.parse_args()
+
+
+def make_image(img_size):
+    """
+    Smooth synthetic image with 8 bit values like decoded JPEGs
+    """
+    torch.manual_seed(0)
+    img = torch.rand(1, 3, img_size[0] // 16, img_size[1] // 16)
+    img = F.interpolate(img, size=img_size, mode='bilinear',
+                        align_corners=False)[0]
+    img = img + 0.05 * torch.rand(img.shape)
+    return (img.clamp(0, 1) * 255).round() / 255
+
+
+def make_dets(num_boxes, img_size):
+    """
+    Pedestrian like bbs of one frame, some of them partially outside
+    """
+    rng = np.random.RandomState(0)
+    h, w = img_size
+    width = rng.uniform(10, 150, num_boxes)
+    height = width * rng.uniform(1.5, 3.5, num_boxes)
+    dets_unclipped = pd.DataFrame({
+        'frame': 1,
+        'id': -1,
+        'bb_left': rng.uniform(-0.3 * width, w - 0.7 * width),
+        'bb_top': rng.uniform(-0.3 * height, h - 0.7 * height),
+        'conf': 1.0,
+        'label': 1,
+        'vis': -1,
+        'frame_path': '000001.jpg'})
+    dets_unclipped['bb_right'] = dets_unclipped['bb_left'] + width
+    dets_unclipped['bb_bot'] = dets_unclipped['bb_top'] + height
+
+    dets = dets_unclipped.copy()
+    for col, m in [('bb_left', w), ('bb_right', w), ('bb_top', h),
+                   ('bb_bot', h)]:
+        dets[col] = np.clip(dets[col].values, 0, m).astype(int)
+
+    return dets, dets_unclipped
+
+
+def main(args):
+    img = make_image(args.img_size)
+    dets, dets_unclipped = make_dets(args.num_boxes, args.img_size)
+
+    for fixed_aspect_ratio in [0, 2.5]:
+        seq = Sequence(
+            name='synthetic',
+            dets=dets,
+            gt=None,
+            to_pil=transforms.ToPILImage(),
+            to_tensor=ToTensor(),
+            transform=make_transform_bot(
+                is_train=False, sz_crop=args.sz_crop),
+            dets_unclipped=dets_unclipped,
+            fixed_aspect_ratio=fixed_aspect_ratio)
+        crop_engine = CropEngine(
+            sz_crop=args.sz_crop, fixed_aspect_ratio=fixed_aspect_ratio)
+        boxes = seq.det_index.boxes[seq.det_index.rows(0)]
+
+        for padding in ['zero', 'mean', 'channel_wise_mean', 'circular']:
+            t = time.perf_counter()
+            for _ in range(args.repeats):
+                res_pil = seq._get_crops(img, boxes, padding)
+            t_pil = (time.perf_counter() - t) / args.repeats
+
+            t = time.perf_counter()
+            for _ in range(args.repeats):
+                res = crop_engine(img, boxes[:, :4], boxes[:, 4:], padding)
+            t_batched = (time.perf_counter() - t) / args.repeats
+
+            # numeric equivalence of crops in encoder input space
+            diff = (res - res_pil).abs()
+            cos = F.cosine_similarity(
+                res.flatten(1), res_pil.flatten(1), dim=1)
+            logger.info(
+                f"fixed_aspect_ratio {fixed_aspect_ratio}, {padding}: "
+                f"mean abs diff {diff.mean():.4f}, "
+                f"max abs diff {diff.max():.4f}, "
+                f"min cosine similarity {cos.min():.5f}, "
+                f"PIL {1000 * t_pil:.1f} ms, "
+                f"batched {1000 * t_batched:.1f} ms "
+                f"({t_pil / t_batched:.1f}x)")
+            assert res.shape == res_pil.shape
+            assert diff.mean() < args.tol, \
+                f"Batched crops differ from PIL crops for {padding}"
+
+
+if __name__ == '__main__':
+    main(init_args())
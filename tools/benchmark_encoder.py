@@ -0,0 +1,82 @@
+import argparse
+import logging
+import time
+import torch
+from ReID.net.resnet import resnet18, resnet50
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Compare crops per second of the encoder forward pass '
+                    'used while tracking (eval mode, no_grad) with the '
+                    'inference path (no checkpointing, folded BatchNorm, '
+                    'channels_last, embedding branch only)')
+    parser.add_argument('--net_type', default='resnet50',
+                        choices=['resnet18', 'resnet50'])
+    parser.add_argument('--batch_sizes', type=int, nargs='+',
+                        default=[1, 16, 64])
+    parser.add_argument('--sz_crop', type=int, nargs=2, default=[384, 128])
+    parser.add_argument('--neck', type=int, default=1)
+    parser.add_argument('--output', default='plain')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--device', default='cpu')
+    return parser.parse_args()
+
+
+def crops_per_second(fn, x, repeats, device):
+    fn(x)
+    t = time.perf_counter()
+    for _ in range(repeats):
+        fn(x)
+    if device != 'cpu':
+        torch.cuda.synchronize()
+    return repeats * x.shape[0] / (time.perf_counter() - t)
+
+
+def main(args):
+    torch.manual_seed(0)
+    net = resnet18 if args.net_type == 'resnet18' else resnet50
+    model = net(pretrained=False, neck=args.neck, num_classes=1000)
+    # non trivial BatchNorm statistics like a trained network
+    for m in model.modules():
+        if isinstance(m, torch.nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.1, 0.1)
+            m.running_var.uniform_(0.5, 1.5)
+    model = model.to(args.device).eval()
+
+    variants = [
+        ('forward', model),
+        ('inference', model.inference_model(channels_last=False)),
+        ('inference channels_last', model.inference_model())]
+
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, 3, *args.sz_crop, device=args.device)
+        with torch.no_grad():
+            ref = model(x, output_option=args.output)[1]
+            res = list()
+            for name, encoder in variants:
+                diff = (encoder(x, output_option=args.output)[1] -
+                        ref).abs().max().item()
+                speed = crops_per_second(
+                    lambda x: encoder(x, output_option=args.output), x,
+                    args.repeats, args.device)
+                res.append((name, speed, diff))
+
+        logger.info(f"batch size {batch_size}:")
+        for name, speed, diff in res:
+            logger.info(f"    {name:24s} {speed:8.1f} crops / s "
+                        f"({speed / res[0][1]:.2f}x), "
+                        f"max abs diff {diff:.2e}")
+
+
+if __name__ == '__main__':
+    main(init_args())
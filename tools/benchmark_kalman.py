@@ -0,0 +1,107 @@
+import argparse
+import logging
+import time
+import numpy as np
+from src.kalman import KalmanFilter, KalmanStore
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Compare per frame Kalman predict and update of per '
+                    'track filters with the batched Kalman store')
+    parser.add_argument('--num_tracks', type=int, nargs='+',
+                        default=[10, 50, 100, 500, 1000, 2000])
+    parser.add_argument('--num_frames', type=int, default=20)
+    parser.add_argument('--inactive_frac', type=float, default=0.2,
+                        help='Fraction of tracks without detection per frame')
+    return parser.parse_args()
+
+
+def make_measurements(num_tracks, num_frames):
+    """
+    Synthetic (x, y, a, h) measurements of tracks with constant velocity
+    """
+    rng = np.random.RandomState(0)
+    start = np.stack([
+        rng.uniform(0, 1920, num_tracks),
+        rng.uniform(0, 1080, num_tracks),
+        rng.uniform(0.3, 0.5, num_tracks),
+        rng.uniform(50, 300, num_tracks)], axis=1)
+    v = np.stack([
+        rng.normal(0, 3, num_tracks),
+        rng.normal(0, 2, num_tracks),
+        np.zeros(num_tracks),
+        rng.normal(0, 0.5, num_tracks)], axis=1)
+    frames = np.arange(num_frames)[:, None, None]
+    noise = rng.normal(0, 1, (num_frames, num_tracks, 4)) * \
+        np.array([1, 1, 0.001, 1])
+    return start[None] + frames * v[None] + noise
+
+
+def run_per_track(kf, measurements, matched):
+    """
+    Per track predict and update as done before the Kalman store
+    """
+    states = [kf.initiate(m) for m in measurements[0]]
+    for frame in range(1, measurements.shape[0]):
+        for i, (mean, cov) in enumerate(states):
+            mean, cov = kf.predict(mean, cov)
+            if matched[frame, i]:
+                mean, cov = kf.update(mean, cov, measurements[frame, i])
+            states[i] = (mean, cov)
+    return np.stack([s[0] for s in states]), np.stack([s[1] for s in states])
+
+
+def run_store(kf, measurements, matched):
+    """
+    Batched predict and update of all tracks in the Kalman store
+    """
+    store = KalmanStore(kf)
+    track_ids = list(range(measurements.shape[1]))
+    for k in track_ids:
+        store.initiate(k, measurements[0, k])
+    for frame in range(1, measurements.shape[0]):
+        store.predict(track_ids, [])
+        for k in np.nonzero(matched[frame])[0]:
+            store.add_measurement(k, measurements[frame, k])
+        store.update()
+    slots = store.get_slots(track_ids)
+    return store.mean[slots], store.covariance[slots]
+
+
+def main(args):
+    kf = KalmanFilter()
+    rng = np.random.RandomState(1)
+    for num_tracks in args.num_tracks:
+        measurements = make_measurements(num_tracks, args.num_frames)
+        matched = rng.uniform(size=measurements.shape[:2]) > \
+            args.inactive_frac
+
+        t = time.perf_counter()
+        mean_ref, cov_ref = run_per_track(kf, measurements, matched)
+        t_loop = (time.perf_counter() - t) / (args.num_frames - 1)
+
+        t = time.perf_counter()
+        mean, cov = run_store(kf, measurements, matched)
+        t_batched = (time.perf_counter() - t) / (args.num_frames - 1)
+
+        assert np.allclose(mean, mean_ref, rtol=1e-6, atol=1e-6)
+        assert np.allclose(cov, cov_ref, rtol=1e-6, atol=1e-6)
+
+        logger.info(f"{num_tracks:5d} tracks: "
+                    f"per track {1000 * t_loop:8.3f} ms / frame, "
+                    f"batched {1000 * t_batched:7.3f} ms / frame "
+                    f"({t_loop / t_batched:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(init_args())
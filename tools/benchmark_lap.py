@@ -0,0 +1,140 @@
+import argparse
+import logging
+import time
+import numpy as np
+from scipy.optimize import linear_sum_assignment as solve_dense
+from src.assignment import solve_decomposed, feasible_components, \
+    get_solver
+from src.tracking_utils import ious
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Compare the dense assignment with the assignment '
+                    'solver backends on whole problems and on connected '
+                    'components of feasible pairs of synthetic crowded '
+                    'frames, warm started from the previous frame')
+    parser.add_argument('--num_objects', type=int, nargs='+',
+                        default=[50, 100, 200, 500, 1000])
+    parser.add_argument('--density', type=float, default=60,
+                        help='Objects per 1920x1080 area')
+    parser.add_argument('--thresh', type=float, default=0.7)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--solvers', nargs='+',
+                        default=['scipy', 'lapjv', 'lapsolver', 'sparse',
+                                 'auction'])
+    return parser.parse_args()
+
+
+def make_frame(num_objects, density, thresh, rng):
+    """
+    Cost matrix of detections x tracks like after solve_hungarian with
+    nan_first: mix of IoU and appearance distance, pairs above the
+    threshold pushed by a large value
+    """
+    scale = np.sqrt(num_objects / density)
+    w, h = 1920 * scale, 1080 * scale
+    size = rng.uniform(20, 120, num_objects)
+    tracks = np.stack([rng.uniform(0, w, num_objects),
+                       rng.uniform(0, h, num_objects)], axis=1)
+    tracks = np.concatenate([tracks, tracks + size[:, None] *
+                             np.array([0.4, 1])], axis=1)
+
+    # detections: moved tracks, some missed, some new
+    keep = rng.uniform(size=num_objects) > 0.1
+    dets = tracks[keep] + rng.normal(0, 5, (keep.sum(), 1))
+    dets = np.concatenate([dets, tracks[~keep] + rng.uniform(-300, 300)])
+
+    # appearance: low distance to the same object, high to others
+    iou_dist = 1 - ious(dets, tracks)
+    app_dist = rng.uniform(0.4, 1.0, iou_dist.shape)
+    same = np.nonzero(keep)[0]
+    app_dist[np.arange(same.shape[0]), same] = rng.uniform(
+        0.05, 0.4, same.shape[0])
+    dist = 0.4 * app_dist + 0.6 * iou_dist
+    dist = np.where(dist <= thresh, dist, dist + 1e6)
+
+    return dist
+
+
+def accepted(dist, row, col, thresh):
+    keep = dist[row, col] < thresh
+    return keep.sum(), dist[row[keep], col[keep]].sum()
+
+
+def time_solve(fn, repeats):
+    t = time.perf_counter()
+    for _ in range(repeats):
+        res = fn()
+    return (time.perf_counter() - t) / repeats, res
+
+
+def main(args):
+    rng = np.random.RandomState(0)
+    for num_objects in args.num_objects:
+        # two consecutive frames with the same tracks
+        dist = make_frame(num_objects, args.density, args.thresh, rng)
+        next_dist = dist + rng.normal(0, 0.01, dist.shape)
+        feasible = dist < args.thresh
+        next_feasible = next_dist < args.thresh
+        col_ids = np.arange(dist.shape[1])
+
+        t_dense, (row, col) = time_solve(
+            lambda: solve_dense(next_dist), args.repeats)
+        num_dense, cost_dense = accepted(next_dist, row, col, args.thresh)
+
+        singles, blocks = feasible_components(next_feasible)
+        largest = max([r.shape[0] * c.shape[0] for r, c in blocks] + [1])
+        logger.info(f"{num_objects} objects: "
+                    f"{singles[0].shape[0] + len(blocks)} components "
+                    f"(largest {largest} entries), dense scipy "
+                    f"{1000 * t_dense:.3f} ms, {num_dense} matches")
+
+        for name in args.solvers:
+            try:
+                solver = get_solver(name)
+            except ImportError:
+                logger.info(f"    {name:10s} not installed")
+                continue
+
+            res = dict()
+            for decompose in [False, True]:
+                # solve previous frame first for warm start
+                min_decompose = 40000 if decompose else np.inf
+                solver.reset()
+                solve_decomposed(dist, feasible, solver, col_ids,
+                                 min_decompose=min_decompose)
+                t, (row, col) = time_solve(lambda: solve_decomposed(
+                    next_dist, next_feasible, solver, col_ids,
+                    min_decompose=min_decompose), args.repeats)
+                num, cost = accepted(next_dist, row, col, args.thresh)
+
+                # maximum number of feasible matches, at most the cost
+                # of the dense solution (auction is epsilon optimal)
+                assert num == num_dense, name
+                assert cost <= cost_dense + 1e-3, name
+                res[decompose] = (t, cost)
+
+            # whole problem without warm start
+            t_cold, _ = time_solve(lambda: (solver.reset(), solver.solve(
+                next_dist, next_feasible, col_ids))[1], args.repeats)
+
+            logger.info(f"    {name:10s} "
+                        f"whole {1000 * t_cold:8.3f} ms cold, "
+                        f"{1000 * res[False][0]:8.3f} ms warm, "
+                        f"decomposed {1000 * res[True][0]:8.3f} ms "
+                        f"({t_dense / res[True][0]:.1f}x), "
+                        f"cost {res[True][1]:.4f} (dense {cost_dense:.4f})")
+
+
+if __name__ == '__main__':
+    main(init_args())
@@ -0,0 +1,129 @@
+import argparse
+import logging
+import time
+import numpy as np
+import pandas as pd
+from src.datasets.detection_index import DetectionIndex
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Compare per frame detection lookup of the pandas '
+                    'boolean filtering path with the detection index')
+    parser.add_argument('--num_frames', type=int, default=2000)
+    parser.add_argument('--dets_per_frame', type=int, default=150)
+    parser.add_argument('--img_size', type=int, nargs=2, default=[1080, 1920])
+    parser.add_argument('--legacy_frames', type=int, default=200,
+                        help='Number of frames timed for the pandas path, '
+                             'extrapolated to the whole sequence')
+    return parser.parse_args()
+
+
+def make_dets(num_frames, dets_per_frame, img_size):
+    """
+    Generate a synthetic detection table with the columns of MOTLoader
+    """
+    rng = np.random.RandomState(0)
+    n = num_frames * dets_per_frame
+    h, w = img_size
+    dets = pd.DataFrame({
+        'frame': np.repeat(np.arange(1, num_frames + 1), dets_per_frame),
+        'id': -1,
+        'bb_left': rng.uniform(-20, w, n),
+        'bb_top': rng.uniform(-20, h, n),
+        'bb_width': rng.uniform(10, 100, n),
+        'bb_height': rng.uniform(20, 250, n),
+        'conf': rng.uniform(0, 1, n),
+        'label': 1,
+        'vis': -1})
+    dets['bb_right'] = dets['bb_left'] + dets['bb_width']
+    dets['bb_bot'] = dets['bb_top'] + dets['bb_height']
+    dets['frame_path'] = dets['frame'].apply(lambda i: f"{i:06d}.jpg")
+
+    dets_unclipped = dets.copy()
+    for col, m in [('bb_left', w), ('bb_right', w), ('bb_top', h),
+                   ('bb_bot', h)]:
+        dets[col] = np.clip(dets[col].values, 0, m).astype(int)
+    dets['detection_id'] = np.arange(n)
+
+    return dets, dets_unclipped
+
+
+def legacy_frame(dets, dets_unclipped, frame):
+    """
+    Per frame lookup as done before the detection index
+    """
+    dets_frame = dets[dets['frame'] == frame]
+    dets_uncl_frame = dets_unclipped[dets_unclipped['frame'] == frame]
+    assert len(dets_frame['frame_path'].unique()) == 1
+
+    boxes, ids, conf = list(), list(), list()
+    for ind, row in dets_frame.iterrows():
+        row_unclipped = dets_uncl_frame.loc[ind]
+        boxes.append(np.array([row_unclipped['bb_left'],
+                               row_unclipped['bb_top'],
+                               row_unclipped['bb_right'],
+                               row_unclipped['bb_bot']], dtype=np.float32))
+        ids.append(row['id'])
+        conf.append(row['conf'])
+    return boxes, ids, conf
+
+
+def index_frame(det_index, idx):
+    """
+    Per frame lookup using the detection index
+    """
+    rows = det_index.rows(idx)
+    boxes = det_index.boxes[rows]
+    return list(boxes[:, 4:].astype(np.float32)), \
+        det_index.ids[rows].tolist(), det_index.conf[rows].tolist()
+
+
+def main(args):
+    dets, dets_unclipped = make_dets(
+        args.num_frames, args.dets_per_frame, args.img_size)
+    logger.info(f"{args.num_frames} frames, {dets.shape[0]} detections")
+
+    # pandas boolean filtering + iterrows
+    frames = dets['frame'].unique()
+    num_legacy = min(args.legacy_frames, len(frames))
+    t = time.perf_counter()
+    for frame in frames[:num_legacy]:
+        legacy_frame(dets, dets_unclipped, frame)
+    t_legacy = (time.perf_counter() - t) / num_legacy
+
+    # detection index (build once + O(1) slicing)
+    t = time.perf_counter()
+    det_index = DetectionIndex(dets, dets_unclipped)
+    t_build = time.perf_counter() - t
+    t = time.perf_counter()
+    for idx in range(len(det_index)):
+        index_frame(det_index, idx)
+    t_index = (time.perf_counter() - t) / len(det_index)
+
+    # sanity check that both paths give the same detections
+    for idx in [0, len(frames) // 2, len(frames) - 1]:
+        b_l, i_l, c_l = legacy_frame(dets, dets_unclipped, frames[idx])
+        b_i, i_i, c_i = index_frame(det_index, idx)
+        assert np.allclose(np.stack(b_l), np.stack(b_i))
+        assert i_l == i_i and np.allclose(c_l, c_i)
+
+    logger.info(f"pandas path:     {1000 * t_legacy:.3f} ms / frame, "
+                f"{t_legacy * len(frames):.2f} s / sequence (extrapolated)")
+    logger.info(f"detection index: {1000 * t_index:.3f} ms / frame, "
+                f"{t_index * len(frames) + t_build:.2f} s / sequence "
+                f"(incl. {t_build:.2f} s build)")
+    logger.info(f"speed up per frame: {t_legacy / t_index:.1f}x")
+
+
+if __name__ == '__main__':
+    main(init_args())
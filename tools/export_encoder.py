@@ -0,0 +1,119 @@
+import argparse
+import copy
+import logging
+import os
+import os.path as osp
+import yaml
+import torch
+import torch.nn as nn
+from ReID import net
+from src.encoder_backend import EagerBackend, TorchScriptBackend, \
+    OnnxRuntimeBackend
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Export the ReID encoder of a tracker config (load_net '
+                    'checkpoint) to TorchScript and ONNX for the encoder '
+                    'backends and check numeric parity with the eager '
+                    'encoder')
+    parser.add_argument('--config_path', type=str,
+                        default='config/config_tracker.yaml')
+    parser.add_argument('--output_dir', type=str, default='exported_encoder')
+    parser.add_argument('--formats', nargs='+',
+                        default=['torchscript', 'onnxruntime'])
+    parser.add_argument('--batch_size', type=int, default=8,
+                        help='Batch size of the example input, the exported '
+                             'encoders take any batch size')
+    parser.add_argument('--tol', type=float, default=1e-4,
+                        help='Maximum absolute difference of the embeddings '
+                             'relative to their largest absolute value')
+    return parser.parse_args()
+
+
+class ExportEncoder(nn.Module):
+    """
+    Inference path of the encoder with the outputs of the exported
+    backends: fc7 and embeddings after the bottleneck (fc7 if there is no
+    bottleneck)
+    """
+    def __init__(self, model, channels_last):
+        super(ExportEncoder, self).__init__()
+        self.model = model.inference_model(channels_last=channels_last)
+        self.eval()
+
+    def forward(self, x):
+        fc7 = self.model.features(x)
+        if self.model.bottleneck is not None:
+            return fc7, self.model.bottleneck(fc7)
+        return fc7, fc7.clone()
+
+
+def export_torchscript(encoder, x, path):
+    model = torch.jit.trace(ExportEncoder(encoder, channels_last=True), x)
+    torch.jit.save(torch.jit.freeze(model), path)
+
+
+def export_onnx(encoder, x, path):
+    torch.onnx.export(
+        ExportEncoder(encoder, channels_last=False), x, path,
+        input_names=['crops'],
+        output_names=['fc7', 'feats_after'],
+        dynamic_axes={'crops': {0: 'batch'}, 'fc7': {0: 'batch'},
+                      'feats_after': {0: 'batch'}},
+        opset_version=17,
+        dynamo=False)
+
+
+def main(args):
+    with open(args.config_path, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    reid_net_cfg = config['reid_net']
+    encoder_params = copy.deepcopy(reid_net_cfg['encoder_params'])
+    if encoder_params['precision'] != 'fp32':
+        raise ValueError("Only fp32 encoders can be exported")
+    encoder, _, _ = net.load_net(
+        reid_net_cfg['trained_on']['num_classes'], **encoder_params)
+    encoder.eval()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    torch.manual_seed(0)
+    x = torch.randn(args.batch_size, 3, *config['dataset']['sz_crop'])
+    # other batch size to check dynamic batch dimension
+    x_check = torch.randn(args.batch_size + 3, *x.shape[1:])
+    eager = EagerBackend(lambda: encoder)
+
+    exporters = {
+        'torchscript': (export_torchscript, TorchScriptBackend, '.pt'),
+        'onnxruntime': (export_onnx, OnnxRuntimeBackend, '.onnx')}
+    for name in args.formats:
+        export, backend, ext = exporters[name]
+        path = osp.join(args.output_dir, 'encoder' + ext)
+        with torch.no_grad():
+            export(encoder, x, path)
+        logger.info(f"Exported {name} encoder to {path}")
+
+        try:
+            backend = backend(path)
+        except ImportError:
+            logger.info(f"    {name} not installed, parity not checked")
+            continue
+        for output in ['plain', 'norm', 'neck']:
+            ref = eager(x_check, output)
+            diff = ((backend(x_check, output) - ref).abs().max() /
+                    ref.abs().max()).item()
+            logger.info(f"    output {output}: max relative diff {diff:.2e}")
+            assert diff < args.tol, f"{name} differs from eager encoder"
+
+
+if __name__ == '__main__':
+    main(init_args())
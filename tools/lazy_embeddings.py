@@ -0,0 +1,83 @@
+import argparse
+import copy
+import logging
+import warnings
+import yaml
+import numpy as np
+import torch
+from src.manager import Manager
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+warnings.filterwarnings("ignore")
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Track the sequences of a tracker config with all '
+                    'embeddings and with lazy embeddings (only detections '
+                    'without an unambiguous motion match are encoded) and '
+                    'report the fraction of crops that were not encoded '
+                    'and the change of HOTA and IDF1 (TrackEval)')
+    parser.add_argument('--config_path', type=str,
+                        default='config/config_tracker.yaml')
+    parser.add_argument('--min_iou', type=float, default=None,
+                        help='Overrides lazy_embeddings min_iou of config')
+    parser.add_argument('--margin', type=float, default=None,
+                        help='Overrides lazy_embeddings margin of config')
+    parser.add_argument('--refresh', type=int, default=None,
+                        help='Overrides lazy_embeddings refresh of config')
+    return parser.parse_args()
+
+
+def summary(track_eval_res, experiment):
+    """
+    HOTA and IDF1 of every class over all sequences
+    """
+    res = next(iter(track_eval_res.values()))[experiment]['COMBINED_SEQ']
+    return {
+        cls: (np.mean(r['HOTA']['HOTA']), r['Identity']['IDF1'])
+        for cls, r in res.items() if 'HOTA' in r and 'Identity' in r}
+
+
+def main(args):
+    with open(args.config_path, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    # lazy embeddings can not be combined with stored features or cached
+    # embeddings, both runs compute the embeddings of the sequences
+    config['tracker']['store_feats'] = 0
+    config['reid_net']['embedding_cache']['do'] = 0
+    for k in ['min_iou', 'margin', 'refresh']:
+        if getattr(args, k) is not None:
+            config['tracker']['lazy_embeddings'][k] = getattr(args, k)
+
+    res = dict()
+    for lazy in [0, 1]:
+        cfg = copy.deepcopy(config)
+        cfg['tracker']['lazy_embeddings']['do'] = lazy
+        manager = Manager(
+            device, cfg['dataset'], cfg['reid_net'], cfg['tracker'], cfg)
+        manager._evaluate(log=False)
+        res[lazy] = summary(
+            manager.track_eval_res, manager.tracker.experiment)
+    manager.tracker.log_lazy_stats('all sequences', manager.tracker.lazy_stats)
+
+    for cls, (hota, idf1) in res[1].items():
+        hota_all, idf1_all = res[0][cls]
+        logger.info(
+            f"{cls}: HOTA {hota_all:.2%} -> {hota:.2%} "
+            f"({hota - hota_all:+.2%}), IDF1 {idf1_all:.2%} -> {idf1:.2%} "
+            f"({idf1 - idf1_all:+.2%})")
+
+
+if __name__ == '__main__':
+    main(init_args())
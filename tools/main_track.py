@@ -46,6 +46,8 @@ def init_args():
     parser.add_argument('--new_track_conf', type=float, default=0.6)
     parser.add_argument('--remove_unconfirmed', type=float, default=0)
     parser.add_argument('--last_n_frames', type=int, default=100000000)
+    parser.add_argument('--embedding_cache', type=int, default=0,
+                        help='Reuse ReID embeddings across runs')
     return parser.parse_args()
 
 
@@ -74,6 +76,7 @@ def main_track(args):
     config['tracker']['new_track_conf'] = args.new_track_conf
     config['tracker']['remove_unconfirmed'] = args.remove_unconfirmed
     config['tracker']['motion_config']['last_n_frames'] = args.last_n_frames
+    config['reid_net']['embedding_cache']['do'] = args.embedding_cache
     logger.info(config)
 
     manager = Manager(
@@ -0,0 +1,193 @@
+import argparse
+import copy
+import logging
+import os
+import time
+import yaml
+import numpy as np
+import torch
+from ReID import net
+from ReID.net.quantization import QuantizedResNet, save_quantized
+from ReID.data import ReIDDataset, load_data
+from ReID.evaluation import Evaluator
+from data.splits import _SPLITS
+from src.datasets.TrackingDataset import TrackingDataset
+
+logger = logging.getLogger('AllReIDTracker')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.DEBUG)
+formatter = logging.Formatter('%(message)s')
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+
+
+def init_args():
+    parser = argparse.ArgumentParser(
+        description='Post-training static INT8 quantization of the ReID '
+                    'encoder for CPU tracking. Calibrates on detection '
+                    'crops of the tracking sequences of the given configs '
+                    '(e.g., MOT17 and BDD), stores the quantized encoder '
+                    'and reports throughput and ReID mAP / rank-1 of the '
+                    'fp32 and the INT8 encoder.')
+    parser.add_argument('--config_paths', type=str, nargs='+',
+                        default=['config/config_tracker.yaml',
+                                 'config/config_tracker_bdd.yaml'],
+                        help='Tracking configs, the encoder is taken from '
+                             'the first one')
+    parser.add_argument('--output', type=str,
+                        default='quantized_encoder.pth')
+    parser.add_argument('--backend', type=str, default='x86',
+                        help='Quantized engine, e.g., x86, fbgemm, qnnpack')
+    parser.add_argument('--frames_per_seq', type=int, default=5,
+                        help='Evenly spaced frames per sequence used for '
+                             'calibration')
+    parser.add_argument('--max_crops', type=int, default=2048,
+                        help='Maximum number of calibration crops per config')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--reid_config_path', type=str,
+                        default='ReID/config/config_market.yaml',
+                        help='ReID config of the evaluation dataset, empty '
+                             'to skip the ReID evaluation')
+    parser.add_argument('--repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def calibration_crops(config, frames_per_seq, max_crops):
+    """
+    Detection crops of evenly spaced frames of all sequences of the test
+    split of config, preprocessed like while tracking
+    """
+    dataset_cfg = config['dataset']
+    split = _SPLITS[dataset_cfg['splits']]['test']
+    dataset = TrackingDataset(
+        dataset_cfg['splits'],
+        split['seq'],
+        dataset_cfg,
+        split['dir'],
+        net_type=config['reid_net']['encoder_params']['net_type'],
+        dev='cpu')
+
+    crops = list()
+    for seq in dataset.data:
+        seq.load_img_for_det = False
+        seq.set_filter(config['tracker']['det_conf'],
+                       config['tracker']['h_w_thresh'])
+        num = min(frames_per_seq, len(seq))
+        for idx in np.linspace(0, len(seq) - 1, num).astype(int):
+            img, _, dets, _, _ = seq._get(idx)
+            if len(dets):
+                crops.append(img)
+
+    crops = torch.cat(crops) if len(crops) else torch.zeros(0)
+    if crops.shape[0] > max_crops:
+        rng = np.random.RandomState(0)
+        crops = crops[torch.from_numpy(
+            np.sort(rng.choice(crops.shape[0], max_crops, replace=False)))]
+    return crops
+
+
+def crops_per_second(encoder, crops, batch_size, repeats):
+    x = crops[:batch_size]
+    with torch.no_grad():
+        encoder(x, output_option='plain')
+        t = time.perf_counter()
+        for _ in range(repeats):
+            encoder(x, output_option='plain')
+    return repeats * x.shape[0] / (time.perf_counter() - t)
+
+
+def reid_loader(reid_config_path):
+    """
+    Query and gallery loader of the ReID evaluation dataset (Market like)
+    """
+    with open(reid_config_path, 'r') as f:
+        dataset_cfg = yaml.load(f, Loader=yaml.FullLoader)['dataset']
+    root = dataset_cfg['dataset_path']
+    labels, paths = load_data(
+        root=root, add_distractors=dataset_cfg['add_distractors'])
+
+    def full_path(p):
+        return os.path.join(
+            root, 'images', '{:05d}'.format(int(p.split('_')[0])), p)
+    query = [full_path(q) for q in paths['query']]
+    gallery = [full_path(g) for g in paths['bounding_box_test']]
+
+    dataset = ReIDDataset(
+        root=root,
+        labels=labels['bounding_box_test'] + labels['query'],
+        paths=paths['bounding_box_test'] + paths['query'],
+        trans=dataset_cfg['trans'],
+        eval_reid=True,
+        sz_crop=dataset_cfg['sz_crop'])
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=50, shuffle=False,
+        num_workers=dataset_cfg['nb_workers'], drop_last=False)
+
+    return loader, query, gallery
+
+
+def main(args):
+    configs = list()
+    for config_path in args.config_paths:
+        with open(config_path, 'r') as f:
+            configs.append(yaml.load(f, Loader=yaml.FullLoader))
+
+    # fp32 encoder of first config
+    reid_net_cfg = configs[0]['reid_net']
+    encoder_params = copy.deepcopy(reid_net_cfg['encoder_params'])
+    encoder_params['precision'] = 'fp32'
+    encoder, _, _ = net.load_net(
+        reid_net_cfg['trained_on']['num_classes'], **encoder_params)
+    encoder.eval()
+
+    # calibration
+    quantized = QuantizedResNet(
+        encoder, backend=args.backend,
+        sz_crop=configs[0]['dataset']['sz_crop'])
+    all_crops = list()
+    for config_path, config in zip(args.config_paths, configs):
+        crops = calibration_crops(
+            config, args.frames_per_seq, args.max_crops)
+        logger.info(f"{crops.shape[0]} calibration crops of {config_path}")
+        for batch in torch.split(crops, args.batch_size):
+            quantized.calibrate(batch)
+        all_crops.append(crops)
+    quantized.convert()
+    save_quantized(quantized, args.output)
+    logger.info(f"Stored INT8 encoder in {args.output}")
+
+    # throughput and embedding similarity on tracking crops
+    crops = torch.cat(all_crops)
+    with torch.no_grad():
+        ref = encoder(crops[:args.batch_size], output_option='plain')[1]
+        res = quantized(crops[:args.batch_size], output_option='plain')[1]
+    cos = (ref * res).sum(dim=1)
+    speed = crops_per_second(encoder, crops, args.batch_size, args.repeats)
+    speed_int8 = crops_per_second(
+        quantized, crops, args.batch_size, args.repeats)
+    logger.info(f"fp32 {speed:.1f} crops / s, int8 {speed_int8:.1f} "
+                f"crops / s ({speed_int8 / speed:.2f}x), cosine similarity "
+                f"of embeddings mean {cos.mean():.4f}, min {cos.min():.4f}")
+
+    # ReID accuracy
+    if not args.reid_config_path:
+        return
+    loader, query, gallery = reid_loader(args.reid_config_path)
+    # Evaluator moves images to the GPU if available
+    if torch.cuda.is_available():
+        encoder = encoder.cuda()
+    evaluator = Evaluator(output_test_enc=reid_net_cfg['output'])
+    res = dict()
+    for name, model in [('fp32', encoder), ('int8', quantized)]:
+        mAP, cmc = evaluator.evaluate(model, loader, query, gallery)
+        res[name] = (mAP, cmc['Market'][0])
+        logger.info(f"{name}: mAP {mAP:.1%}, rank-1 {cmc['Market'][0]:.1%}")
+    logger.info(f"Change int8 - fp32: "
+                f"mAP {res['int8'][0] - res['fp32'][0]:+.1%}, "
+                f"rank-1 {res['int8'][1] - res['fp32'][1]:+.1%}")
+
+
+if __name__ == '__main__':
+    main(init_args())